@@ -1,3 +1,6 @@
+import datetime
+from typing import Optional
+
 from pydantic import BaseModel
 
 
@@ -14,3 +17,11 @@ class AccountInfo(BaseModel):
 
 class NoAuthAddress(BaseModel):
     address: str
+
+
+class HistoryQuery(BaseModel):
+    address: str
+    cursor: Optional[str] = None  # next_cursor of the previous page
+    limit: Optional[int] = None
+    since: Optional[datetime.datetime] = None  # Inclusive. Times without a timezone are KST, like the response.
+    until: Optional[datetime.datetime] = None  # Exclusive
@@ -0,0 +1,96 @@
+import os
+import time
+from collections import OrderedDict
+
+from tokens.metadata import token_cache
+
+SESSION_CACHE_SIZE = int(os.environ.get('SESSION_CACHE_SIZE', '10000'))
+
+SESSION_CACHE_TTL = float(os.environ.get('SESSION_CACHE_TTL', '60'))
+
+# Without the shared Redis, a worker only sees its own logins, so another worker would keep accepting a user's
+# previous token after that user logs in again. The in-process cache is therefore off unless the server runs a
+# single worker and sets SESSION_CACHE_LOCAL=1.
+SESSION_CACHE_LOCAL = os.environ.get('SESSION_CACHE_LOCAL', '0') == '1'
+
+
+class SessionCache:
+    """
+    Remembers the last verified login token of each user, so authenticated requests skip the passphrase query and
+    the signature check. Every login rotates the user's passphrase, so only one token per user can be valid and the
+    cache keeps one entry per uid. A hit requires the exact same token (same payload and signature) and honors `exp`.
+
+    Uses the TOKEN_CACHE_URL Redis, which deploys configure in app.yaml, so a login replaces the old token on every
+    worker. Without it the cache is off unless `local` is set: it never hits and every request queries the database.
+    """
+
+    def __init__(self, max_size: int, ttl: float, remote=None, local: bool = False):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.remote = remote
+        self.local = local
+
+    @staticmethod
+    def remote_key(uid: str) -> str:
+        return f'session:{uid}'
+
+    async def get(self, uid: str, token: str) -> bool:
+        """
+        :return: True if `token` was verified for `uid` before and has not expired or been replaced since.
+        """
+        if self.remote is not None:
+            try:
+                cached = await self.remote.get(self.remote_key(uid))
+            except Exception as e:
+                print(f'Session cache error: {e}')
+                return False
+
+            return cached is not None and cached.decode('utf-8') == token
+
+        if not self.local:
+            return False
+
+        entry = self.entries.get(uid)
+        if entry is None:
+            return False
+
+        cached_token, expires_at, _ = entry
+        if cached_token != token or expires_at < time.time():
+            return False
+
+        self.entries.move_to_end(uid)
+        return True
+
+    async def put(self, uid: str, token: str, exp: int, replace: bool = False) -> None:
+        """
+        Stores a verified token. Login passes replace=True to drop the user's previous token at once. Request
+        handlers never overwrite a newer token, so a request that verified the old token while a login was running
+        cannot restore it. A later login always has a later `exp`; Redis only lets login overwrite (SET NX otherwise).
+        """
+        now = time.time()
+        if exp <= now:
+            return
+
+        if self.remote is not None:
+            try:
+                await self.remote.set(self.remote_key(uid), token, ex=max(1, int(exp - now)), nx=not replace)
+            except Exception as e:
+                print(f'Session cache error: {e}')
+            return
+
+        if not self.local:
+            return
+
+        entry = self.entries.get(uid)
+        if entry is not None and not replace and entry[2] > exp:
+            return
+
+        self.entries[uid] = (token, min(exp, now + self.ttl), exp)
+        self.entries.move_to_end(uid)
+
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+
+session_cache = SessionCache(SESSION_CACHE_SIZE, SESSION_CACHE_TTL, token_cache.remote, SESSION_CACHE_LOCAL)
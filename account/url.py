@@ -1,38 +1,45 @@
+import base64
+import binascii
+import calendar
 import datetime
 import os
 import random
 import string
-import sys
 from typing import Optional
 
 import bcrypt
 import jwt
 from fastapi import APIRouter, Depends, Header
 from fastapi.responses import JSONResponse
-from sqlalchemy.orm import Session
-from web3 import Web3, HTTPProvider
-from web3.middleware import geth_poa_middleware
+from sqlalchemy import and_, or_, select, union_all
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased
+from web3 import Web3
 
-from account.DataClass import LoginInfo, AccountInfo, NoAuthAddress
+from account.DataClass import LoginInfo, AccountInfo, HistoryQuery
+from account.session import session_cache
 from database import DB, models
+from node.chain import w3
+from node.signer import new_account
+from node.executor import run_blocking
 from node.url import validate_login_token, invalid_login_token_exception, address_invalid_exception, \
     user_doesnt_own_wallet_exception
+from tokens.keys import key_manager
 
 account_router = APIRouter()
 
-server_address_env = os.environ.get('SERVER_ADDRESS')
-public_key_env = os.environ.get('PUBLIC_KEY')
+# PUBLIC_KEY matches PRIVATE_KEY. Once SIGNING_KEYS is set, clients get the key that currently signs.
+public_key_env = key_manager.active.public_key if os.environ.get('SIGNING_KEYS') else os.environ.get('PUBLIC_KEY')
 
-if server_address_env is None:
-    print('Server Address Environment Variable Missing!!')
-    sys.exit(1)
+KST = datetime.timedelta(hours=9)
 
-w3 = Web3(HTTPProvider(server_address_env))
-w3.middleware_onion.inject(geth_poa_middleware, layer=0)
+# /account/history page size when the request has no limit, and the largest limit accepted
+HISTORY_PAGE_SIZE = int(os.environ.get('HISTORY_PAGE_SIZE', '100'))
+HISTORY_MAX_PAGE_SIZE = int(os.environ.get('HISTORY_MAX_PAGE_SIZE', '1000'))
 
 
 @account_router.post("/create")
-async def create_account(account_info: AccountInfo, db: Session = Depends(DB.get_db)) -> JSONResponse:
+async def create_account(account_info: AccountInfo, db: AsyncSession = Depends(DB.get_db)) -> JSONResponse:
     """
     :return: JSONResponse with proper status code.
     """
@@ -40,25 +47,25 @@ async def create_account(account_info: AccountInfo, db: Session = Depends(DB.get
     account_pw = account_info.password
     account_wallet_pw = account_info.wallet_password
 
-    if db.query(models.User).filter(models.User.user_id == account_id).all():
+    if (await db.scalars(select(models.User).filter(models.User.user_id == account_id))).all():
         return JSONResponse(
             status_code=200,
             content={"error": "Same ID already exists!"}
         )
     else:
         try:
-            wallet_address = w3.geth.personal.new_account(account_wallet_pw)
+            wallet_address = Web3.toChecksumAddress(await new_account(w3, account_wallet_pw))
         except Exception:
             return JSONResponse(
                 status_code=503,
                 content={"error": "Error occured while creating your wallet! Please try again."}
             )
-        account_pw_encrypted = bcrypt.hashpw(account_pw.encode('utf-8'), bcrypt.gensalt())
+        account_pw_encrypted = await run_blocking(bcrypt.hashpw, account_pw.encode('utf-8'), bcrypt.gensalt())
 
         user = models.User(user_id=account_id, user_pw_encrypted=account_pw_encrypted, user_wallet=wallet_address,
                            user_type="customer")
         db.add(user)
-        db.commit()
+        await db.commit()
 
         return JSONResponse(
             status_code=200,
@@ -67,7 +74,7 @@ async def create_account(account_info: AccountInfo, db: Session = Depends(DB.get
 
 
 @account_router.post("/login")
-async def login(login_info: LoginInfo, db: Session = Depends(DB.get_db)) -> JSONResponse:
+async def login(login_info: LoginInfo, db: AsyncSession = Depends(DB.get_db)) -> JSONResponse:
     """
     :param db: Database session
     :param login_info: ID and Password in JSON format.
@@ -76,21 +83,25 @@ async def login(login_info: LoginInfo, db: Session = Depends(DB.get_db)) -> JSON
     login_id = login_info.user_id
     login_pw = login_info.password
 
-    selected_row = db.query(models.User).filter(models.User.user_id == login_id).first()
+    selected_row = (await db.scalars(select(models.User).filter(models.User.user_id == login_id))).first()
 
     if selected_row:
         user_pw_encrypted = selected_row.user_pw_encrypted
-        if bcrypt.checkpw(login_pw.encode('utf-8'), user_pw_encrypted.encode('utf-8')):
+        if await run_blocking(bcrypt.checkpw, login_pw.encode('utf-8'), user_pw_encrypted.encode('utf-8')):
             passphrase = ''.join(random.choice(string.ascii_letters + string.digits) for i in range(12))
+            expiration = datetime.datetime.utcnow() + datetime.timedelta(days=7)
             encoded_jwt = jwt.encode(
                 {
-                    "exp": datetime.datetime.utcnow() + datetime.timedelta(days=7),
+                    "exp": expiration,
                     "uid": login_id
                 }, passphrase, algorithm="HS256"
             )
-            user = db.query(models.User).filter(models.User.user_id == login_id).first()
+            user = (await db.scalars(select(models.User).filter(models.User.user_id == login_id))).first()
             user.passphrase = passphrase
-            db.commit()
+            await db.commit()
+
+            # The new passphrase invalidates the previous token, so replace it in the session cache right away
+            await session_cache.put(login_id, encoded_jwt, calendar.timegm(expiration.utctimetuple()), replace=True)
 
             return JSONResponse(
                 status_code=200,
@@ -109,8 +120,9 @@ async def login(login_info: LoginInfo, db: Session = Depends(DB.get_db)) -> JSON
 
 
 @account_router.get("/get_info")
-async def get_user_info(x_access_token: Optional[str] = Header(None), db: Session = Depends(DB.get_db)) -> JSONResponse:
-    validity = validate_login_token(x_access_token)
+async def get_user_info(x_access_token: Optional[str] = Header(None),
+                        db: AsyncSession = Depends(DB.get_db)) -> JSONResponse:
+    validity = await validate_login_token(x_access_token)
 
     if validity.get('result', 'invalid') == 'invalid':
         return invalid_login_token_exception()
@@ -118,7 +130,7 @@ async def get_user_info(x_access_token: Optional[str] = Header(None), db: Sessio
     extracted = jwt.decode(x_access_token, algorithms='HS256', options={'verify_signature': False,
                                                                         'require': ['exp', 'uid']})
 
-    token_user = db.query(models.User).filter(models.User.user_id == extracted['uid']).first()
+    token_user = (await db.scalars(select(models.User).filter(models.User.user_id == extracted['uid']))).first()
     token_user_type = token_user.user_type
     token_wallet = token_user.user_wallet
 
@@ -133,11 +145,75 @@ async def get_user_info(x_access_token: Optional[str] = Header(None), db: Sessio
     )
 
 
+def invalid_history_query_exception() -> JSONResponse:
+    return JSONResponse(
+        status_code=400,
+        content={'error': 'History query parameter is not valid!'}
+    )
+
+
+def encode_history_cursor(history: models.History) -> str:
+    raw = f'{history.event_time.isoformat()}|{history.history_id}'
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('utf-8')
+
+
+def decode_history_cursor(cursor: str) -> tuple:
+    """
+    :return: (event_time, history_id) of the last row of the previous page. Raises ValueError if malformed.
+    """
+    try:
+        event_time, history_id = base64.urlsafe_b64decode(cursor.encode('utf-8')).decode('utf-8').split('|')
+    except (binascii.Error, UnicodeDecodeError) as e:
+        raise ValueError(e)
+
+    return datetime.datetime.fromisoformat(event_time), int(history_id)
+
+
+def to_utc(moment: datetime.datetime) -> datetime.datetime:
+    # event_time is stored as naive UTC
+    if moment.tzinfo is None:
+        return moment - KST
+    return moment.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+
+
+def history_page_query(address: str, after: tuple, since: datetime.datetime, until: datetime.datetime, limit: int):
+    """
+    One statement returning the next `limit` History rows sent from or to `address`, ordered by
+    (event_time, history_id). Each UNION branch walks its own (token_from|token_to, event_time) index and stops after
+    `limit` rows, so the cost of a page does not depend on how long the wallet's history is.
+    """
+    def branch(*conditions):
+        query = select(models.History).filter(*conditions)
+        if after is not None:
+            query = query.filter(or_(models.History.event_time > after[0],
+                                     and_(models.History.event_time == after[0],
+                                          models.History.history_id > after[1])))
+        if since is not None:
+            query = query.filter(models.History.event_time >= since)
+        if until is not None:
+            query = query.filter(models.History.event_time < until)
+
+        return select(query.order_by(models.History.event_time, models.History.history_id).limit(limit).subquery())
+
+    # A transfer to oneself matches both directions, but is returned once
+    merged = union_all(branch(models.History.token_from == address),
+                       branch(models.History.token_to == address,
+                              or_(models.History.token_from.is_(None), models.History.token_from != address))) \
+        .subquery()
+    history = aliased(models.History, merged)
+
+    return select(history).order_by(history.event_time, history.history_id).limit(limit)
+
+
 @account_router.post("/history")
-async def get_user_history(account: NoAuthAddress, x_access_token: Optional[str] = Header(None),
-                           db: Session = Depends(DB.get_db)) -> JSONResponse:
+async def get_user_history(account: HistoryQuery, x_access_token: Optional[str] = Header(None),
+                           db: AsyncSession = Depends(DB.get_db)) -> JSONResponse:
+    """
+    Wallet history oldest first, one page per request. Pass `next_cursor` back as `cursor` for the next page; it is
+    null on the last page.
+    """
     # Check login token validity
-    token_validity = validate_login_token(x_access_token)
+    token_validity = await validate_login_token(x_access_token)
 
     if token_validity.get('result', 'invalid') == 'invalid':
         return invalid_login_token_exception()
@@ -147,8 +223,20 @@ async def get_user_history(account: NoAuthAddress, x_access_token: Optional[str]
     except ValueError:
         return address_invalid_exception()
 
+    limit = account.limit if account.limit is not None else HISTORY_PAGE_SIZE
+    if not 0 < limit <= HISTORY_MAX_PAGE_SIZE:
+        return invalid_history_query_exception()
+
+    try:
+        after = decode_history_cursor(account.cursor) if account.cursor else None
+    except ValueError:
+        return invalid_history_query_exception()
+
+    since = to_utc(account.since) if account.since else None
+    until = to_utc(account.until) if account.until else None
+
     # Check if user owns the wallet
-    wallet_user = db.query(models.User).filter(models.User.user_wallet == address).first()
+    wallet_user = (await db.scalars(select(models.User).filter(models.User.user_wallet == address))).first()
 
     if not wallet_user:
         return user_doesnt_own_wallet_exception()
@@ -157,30 +245,27 @@ async def get_user_history(account: NoAuthAddress, x_access_token: Optional[str]
     if wallet_user_id != token_validity['token']['uid']:
         return user_doesnt_own_wallet_exception()
 
-    # Get transaction history
-    tx_history = []
-
-    from_history = db.query(models.History).filter(models.History.token_from == address).all()
-    to_history = db.query(models.History).filter(models.History.token_to == address).all()
+    # Get transaction history. One extra row tells whether another page follows.
+    histories = (await db.scalars(history_page_query(address, after, since, until, limit + 1))).all()
 
-    histories = from_history + to_history
-    histories.sort(key=lambda x: x.event_time)
+    next_cursor = None
+    if len(histories) > limit:
+        histories = histories[:limit]
+        next_cursor = encode_history_cursor(histories[-1])
 
-    if not histories:
-        histories = []
-
-    KST = datetime.timedelta(hours=9)
+    tx_history = []
     for history in histories:
         tx_history.append(
             {
                 "token_id": history.token_id,
                 "token_from": history.token_from,
                 "token_to": history.token_to,
-                "event_time": (history.event_time + KST).strftime('%Y/%m/%d %H:%M:%S')
+                "event_time": (history.event_time + KST).strftime('%Y/%m/%d %H:%M:%S'),
+                "status": history.tx_status or models.TX_CONFIRMED
             }
         )
 
     return JSONResponse(
         status_code=200,
-        content={'result': tx_history}
+        content={'result': tx_history, 'next_cursor': next_cursor}
     )
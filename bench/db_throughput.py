@@ -0,0 +1,112 @@
+"""
+Compares request throughput of the blocking session (SessionLocal in a threadpool, like `def` handlers) against the
+async session (AsyncSessionLocal on one event loop, like `async def` handlers) on the same queries.
+
+Runs against DATABASE_URL, defaulting to a local SQLite file. For a MySQL stand-in, point DATABASE_URL at a scratch
+schema that already has the tables (the models omit VARCHAR lengths, so create_all only works on SQLite).
+
+    pip install aiosqlite
+    python -m bench.db_throughput --requests 2000 --concurrency 40
+    DATABASE_URL=mysql+pymysql://user:pw@127.0.0.1:3306/scratch python -m bench.db_throughput --no-seed
+"""
+import argparse
+import asyncio
+import datetime
+import os
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+os.environ.setdefault('DATABASE_URL', 'sqlite:///./bench.db')
+
+from sqlalchemy import delete, select  # noqa: E402
+
+from database import DB, models  # noqa: E402
+
+TABLES = [models.Token.__table__, models.History.__table__]
+
+
+def seed(num_tokens: int) -> None:
+    if DB.engine.url.get_backend_name() == 'sqlite':
+        models.Base.metadata.create_all(bind=DB.engine, tables=TABLES)
+
+    now = datetime.datetime.utcnow()
+    with DB.SessionLocal() as db:
+        db.execute(delete(models.History))
+        db.execute(delete(models.Token))
+        for token_id in range(num_tokens):
+            db.add(models.Token(token_id=token_id, brand='bench', product_name=f'product {token_id}',
+                                production_date=now.date(), expiration_date=now.date(), details='bench'))
+            db.add(models.History(token_id=token_id, token_from=None, token_to='0x' + '0' * 40, event_time=now))
+            db.add(models.History(token_id=token_id, token_from='0x' + '0' * 40, token_to='0x' + '1' * 40,
+                                  event_time=now))
+        db.commit()
+
+
+def sync_request(token_id: int) -> float:
+    start = time.perf_counter()
+    with DB.SessionLocal() as db:
+        db.get(models.Token, token_id)
+        db.scalars(select(models.History).filter(models.History.token_id == token_id)
+                   .order_by(models.History.history_id)).all()
+    return time.perf_counter() - start
+
+
+async def async_request(token_id: int) -> float:
+    start = time.perf_counter()
+    async with DB.AsyncSessionLocal() as db:
+        await db.get(models.Token, token_id)
+        (await db.scalars(select(models.History).filter(models.History.token_id == token_id)
+                          .order_by(models.History.history_id))).all()
+    return time.perf_counter() - start
+
+
+def run_sync(token_ids: list, concurrency: int) -> tuple:
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        latencies = list(pool.map(sync_request, token_ids))
+    return time.perf_counter() - start, latencies
+
+
+async def run_async(token_ids: list, concurrency: int) -> tuple:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def limited(token_id: int) -> float:
+        async with semaphore:
+            return await async_request(token_id)
+
+    start = time.perf_counter()
+    latencies = await asyncio.gather(*[limited(token_id) for token_id in token_ids])
+    elapsed = time.perf_counter() - start
+
+    await DB.async_engine.dispose()
+    return elapsed, latencies
+
+
+def report(mode: str, elapsed: float, latencies: list) -> None:
+    latencies = sorted(latencies)
+    p99 = latencies[int(len(latencies) * 0.99) - 1]
+    print(f'{mode:>5}: {len(latencies) / elapsed:8.1f} req/s  '
+          f'p50 {statistics.median(latencies) * 1000:7.2f} ms  p99 {p99 * 1000:7.2f} ms')
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=40, help='threadpool size / in-flight coroutines')
+    parser.add_argument('--tokens', type=int, default=500)
+    parser.add_argument('--no-seed', action='store_true', help='reuse the rows already in the database')
+    args = parser.parse_args()
+
+    if not args.no_seed:
+        seed(args.tokens)
+
+    token_ids = [n % args.tokens for n in range(args.requests)]
+
+    print(f'{DB.engine.url.get_backend_name()}: {args.requests} requests, concurrency {args.concurrency}')
+    report('sync', *run_sync(token_ids, args.concurrency))
+    report('async', *asyncio.run(run_async(token_ids, args.concurrency)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+"""
+Compares the chain side of /node/mint before and after reading the token id from the receipt:
+
+    legacy:  safeMint, get_transaction, getMaxTokenID().transact, getMaxTokenID().call
+    receipt: safeMint, then poll eth_getTransactionReceipt and decode the Transfer log
+
+Mints real tokens, so point it at a dev chain (e.g. `geth --dev`) with an unlocked account that holds MINTER_ROLE.
+
+    SERVER_ADDRESS=http://127.0.0.1:8545 CONTRACT_ADDRESS=0x... python -m bench.mint --minter 0x... --mints 50
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import time
+
+from web3 import Web3
+from web3.logs import DISCARD
+
+from node.async_contract import AsyncContract, async_web3, wait_for_receipt
+
+ZERO_ADDRESS = '0x0000000000000000000000000000000000000000'
+
+
+def count_requests(w3: Web3) -> dict:
+    counter = {'requests': 0}
+    coro_request = w3.manager.coro_request
+
+    async def counted(*args, **kwargs):
+        counter['requests'] += 1
+        return await coro_request(*args, **kwargs)
+
+    w3.manager.coro_request = counted
+    return counter
+
+
+async def legacy_mint(w3: Web3, contract_instance, minter: str) -> tuple:
+    tx_hash = await contract_instance.functions.safeMint(minter).transact({'from': minter})
+    await w3.eth.get_transaction(tx_hash)
+
+    sync_tid = contract_instance.functions.getMaxTokenID()
+    sync_hash = await sync_tid.transact({'from': minter})
+
+    return await sync_tid.call(), [tx_hash, sync_hash]
+
+
+async def receipt_mint(w3: Web3, contract_instance, minter: str) -> tuple:
+    tx_hash = await contract_instance.functions.safeMint(minter).transact({'from': minter})
+    receipt = await wait_for_receipt(w3, tx_hash)
+
+    events = contract_instance.events.Transfer().processReceipt(receipt, errors=DISCARD)
+    token_ids = [event['args']['tokenId'] for event in events if event['args']['from'] == ZERO_ADDRESS]
+    return token_ids[0], [tx_hash]
+
+
+async def run(mode: str, w3: Web3, contract_instance, minter: str, mints: int, concurrency: int) -> None:
+    mint = legacy_mint if mode == 'legacy' else receipt_mint
+    counter = count_requests(w3)
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    tx_hashes = []
+    token_ids = []
+
+    async def one() -> None:
+        async with semaphore:
+            started = time.perf_counter()
+            token_id, hashes = await mint(w3, contract_instance, minter)
+            latencies.append(time.perf_counter() - started)
+            tx_hashes.extend(hashes)
+            token_ids.append(token_id)
+
+    started = time.perf_counter()
+    await asyncio.gather(*[one() for _ in range(mints)])
+    elapsed = time.perf_counter() - started
+    requests = counter['requests']
+
+    gas = 0
+    for tx_hash in tx_hashes:
+        gas += (await wait_for_receipt(w3, tx_hash))['gasUsed']
+
+    latencies.sort()
+    print(f'{mode}: {mints / elapsed:.1f} mints/s, p50 {statistics.median(latencies) * 1000:.1f} ms, '
+          f'p95 {latencies[int(len(latencies) * 0.95)] * 1000:.1f} ms, {requests / mints:.1f} RPC requests '
+          f'and {gas // mints} gas per mint, {mints - len(set(token_ids))} duplicate token ids')
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--minter', required=True, help='unlocked account with MINTER_ROLE')
+    parser.add_argument('--mints', type=int, default=50)
+    parser.add_argument('--concurrency', type=int, default=1)
+    args = parser.parse_args()
+
+    abi = json.load(open('./contract/GuaranteeToken.json'))['abi']
+    minter = Web3.toChecksumAddress(args.minter)
+    loop = asyncio.get_event_loop()
+
+    for mode in ('legacy', 'receipt'):
+        w3 = async_web3(os.environ['SERVER_ADDRESS'])
+        contract_instance = AsyncContract(w3, abi, Web3.toChecksumAddress(os.environ['CONTRACT_ADDRESS']))
+        loop.run_until_complete(run(mode, w3, contract_instance, minter, args.mints, args.concurrency))
+
+
+if __name__ == '__main__':
+    main()
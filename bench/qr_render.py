@@ -0,0 +1,91 @@
+"""
+Measures QR rendering per output format, and how much it stalls the event loop when run on the loop, in the thread
+executor (the old create_qr path) or in the process pool.
+
+    python -m bench.qr_render --requests 200 --concurrency 16
+"""
+import argparse
+import asyncio
+import base64
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from tokens.qr import JSON, PNG, SVG, QrRenderer, render, to_data_url
+
+# Same length as an RS256 ownership JWT
+SAMPLE_JWT = 'eyJ0eXAiOiJKV1QiLCJhbGciOiJSUzI1NiJ9.' + 'x' * 120 + '.' + base64.urlsafe_b64encode(bytes(256)).decode()
+
+
+async def heartbeat(stop: asyncio.Event, lags: list) -> None:
+    # A 1 ms tick; anything above that is time the loop could not serve other requests
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(0.001)
+        lags.append(time.perf_counter() - started - 0.001)
+
+
+async def run(mode: str, requests: int, concurrency: int, workers: int) -> tuple:
+    threads = ThreadPoolExecutor(max_workers=workers)
+    renderer = QrRenderer(workers, requests, requests)
+    semaphore = asyncio.Semaphore(concurrency)
+    loop = asyncio.get_event_loop()
+    latencies = []
+
+    async def one() -> None:
+        async with semaphore:
+            started = time.perf_counter()
+            if mode == 'loop':
+                render(SAMPLE_JWT, PNG)
+            elif mode == 'threads':
+                await loop.run_in_executor(threads, render, SAMPLE_JWT, PNG)
+            else:
+                await renderer.render(SAMPLE_JWT, PNG)
+            latencies.append(time.perf_counter() - started)
+
+    if mode == 'processes':
+        # Start the pool processes before measuring
+        await asyncio.gather(*[renderer.render(SAMPLE_JWT, PNG) for _ in range(workers)])
+
+    stop = asyncio.Event()
+    lags = []
+    ticker = asyncio.ensure_future(heartbeat(stop, lags))
+
+    started = time.perf_counter()
+    await asyncio.gather(*[one() for _ in range(requests)])
+    elapsed = time.perf_counter() - started
+
+    stop.set()
+    await ticker
+    threads.shutdown()
+    renderer.shutdown()
+
+    return elapsed, latencies, lags
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--workers', type=int, default=2, help='threads or processes rendering in parallel')
+    args = parser.parse_args()
+
+    print('== output formats ==')
+    for output in (PNG, SVG, JSON):
+        image, cpu = render(SAMPLE_JWT, output)
+        size = len(to_data_url(image)) if output == JSON else len(image)
+        print(f'{output}: {size} bytes, {cpu * 1000:.2f} ms CPU')
+
+    print(f'\n== {args.requests} PNG renders, concurrency {args.concurrency}, {args.workers} workers ==')
+    for mode in ('loop', 'threads', 'processes'):
+        elapsed, latencies, lags = asyncio.get_event_loop().run_until_complete(
+            run(mode, args.requests, args.concurrency, args.workers))
+        latencies.sort()
+        print(f'{mode}: {args.requests / elapsed:.1f} renders/s, '
+              f'p50 {statistics.median(latencies) * 1000:.1f} ms, '
+              f'p95 {latencies[int(len(latencies) * 0.95)] * 1000:.1f} ms, '
+              f'loop stall max {max(lags, default=0) * 1000:.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
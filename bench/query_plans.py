@@ -0,0 +1,113 @@
+"""
+Shows the query plans and timings of the hot History/User lookups without and with the migration 2 indexes.
+
+Runs against DATABASE_URL, defaulting to a local SQLite file that is seeded with synthetic rows. The schema stays at
+the latest version; the script only drops the lookup indexes and creates them again, so only point it at a scratch
+database, never at production.
+
+    python -m bench.query_plans --rows 200000
+    DATABASE_URL=mysql+pymysql://user:pw@127.0.0.1:3306/scratch python -m bench.query_plans --no-seed
+"""
+import argparse
+import datetime
+import os
+import time
+
+os.environ.setdefault('DATABASE_URL', 'sqlite:///./bench.db')
+
+from sqlalchemy import delete, select, text  # noqa: E402
+
+from database import DB, migrate, models  # noqa: E402
+from database.migrations import v002_lookup_indexes  # noqa: E402
+
+WALLETS = 1000
+
+# Migration 5's unique (token_id, prev_hash) index also serves lookups by token_id, so it is dropped with them
+CHAIN_LINK_INDEX = ('History', 'uq_history_token_id_prev_hash', ['token_id', 'prev_hash'])
+
+
+def wallet(n: int) -> str:
+    return '0x' + format(n, '040x')
+
+
+def seed(rows: int) -> None:
+    if DB.engine.url.get_backend_name() == 'sqlite':
+        models.Base.metadata.create_all(bind=DB.engine, tables=[models.User.__table__, models.History.__table__])
+
+    start = datetime.datetime(2022, 1, 1)
+    with DB.engine.begin() as conn:
+        conn.execute(delete(models.History))
+        conn.execute(delete(models.User))
+        conn.execute(models.User.__table__.insert(), [
+            {'user_id': f'user{n}', 'user_pw_encrypted': '-', 'user_wallet': wallet(n), 'user_type': 'customer'}
+            for n in range(WALLETS)])
+        conn.execute(models.History.__table__.insert(), [
+            {'token_id': n // 4, 'token_from': wallet(n % WALLETS), 'token_to': wallet((n * 7 + 1) % WALLETS),
+             'event_time': start + datetime.timedelta(seconds=n)}
+            for n in range(rows)])
+
+
+def hot_queries(rows: int) -> list:
+    address = wallet(WALLETS // 2)
+    return [
+        ('History by token_id', select(models.History)
+         .filter(models.History.token_id == rows // 8).order_by(models.History.history_id)),
+        ('History by token_from', select(models.History)
+         .filter(models.History.token_from == address).order_by(models.History.event_time)),
+        ('History by token_to', select(models.History)
+         .filter(models.History.token_to == address).order_by(models.History.event_time)),
+        ('User by user_wallet', select(models.User).filter(models.User.user_wallet == address)),
+    ]
+
+
+def explain(conn, statement) -> list:
+    sql = str(statement.compile(dialect=conn.dialect, compile_kwargs={'literal_binds': True}))
+    prefix = 'EXPLAIN QUERY PLAN ' if conn.dialect.name == 'sqlite' else 'EXPLAIN '
+    return [' | '.join(str(value) for value in row) for row in conn.execute(text(prefix + sql))]
+
+
+def measure(conn, statement, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        conn.execute(statement).fetchall()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def report(title: str, queries: list, repeat: int) -> None:
+    print(f'\n== {title} ==')
+    with DB.engine.connect() as conn:
+        for name, statement in queries:
+            print(f'{name}: {measure(conn, statement, repeat):.3f} ms')
+            for line in explain(conn, statement):
+                print(f'    {line}')
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=200000, help='History rows to seed')
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--no-seed', action='store_true', help='reuse the rows already in the database')
+    args = parser.parse_args()
+
+    if not args.no_seed:
+        seed(args.rows)
+
+    queries = hot_queries(args.rows)
+
+    # The ORM selects need every column, so the schema is brought to the latest version and kept there
+    migrate.upgrade(DB.engine)
+
+    table, name, columns = CHAIN_LINK_INDEX
+    with DB.engine.begin() as conn:
+        v002_lookup_indexes.downgrade(conn)
+        migrate.drop_index(conn, table, name)
+    report('without lookup indexes', queries, args.repeat)
+
+    with DB.engine.begin() as conn:
+        v002_lookup_indexes.upgrade(conn)
+        migrate.add_index(conn, table, name, columns, unique=True)
+    report('with lookup indexes (latest schema version)', queries, args.repeat)
+
+
+if __name__ == '__main__':
+    main()
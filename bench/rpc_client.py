@@ -0,0 +1,70 @@
+"""
+Read latency of web3's AsyncHTTPProvider, which opens a new connection for every request, against the pooled
+keep-alive provider of node/rpc.py, sequentially and with --concurrency requests in flight.
+
+    SERVER_ADDRESS=http://127.0.0.1:8545 python -m bench.rpc_client --requests 500 --concurrency 32
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import time
+
+from web3 import Web3
+from web3.eth import AsyncEth
+from web3.providers.async_rpc import AsyncHTTPProvider
+
+from node.async_contract import async_web3
+from node.rpc import rpc_stats
+
+
+async def run(mode: str, w3: Web3, requests: int, concurrency: int) -> None:
+    await w3.eth.block_number  # warm up (and open the pool)
+
+    sequential = []
+    for _ in range(requests):
+        started = time.perf_counter()
+        await w3.eth.block_number
+        sequential.append(time.perf_counter() - started)
+
+    semaphore = asyncio.Semaphore(concurrency)
+    errors = []
+
+    async def one() -> None:
+        async with semaphore:
+            try:
+                await w3.eth.block_number
+            except Exception as e:
+                errors.append(e)
+
+    started = time.perf_counter()
+    await asyncio.gather(*[one() for _ in range(requests)])
+    elapsed = time.perf_counter() - started
+
+    sequential.sort()
+    print(f'{mode}: sequential p50 {statistics.median(sequential) * 1000:.2f} ms, '
+          f'p95 {sequential[int(len(sequential) * 0.95)] * 1000:.2f} ms; '
+          f'{concurrency} concurrent {requests / elapsed:.0f} req/s, {len(errors)} failed')
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, default=32)
+    args = parser.parse_args()
+
+    endpoint = os.environ['SERVER_ADDRESS']
+    loop = asyncio.get_event_loop()
+
+    web3_default = Web3(AsyncHTTPProvider(endpoint), modules={'eth': (AsyncEth,)}, middlewares=[])
+    loop.run_until_complete(run('new connection per request', web3_default, args.requests, args.concurrency))
+
+    pooled = async_web3(endpoint)
+    loop.run_until_complete(run('keep-alive pool', pooled, args.requests, args.concurrency))
+    loop.run_until_complete(pooled.provider.close())
+
+    print(f"pooled eth_blockNumber: {rpc_stats.stats()['eth_blockNumber']}")
+
+
+if __name__ == '__main__':
+    main()
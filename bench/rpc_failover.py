@@ -0,0 +1,152 @@
+"""
+Read balancing, write failover and ejection of the multi-node provider of node/rpc.py, against stand-in JSON-RPC
+nodes with different latencies started in this process.
+
+    python -m bench.rpc_failover --nodes 3 --latencies 2,5,10 --requests 600
+"""
+import argparse
+import asyncio
+import time
+from collections import Counter
+
+from aiohttp import web
+
+from node import rpc
+from node.async_contract import async_web3
+
+HOST = '127.0.0.1'
+
+
+class StandInNode:
+    """
+    Answers the JSON-RPC methods the server uses with fixed values after `latency` seconds, and counts them.
+    """
+
+    def __init__(self, port: int, latency: float):
+        self.port = port
+        self.latency = latency
+        self.calls = Counter()
+        self.runner = None
+
+    @property
+    def uri(self) -> str:
+        return f'http://{HOST}:{self.port}'
+
+    def answer(self, request: dict) -> dict:
+        method = request['method']
+        self.calls[method] += 1
+
+        if method == 'eth_getBlockByNumber':
+            result = {'number': '0x10', 'timestamp': hex(int(time.time()))}
+        elif method == 'eth_syncing':
+            result = False
+        elif method in ('eth_sendRawTransaction', 'eth_sendTransaction'):
+            result = '0x' + '11' * 32
+        elif method == 'eth_call':
+            result = '0x' + '00' * 31 + '01'
+        else:
+            result = '0x10'
+
+        return {'jsonrpc': '2.0', 'id': request.get('id'), 'result': result}
+
+    async def handle(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        await asyncio.sleep(self.latency)
+
+        if isinstance(body, list):
+            return web.json_response([self.answer(item) for item in body])
+        return web.json_response(self.answer(body))
+
+    async def start(self) -> None:
+        app = web.Application()
+        app.router.add_post('/', self.handle)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, HOST, self.port).start()
+
+    async def stop(self) -> None:
+        await self.runner.cleanup()
+        self.runner = None
+
+
+def print_nodes(nodes: list, provider, label: str) -> None:
+    print(label)
+    for node, endpoint in zip(nodes, provider.endpoints):
+        status = endpoint.status()
+        print(f'  {node.uri} ({node.latency * 1000:.0f} ms): reads {node.calls["eth_call"]}, '
+              f'writes {node.calls["eth_sendRawTransaction"]}, ejected {status["ejected"]}, '
+              f'avg {status["latencyMs"]} ms')
+        node.calls.clear()
+
+
+async def reads(w3, requests: int, concurrency: int) -> int:
+    semaphore = asyncio.Semaphore(concurrency)
+    failed = []
+
+    async def one() -> None:
+        async with semaphore:
+            try:
+                await w3.provider.make_request('eth_call', [{'to': '0x' + '00' * 20, 'data': '0x'}, 'latest'])
+            except Exception as e:
+                failed.append(e)
+
+    await asyncio.gather(*[one() for _ in range(requests)])
+    return len(failed)
+
+
+async def writes(w3, requests: int) -> int:
+    failed = 0
+    for _ in range(requests):
+        try:
+            await w3.provider.make_request('eth_sendRawTransaction', ['0x00'])
+        except Exception:
+            failed += 1
+
+    return failed
+
+
+async def run(args) -> None:
+    latencies = [float(latency) / 1000 for latency in args.latencies.split(',')]
+    nodes = [StandInNode(args.port + i, latencies[i % len(latencies)]) for i in range(args.nodes)]
+    for node in nodes:
+        await node.start()
+
+    w3 = async_web3(','.join(node.uri for node in nodes), timeout=1)
+    provider = w3.provider
+
+    failed = await reads(w3, args.requests, args.concurrency)
+    failed += await writes(w3, 20)
+    print_nodes(nodes, provider, f'All nodes up ({failed} failed):')
+
+    await nodes[0].stop()
+    failed = await reads(w3, args.requests, args.concurrency)
+    failed += await writes(w3, 20)
+    print_nodes(nodes, provider, f'Primary stopped ({failed} failed):')
+
+    await nodes[0].start()
+    await asyncio.sleep(rpc.RPC_EJECT_SECONDS)
+    failed = await reads(w3, args.requests, args.concurrency)
+    failed += await writes(w3, 20)
+    print_nodes(nodes, provider, f'Primary back after its ejection ({failed} failed):')
+
+    await provider.close()
+    for node in nodes:
+        await node.stop()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--nodes', type=int, default=3)
+    parser.add_argument('--latencies', default='2,5,10', help='Milliseconds per node, repeated over the nodes')
+    parser.add_argument('--requests', type=int, default=600)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--port', type=int, default=18545, help='Port of the first node, the others follow')
+    parser.add_argument('--eject-seconds', type=float, default=1)
+    args = parser.parse_args()
+
+    rpc.RPC_EJECT_SECONDS = args.eject_seconds
+    asyncio.get_event_loop().run_until_complete(run(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+"""
+Compares ownership ticket signing: RS256 from PEM bytes on every call (the old create_qr path), RS256 with the key
+parsed once, and EdDSA with the key parsed once. Uses throwaway keys, no environment needed.
+
+    python -m bench.signing --tickets 2000
+"""
+import argparse
+import datetime
+import time
+
+import jwt
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ed25519, rsa
+
+
+def measure(name: str, sign, tickets: int) -> None:
+    payload = {'tid': 1, 'owner': '0x' + 'ab' * 20, 'exp': datetime.datetime.utcnow() + datetime.timedelta(hours=1)}
+
+    started = time.perf_counter()
+    for _ in range(tickets):
+        encoded = sign(payload)
+    elapsed = time.perf_counter() - started
+
+    print(f'{name}: {elapsed / tickets * 1000:.3f} ms per ticket, {tickets / elapsed:.0f} tickets/s, '
+          f'{len(encoded)} characters')
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--tickets', type=int, default=2000)
+    args = parser.parse_args()
+
+    rsa_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    rsa_pem = rsa_key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.TraditionalOpenSSL,
+                                    serialization.NoEncryption())
+    ed_key = ed25519.Ed25519PrivateKey.generate()
+
+    measure('RS256, PEM parsed per call', lambda payload: jwt.encode(payload, key=rsa_pem, algorithm='RS256'),
+            args.tickets)
+    measure('RS256, key parsed once', lambda payload: jwt.encode(payload, key=rsa_key, algorithm='RS256'),
+            args.tickets)
+    measure('EdDSA, key parsed once', lambda payload: jwt.encode(payload, key=ed_key, algorithm='EdDSA'),
+            args.tickets)
+
+
+if __name__ == '__main__':
+    main()
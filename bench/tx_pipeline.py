@@ -0,0 +1,72 @@
+"""
+Write throughput of one wallet: concurrent eth_sendTransaction with the node picking every nonce, against the local
+nonce pipeline. --workers runs that many independent pipelines at once, like gunicorn workers sharing a wallet.
+
+Sends real value transfers, so point it at a dev chain with an unlocked, funded account.
+
+    SERVER_ADDRESS=http://127.0.0.1:8545 python -m bench.tx_pipeline --sender 0x... --txs 200 --concurrency 32
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import time
+
+from web3 import Web3
+
+from node.async_contract import async_web3, wait_for_receipts
+from node.tx_pipeline import TX_RETRY_BACKOFF, TX_SUBMIT_RETRIES, TxPipeline
+
+
+async def run(mode: str, w3: Web3, sender: str, txs: int, concurrency: int, workers: int) -> None:
+    pipelines = [TxPipeline(concurrency, TX_SUBMIT_RETRIES, TX_RETRY_BACKOFF) for _ in range(workers)]
+    semaphore = asyncio.Semaphore(concurrency)
+    transaction = {'from': sender, 'to': sender, 'value': 0, 'gas': 21000}
+    latencies = []
+    tx_hashes = []
+    errors = []
+
+    async def one(n: int) -> None:
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                if mode == 'node nonces':
+                    tx_hashes.append(await w3.eth.send_transaction(transaction))
+                else:
+                    tx_hashes.append(await pipelines[n % workers].submit(w3, transaction))
+            except Exception as e:
+                errors.append(str(e))
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*[one(n) for n in range(txs)])
+    elapsed = time.perf_counter() - started
+
+    receipts = await wait_for_receipts(w3, tx_hashes)
+    mined = sum(1 for receipt in receipts if receipt is not None and receipt['status'] == 1)
+    retries = sum(pipeline.stats['retries'] for pipeline in pipelines)
+
+    latencies.sort()
+    print(f'{mode}: {txs / elapsed:.1f} tx/s submitted, p50 {statistics.median(latencies) * 1000:.1f} ms, '
+          f'p95 {latencies[int(len(latencies) * 0.95)] * 1000:.1f} ms, {mined} mined, {len(errors)} failed, '
+          f'{retries} retries')
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sender', required=True, help='unlocked, funded account')
+    parser.add_argument('--txs', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--workers', type=int, default=1, help='independent pipelines sharing the wallet')
+    args = parser.parse_args()
+
+    w3 = async_web3(os.environ['SERVER_ADDRESS'])
+    sender = Web3.toChecksumAddress(args.sender)
+    loop = asyncio.get_event_loop()
+
+    for mode in ('node nonces', 'pipeline'):
+        loop.run_until_complete(run(mode, w3, sender, args.txs, args.concurrency, args.workers))
+
+
+if __name__ == '__main__':
+    main()
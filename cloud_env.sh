@@ -4,4 +4,6 @@ sed -i 's|%CONTRACT_ADDRESS%|'$CONTRACT_ADDRESS'|g' app.yaml
 sed -i "s|%DB_INFO%|${DB_INFO}|g" app.yaml
 sed -i 's|%PRIVATE_KEY%|'$PRIVATE_KEY'|g' app.yaml
 sed -i 's|%PUBLIC_KEY%|'$PUBLIC_KEY'|g' app.yaml
-sed -i "s|%SERVER_ADDRESS%|${SERVER_ADDRESS}|g" app.yaml
\ No newline at end of file
+sed -i 's|%SIGNING_KEYS%|'$SIGNING_KEYS'|g' app.yaml
+sed -i "s|%SERVER_ADDRESS%|${SERVER_ADDRESS}|g" app.yaml
+sed -i "s|%TOKEN_CACHE_URL%|${TOKEN_CACHE_URL}|g" app.yaml
\ No newline at end of file
@@ -2,28 +2,67 @@ import os
 import json
 
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-SECRET_FILE = os.environ.get('DB_INFO')
-secret = json.loads(SECRET_FILE)
-DB = secret["DB"]
 
-DB_URL = f"mysql+pymysql://{DB['user']}:{DB['password']}@{DB['host']}:{DB['port']}/{DB['database']}?charset=utf8"
+# DATABASE_URL overrides DB_INFO, e.g. sqlite:////tmp/guarantee.db or mysql+pymysql://... for a local stand-in.
+# The async URL is derived from it by swapping in the async driver of the same backend.
+DATABASE_URL_ENV = os.environ.get('DATABASE_URL')
+
+ASYNC_DRIVERS = {
+    'mysql': 'mysql+aiomysql',
+    'sqlite': 'sqlite+aiosqlite'
+}
+
+# Connections per worker process. gunicorn runs 4 workers, so the MySQL server sees up to
+# 4 * (POOL_SIZE + MAX_OVERFLOW) connections from the async engines.
+POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', '5'))
+MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', '10'))
+POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', '3600'))
+
+if DATABASE_URL_ENV is None:
+    SECRET_FILE = os.environ.get('DB_INFO')
+    secret = json.loads(SECRET_FILE)
+    DB = secret["DB"]
+
+    DB_URL = f"mysql+pymysql://{DB['user']}:{DB['password']}@{DB['host']}:{DB['port']}/{DB['database']}?charset=utf8"
+else:
+    DB_URL = DATABASE_URL_ENV
+
+ASYNC_DB_URL = make_url(DB_URL).set(drivername=ASYNC_DRIVERS[make_url(DB_URL).get_backend_name()])
+
+
+def engine_options(url) -> dict:
+    if make_url(url).get_backend_name() == 'sqlite':
+        # SQLite uses a file lock instead of a server connection pool
+        return {}
+
+    return {'pool_size': POOL_SIZE, 'max_overflow': MAX_OVERFLOW, 'pool_recycle': POOL_RECYCLE, 'pool_pre_ping': True}
+
+
 engine = create_engine(
-    DB_URL, encoding='utf-8'
+    DB_URL, encoding='utf-8', **engine_options(DB_URL),
+    connect_args={'check_same_thread': False} if make_url(DB_URL).get_backend_name() == 'sqlite' else {}
 )
 print(DB_URL)
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Request handlers use the async engine so a slow query never stalls the event loop
+async_engine = create_async_engine(
+    ASYNC_DB_URL, **engine_options(ASYNC_DB_URL)
+)
+
+AsyncSessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=async_engine,
+                                 class_=AsyncSession)
+
 Base = declarative_base()
 
 
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_db():
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
@@ -0,0 +1,121 @@
+import datetime
+import hashlib
+import os
+
+from sqlalchemy import func, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import models
+
+# Attempts to chain a row to a token's head while concurrent requests keep extending it
+CHAIN_WRITE_RETRIES = int(os.environ.get('HISTORY_CHAIN_WRITE_RETRIES', '5'))
+
+
+def history_hash(prev_hash: str, token_id: int, token_from: str, token_to: str,
+                 event_time: datetime.datetime) -> str:
+    """
+    Cumulative hash of one History row. Each row commits to every row before it through prev_hash, so changing or
+    removing an old row breaks every later hash of the token.
+
+    :param prev_hash: chain_hash of the token's previous row, None for the mint row
+    """
+    message = '|'.join([prev_hash or '', str(token_id), token_from or '', token_to or '',
+                        event_time.strftime('%Y-%m-%d %H:%M:%S')])
+    return hashlib.sha256(message.encode('utf-8')).hexdigest()
+
+
+def row_hash(prev_hash: str, history: models.History) -> str:
+    return history_hash(prev_hash, history.token_id, history.token_from, history.token_to, history.event_time)
+
+
+async def head_hash(db: AsyncSession, token_id: int) -> str:
+    """
+    :return: chain_hash of the token's latest History row, None if it has none
+    """
+    return (await db.scalars(select(models.History.chain_hash)
+                             .filter(models.History.token_id == token_id)
+                             .order_by(models.History.history_id.desc())
+                             .limit(1))).first()
+
+
+async def head_hashes(db: AsyncSession, token_ids: list) -> dict:
+    """
+    :return: {token_id: chain_hash of its latest History row} for the tokens that have rows, in one query
+    """
+    heads = (select(func.max(models.History.history_id).label('history_id'))
+             .filter(models.History.token_id.in_(token_ids))
+             .group_by(models.History.token_id)
+             .subquery())
+
+    rows = await db.execute(select(models.History.token_id, models.History.chain_hash)
+                            .join(heads, models.History.history_id == heads.c.history_id))
+    return {token_id: chain_hash for token_id, chain_hash in rows}
+
+
+async def new_history(db: AsyncSession, token_id: int, token_from: str, token_to: str) -> models.History:
+    """
+    Builds the next History row of a token, chained to the token's current head. The caller adds and commits it.
+    """
+    # DATETIME columns keep whole seconds, so hash exactly what is stored
+    event_time = datetime.datetime.utcnow().replace(microsecond=0)
+    prev_hash = None if token_from is None else await head_hash(db, token_id)
+
+    return models.History(token_id=token_id, token_from=token_from, token_to=token_to, event_time=event_time,
+                          prev_hash=prev_hash,
+                          chain_hash=history_hash(prev_hash, token_id, token_from, token_to, event_time))
+
+
+def mint_history_values(token_id: int, minter: str, event_time: datetime.datetime) -> dict:
+    """
+    Column values of a token's first History row, for bulk inserts. Mint rows start a chain, so no lookup is needed.
+    They are only written once the mint is mined, hence confirmed.
+    """
+    event_time = event_time.replace(microsecond=0)
+
+    return {'token_id': token_id, 'token_from': None, 'token_to': minter, 'event_time': event_time,
+            'chain_hash': history_hash(None, token_id, None, minter, event_time), 'tx_status': models.TX_CONFIRMED}
+
+
+async def new_transfer_histories(db: AsyncSession, transfers: list) -> list:
+    """
+    Builds the next History row of many tokens at once, like new_history. The caller adds and commits them.
+
+    :param transfers: (token_id, token_from, token_to) with distinct token ids
+    """
+    event_time = datetime.datetime.utcnow().replace(microsecond=0)
+    prev_hashes = await head_hashes(db, [token_id for token_id, _, _ in transfers])
+    histories = []
+
+    for token_id, token_from, token_to in transfers:
+        prev_hash = prev_hashes.get(token_id)
+        histories.append(models.History(token_id=token_id, token_from=token_from, token_to=token_to,
+                                        event_time=event_time, prev_hash=prev_hash,
+                                        chain_hash=history_hash(prev_hash, token_id, token_from, token_to,
+                                                                event_time)))
+
+    return histories
+
+
+async def add_transfer_histories(db: AsyncSession, transfers: list, tx_status: str) -> list:
+    """
+    Adds and flushes the next History row of many tokens. Two requests extending the same head would fork the chain,
+    so the unique (token_id, prev_hash) index rejects the later one; its rows are then rebuilt on the new head. A
+    rejected flush rolls the session back, so call this before anything else is written in the transaction.
+
+    :param transfers: (token_id, token_from, token_to) with distinct token ids
+    :return: The flushed rows, with history_id set, in the order of `transfers`
+    """
+    for attempt in range(CHAIN_WRITE_RETRIES):
+        histories = await new_transfer_histories(db, transfers)
+        for history in histories:
+            history.tx_status = tx_status
+        db.add_all(histories)
+
+        try:
+            await db.flush()
+            return histories
+        except IntegrityError:
+            await db.rollback()
+            if attempt + 1 >= CHAIN_WRITE_RETRIES:
+                raise
@@ -0,0 +1,202 @@
+"""
+Versioned schema migrations. Every module in database/migrations defines VERSION, DESCRIPTION, upgrade(conn) and
+downgrade(conn); applied versions are recorded in the SchemaVersion table.
+
+    python -m database.migrate                  # apply all pending migrations
+    python -m database.migrate status
+    python -m database.migrate downgrade --to 1 # revert every migration above version 1
+
+Index changes on MySQL use ALTER TABLE ... ALGORITHM=INPLACE, LOCK=NONE, so reads and writes continue while the
+index is built. A named lock keeps two runners (e.g. several workers starting at once) from applying the same step.
+"""
+import argparse
+import datetime
+import importlib
+import pkgutil
+from contextlib import contextmanager
+
+from sqlalchemy import delete, inspect, select, text
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.types import Text
+
+from database import DB, models
+from database import migrations as migrations_package
+
+LOCK_NAME = 'guarantee_token_migrate'
+LOCK_TIMEOUT = 600
+
+# Key prefix for TEXT columns, which MySQL cannot index in full. Wallet addresses are 42 characters.
+TEXT_PREFIX_LENGTH = 42
+
+
+def load_migrations() -> list:
+    modules = [importlib.import_module(f'{migrations_package.__name__}.{info.name}')
+               for info in pkgutil.iter_modules(migrations_package.__path__)]
+    modules.sort(key=lambda module: module.VERSION)
+
+    versions = [module.VERSION for module in modules]
+    if len(set(versions)) != len(versions):
+        raise RuntimeError(f'Duplicate migration versions: {versions}')
+
+    return modules
+
+
+@contextmanager
+def migration_lock(conn: Connection):
+    if conn.dialect.name != 'mysql':
+        yield
+        return
+
+    locked = conn.execute(text('SELECT GET_LOCK(:name, :timeout)'), {'name': LOCK_NAME, 'timeout': LOCK_TIMEOUT})
+    if locked.scalar() != 1:
+        raise RuntimeError('Timed out waiting for another migration run')
+
+    try:
+        yield
+    finally:
+        conn.execute(text('SELECT RELEASE_LOCK(:name)'), {'name': LOCK_NAME})
+
+
+def applied_versions(conn: Connection) -> set:
+    models.SchemaVersion.__table__.create(conn, checkfirst=True)
+    return set(conn.execute(select(models.SchemaVersion.version)).scalars())
+
+
+def index_exists(conn: Connection, table: str, name: str) -> bool:
+    return any(index['name'] == name for index in inspect(conn).get_indexes(table))
+
+
+def add_index(conn: Connection, table: str, name: str, columns: list, unique: bool = False) -> None:
+    """
+    Creates an index online. Does nothing if it already exists, so a migration interrupted halfway can be re-run.
+    """
+    if index_exists(conn, table, name):
+        return
+
+    kind = 'UNIQUE INDEX' if unique else 'INDEX'
+
+    if conn.dialect.name != 'mysql':
+        conn.execute(text(f'CREATE {kind} {name} ON {table} ({", ".join(columns)})'))
+        return
+
+    column_types = {column['name']: column['type'] for column in inspect(conn).get_columns(table)}
+    key_parts = [f'`{column}`({TEXT_PREFIX_LENGTH})' if isinstance(column_types[column], Text) else f'`{column}`'
+                 for column in columns]
+
+    conn.execute(text(f'ALTER TABLE `{table}` ADD {kind} `{name}` ({", ".join(key_parts)}), '
+                      f'ALGORITHM=INPLACE, LOCK=NONE'))
+
+
+def add_column(conn: Connection, table: str, name: str, column_type: str) -> None:
+    """
+    Adds a nullable column online. Does nothing if it already exists.
+    """
+    if any(column['name'] == name for column in inspect(conn).get_columns(table)):
+        return
+
+    if conn.dialect.name != 'mysql':
+        conn.execute(text(f'ALTER TABLE {table} ADD COLUMN {name} {column_type}'))
+        return
+
+    conn.execute(text(f'ALTER TABLE `{table}` ADD COLUMN `{name}` {column_type} NULL, ALGORITHM=INPLACE, LOCK=NONE'))
+
+
+def drop_column(conn: Connection, table: str, name: str) -> None:
+    if not any(column['name'] == name for column in inspect(conn).get_columns(table)):
+        return
+
+    if conn.dialect.name != 'mysql':
+        conn.execute(text(f'ALTER TABLE {table} DROP COLUMN {name}'))
+        return
+
+    conn.execute(text(f'ALTER TABLE `{table}` DROP COLUMN `{name}`, ALGORITHM=INPLACE, LOCK=NONE'))
+
+
+def drop_index(conn: Connection, table: str, name: str) -> None:
+    if not index_exists(conn, table, name):
+        return
+
+    if conn.dialect.name != 'mysql':
+        conn.execute(text(f'DROP INDEX {name}'))
+        return
+
+    conn.execute(text(f'ALTER TABLE `{table}` DROP INDEX `{name}`, ALGORITHM=INPLACE, LOCK=NONE'))
+
+
+def upgrade(engine: Engine, target: int = None) -> list:
+    """
+    Applies pending migrations up to `target` (default: all).
+
+    :return: Versions applied by this call
+    """
+    applied = []
+
+    with engine.connect() as conn, migration_lock(conn):
+        done = applied_versions(conn)
+
+        for migration in load_migrations():
+            if migration.VERSION in done or (target is not None and migration.VERSION > target):
+                continue
+
+            print(f'Applying migration {migration.VERSION}: {migration.DESCRIPTION}')
+            migration.upgrade(conn)
+            conn.execute(models.SchemaVersion.__table__.insert().values(version=migration.VERSION,
+                                                                        description=migration.DESCRIPTION,
+                                                                        applied_at=datetime.datetime.utcnow()))
+            applied.append(migration.VERSION)
+
+    return applied
+
+
+def downgrade(engine: Engine, target: int) -> list:
+    """
+    Reverts applied migrations above `target`, newest first.
+
+    :return: Versions reverted by this call
+    """
+    reverted = []
+
+    with engine.connect() as conn, migration_lock(conn):
+        done = applied_versions(conn)
+
+        for migration in reversed(load_migrations()):
+            if migration.VERSION not in done or migration.VERSION <= target:
+                continue
+
+            print(f'Reverting migration {migration.VERSION}: {migration.DESCRIPTION}')
+            migration.downgrade(conn)
+            conn.execute(delete(models.SchemaVersion).where(models.SchemaVersion.version == migration.VERSION))
+            reverted.append(migration.VERSION)
+
+    return reverted
+
+
+def status(engine: Engine) -> list:
+    """
+    :return: [(version, description, applied)] for every known migration
+    """
+    with engine.connect() as conn:
+        done = applied_versions(conn)
+
+    return [(migration.VERSION, migration.DESCRIPTION, migration.VERSION in done) for migration in load_migrations()]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Apply or revert database schema migrations.')
+    parser.add_argument('command', nargs='?', default='upgrade', choices=['upgrade', 'downgrade', 'status'])
+    parser.add_argument('--to', type=int, help='target version (required for downgrade)')
+    args = parser.parse_args()
+
+    if args.command == 'status':
+        for version, description, done in status(DB.engine):
+            print(f'{version:4d} {"applied" if done else "pending":8s} {description}')
+    elif args.command == 'downgrade':
+        if args.to is None:
+            parser.error('downgrade needs --to')
+        print(f'Reverted: {downgrade(DB.engine, args.to) or "nothing"}')
+    else:
+        print(f'Applied: {upgrade(DB.engine, args.to) or "nothing"}')
+
+
+if __name__ == '__main__':
+    main()
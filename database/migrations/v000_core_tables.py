@@ -0,0 +1,41 @@
+from sqlalchemy import Column, Date, DateTime, Integer, MetaData, String, Table, Text
+
+VERSION = 0
+DESCRIPTION = 'User, Token and History tables'
+
+# The tables as they were before migrations existed. Later migrations add their columns and indexes, so they are
+# declared here rather than taken from database/models.py. Wallet addresses and names are TEXT, hence the prefix
+# keys of migration 2 on MySQL.
+metadata = MetaData()
+
+TABLES = [
+    Table('User', metadata,
+          Column('user_id', String(255), primary_key=True, nullable=False),
+          Column('user_pw_encrypted', Text, nullable=False),
+          Column('passphrase', Text),
+          Column('user_wallet', Text),
+          Column('user_type', Text, nullable=False),
+          Column('manu_name', Text, nullable=True)),
+    Table('Token', metadata,
+          Column('token_id', Integer, primary_key=True, nullable=False, autoincrement=False),
+          Column('brand', Text, nullable=False),
+          Column('product_name', Text, nullable=False),
+          Column('production_date', Date, nullable=False),
+          Column('expiration_date', Date, nullable=False),
+          Column('details', Text, nullable=False)),
+    Table('History', metadata,
+          Column('history_id', Integer, primary_key=True, autoincrement=True, nullable=False),
+          Column('token_id', Integer, nullable=False),
+          Column('token_from', Text, nullable=True),
+          Column('token_to', Text, nullable=True),
+          Column('event_time', DateTime, nullable=False)),
+]
+
+
+def upgrade(conn) -> None:
+    # Existing databases already have them, hence checkfirst
+    metadata.create_all(conn, tables=TABLES, checkfirst=True)
+
+
+def downgrade(conn) -> None:
+    metadata.drop_all(conn, tables=TABLES, checkfirst=True)
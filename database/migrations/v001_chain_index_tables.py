@@ -0,0 +1,33 @@
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table
+
+VERSION = 1
+DESCRIPTION = 'Tables of the chain event indexer'
+
+# The tables as this version creates them, independent of later changes to database/models.py
+metadata = MetaData()
+
+TABLES = [
+    Table('TokenApproval', metadata,
+          Column('token_id', Integer, primary_key=True, autoincrement=False, nullable=False),
+          Column('approved', String(42), nullable=True, index=True),
+          Column('block_number', Integer, nullable=False)),
+    Table('Ownership', metadata,
+          Column('token_id', Integer, primary_key=True, autoincrement=False, nullable=False),
+          Column('owner', String(42), nullable=False, index=True),
+          Column('block_number', Integer, nullable=False)),
+    Table('SyncState', metadata,
+          Column('name', String(64), primary_key=True, nullable=False),
+          Column('block_number', Integer, nullable=False),
+          Column('block_hash', String(66), nullable=True),
+          Column('lease_owner', String(128), nullable=True),
+          Column('lease_until', DateTime, nullable=True)),
+]
+
+
+def upgrade(conn) -> None:
+    # These tables were created by the indexer at startup before migrations existed, hence checkfirst
+    metadata.create_all(conn, tables=TABLES, checkfirst=True)
+
+
+def downgrade(conn) -> None:
+    metadata.drop_all(conn, tables=TABLES, checkfirst=True)
@@ -0,0 +1,22 @@
+from database.migrate import add_index, drop_index
+
+VERSION = 2
+DESCRIPTION = 'Indexes on History and User lookup columns'
+
+# (table, index name, columns). Names match the Index declarations in database/models.py.
+INDEXES = [
+    ('History', 'ix_history_token_id_history_id', ['token_id', 'history_id']),
+    ('History', 'ix_history_token_from_event_time', ['token_from', 'event_time']),
+    ('History', 'ix_history_token_to_event_time', ['token_to', 'event_time']),
+    ('User', 'ix_user_user_wallet', ['user_wallet']),
+]
+
+
+def upgrade(conn) -> None:
+    for table, name, columns in INDEXES:
+        add_index(conn, table, name, columns)
+
+
+def downgrade(conn) -> None:
+    for table, name, _ in reversed(INDEXES):
+        drop_index(conn, table, name)
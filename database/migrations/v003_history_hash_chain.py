@@ -0,0 +1,65 @@
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, Text, bindparam, select, update
+
+from database.history_chain import row_hash
+from database.migrate import add_column, drop_column
+
+VERSION = 3
+DESCRIPTION = 'History hash chain and integrity audit table'
+
+# Tokens whose rows are hashed per statement batch during the backfill
+BACKFILL_BATCH = 500
+
+# The tables as of this version. database/models.py has the columns later migrations add, which do not exist yet.
+metadata = MetaData()
+
+history = Table('History', metadata,
+                Column('history_id', Integer, primary_key=True),
+                Column('token_id', Integer, nullable=False),
+                Column('token_from', Text, nullable=True),
+                Column('token_to', Text, nullable=True),
+                Column('event_time', DateTime, nullable=False),
+                Column('chain_hash', String(64), nullable=True))
+
+history_audit = Table('HistoryAudit', metadata,
+                      Column('token_id', Integer, primary_key=True, autoincrement=False, nullable=False),
+                      Column('history_id', Integer, nullable=False),
+                      Column('detail', String(255), nullable=False),
+                      Column('detected_at', DateTime, nullable=False))
+
+
+def upgrade(conn) -> None:
+    add_column(conn, 'History', 'chain_hash', 'VARCHAR(64)')
+    metadata.create_all(conn, tables=[history_audit], checkfirst=True)
+
+    # Existing rows become the trusted starting point of every chain
+    after = -1
+    while True:
+        token_ids = conn.execute(select(history.c.token_id).distinct()
+                                 .where(history.c.token_id > after)
+                                 .order_by(history.c.token_id)
+                                 .limit(BACKFILL_BATCH)).scalars().all()
+        if not token_ids:
+            break
+
+        rows = conn.execute(select(history)
+                            .where(history.c.token_id.in_(token_ids))
+                            .order_by(history.c.token_id, history.c.history_id)).all()
+
+        prev_hashes = {}
+        changed = []
+        for row in rows:
+            chain_hash = row_hash(prev_hashes.get(row.token_id), row)
+            prev_hashes[row.token_id] = chain_hash
+            if row.chain_hash != chain_hash:
+                changed.append({'row_id': row.history_id, 'row_hash': chain_hash})
+
+        if changed:
+            conn.execute(update(history).where(history.c.history_id == bindparam('row_id'))
+                         .values(chain_hash=bindparam('row_hash')), changed)
+
+        after = token_ids[-1]
+
+
+def downgrade(conn) -> None:
+    metadata.drop_all(conn, tables=[history_audit], checkfirst=True)
+    drop_column(conn, 'History', 'chain_hash')
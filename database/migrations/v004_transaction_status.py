@@ -0,0 +1,32 @@
+from sqlalchemy import Column, DateTime, Index, Integer, MetaData, String, Table, Text
+
+from database.migrate import add_column, drop_column
+
+VERSION = 4
+DESCRIPTION = 'Receipt status of sent transactions'
+
+# The table as this version creates it, independent of later changes to database/models.py
+metadata = MetaData()
+
+chain_transaction = Table('ChainTransaction', metadata,
+                          Column('tx_hash', String(66), primary_key=True, nullable=False),
+                          Column('kind', String(16), nullable=False),
+                          Column('token_id', Integer, nullable=True),
+                          Column('history_id', Integer, nullable=True),
+                          Column('payload', Text, nullable=True),
+                          Column('status', String(16), nullable=False),
+                          Column('block_number', Integer, nullable=True),
+                          Column('detail', String(255), nullable=True),
+                          Column('submitted_at', DateTime, nullable=False),
+                          Column('updated_at', DateTime, nullable=False),
+                          Index('ix_chaintransaction_status_submitted_at', 'status', 'submitted_at'))
+
+
+def upgrade(conn) -> None:
+    add_column(conn, 'History', 'tx_status', 'VARCHAR(16)')
+    metadata.create_all(conn, tables=[chain_transaction], checkfirst=True)
+
+
+def downgrade(conn) -> None:
+    metadata.drop_all(conn, tables=[chain_transaction], checkfirst=True)
+    drop_column(conn, 'History', 'tx_status')
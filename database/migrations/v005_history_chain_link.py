@@ -0,0 +1,55 @@
+from sqlalchemy import Column, Integer, MetaData, String, Table, bindparam, select, update
+
+from database.migrate import add_column, add_index, drop_column, drop_index
+
+VERSION = 5
+DESCRIPTION = 'Unique link from each History row to the head it extends'
+
+# Tokens whose rows are linked per statement batch during the backfill
+BACKFILL_BATCH = 500
+
+# The History columns this version reads and writes
+history = Table('History', MetaData(),
+                Column('history_id', Integer, primary_key=True),
+                Column('token_id', Integer, nullable=False),
+                Column('chain_hash', String(64), nullable=True),
+                Column('prev_hash', String(64), nullable=True))
+
+
+def upgrade(conn) -> None:
+    add_column(conn, 'History', 'prev_hash', 'VARCHAR(64)')
+
+    # Every row extends the row before it; the mint row extends nothing
+    after = -1
+    while True:
+        token_ids = conn.execute(select(history.c.token_id).distinct()
+                                 .where(history.c.token_id > after)
+                                 .order_by(history.c.token_id)
+                                 .limit(BACKFILL_BATCH)).scalars().all()
+        if not token_ids:
+            break
+
+        rows = conn.execute(select(history)
+                            .where(history.c.token_id.in_(token_ids))
+                            .order_by(history.c.token_id, history.c.history_id)).all()
+
+        prev_hashes = {}
+        changed = []
+        for row in rows:
+            prev_hash = prev_hashes.get(row.token_id)
+            prev_hashes[row.token_id] = row.chain_hash
+            if row.prev_hash != prev_hash:
+                changed.append({'row_id': row.history_id, 'row_prev_hash': prev_hash})
+
+        if changed:
+            conn.execute(update(history).where(history.c.history_id == bindparam('row_id'))
+                         .values(prev_hash=bindparam('row_prev_hash')), changed)
+
+        after = token_ids[-1]
+
+    add_index(conn, 'History', 'uq_history_token_id_prev_hash', ['token_id', 'prev_hash'], unique=True)
+
+
+def downgrade(conn) -> None:
+    drop_index(conn, 'History', 'uq_history_token_id_prev_hash')
+    drop_column(conn, 'History', 'prev_hash')
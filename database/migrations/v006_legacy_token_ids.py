@@ -0,0 +1,98 @@
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, Text, and_, bindparam, select, update
+
+from database.history_chain import row_hash
+
+VERSION = 6
+DESCRIPTION = 'Move Token and History rows of pre-receipt mints to their real token ids'
+
+# Tokens re-keyed per statement batch
+REKEY_BATCH = 500
+
+# The columns this version reads and writes
+metadata = MetaData()
+
+token = Table('Token', metadata,
+              Column('token_id', Integer, primary_key=True, autoincrement=False))
+
+history = Table('History', metadata,
+                Column('history_id', Integer, primary_key=True),
+                Column('token_id', Integer, nullable=False),
+                Column('token_from', Text, nullable=True),
+                Column('token_to', Text, nullable=True),
+                Column('event_time', DateTime, nullable=False),
+                Column('chain_hash', String(64), nullable=True),
+                Column('prev_hash', String(64), nullable=True),
+                Column('tx_status', String(16), nullable=True))
+
+history_audit = Table('HistoryAudit', metadata,
+                      Column('token_id', Integer, primary_key=True, autoincrement=False))
+
+
+def legacy_token_ids(conn) -> list:
+    """
+    The mint handler used to read getMaxTokenID() after minting, which the contract had already incremented, so it
+    stored every token one id above the token it minted. Those mint rows predate receipt tracking and have no
+    tx_status; mints recorded from the receipt log always have one.
+
+    :return: Stored ids of the tokens written that way, ascending
+    """
+    return conn.execute(select(token.c.token_id)
+                        .join(history, and_(history.c.token_id == token.c.token_id, history.c.token_from.is_(None)))
+                        .where(history.c.tx_status.is_(None))
+                        .order_by(token.c.token_id)).scalars().all()
+
+
+def rekey(conn, token_ids: list, offset: int) -> None:
+    """
+    Moves the Token row and the mint History row of `token_ids` to token_id + offset and re-hashes the History
+    chains they leave and join, which commit to the token id. Like migration 3, the rows as they are become the
+    trusted start.
+    """
+
+    # One row at a time in an order where the target id is always free: token K moves to K - 1 after K - 1 moved on
+    ordered = sorted(token_ids, reverse=offset > 0)
+    moves = [{'old_id': token_id, 'new_id': token_id + offset} for token_id in ordered]
+
+    conn.execute(update(token).where(token.c.token_id == bindparam('old_id'))
+                 .values(token_id=bindparam('new_id')), moves)
+    # Only the mint path stored the wrong id. Transfers, legacy ones included, always used the real token id.
+    conn.execute(update(history).where(history.c.token_id == bindparam('old_id'), history.c.token_from.is_(None),
+                                       history.c.tx_status.is_(None))
+                 .values(token_id=bindparam('new_id')), moves)
+    # Chains that lost or gained rows. Findings about the old chains are dropped; the verifier re-checks.
+    affected = sorted(set(token_ids) | {token_id + offset for token_id in token_ids})
+    conn.execute(history_audit.delete().where(history_audit.c.token_id.in_(affected)))
+
+    rows = conn.execute(select(history)
+                        .where(history.c.token_id.in_(affected))
+                        .order_by(history.c.token_id, history.c.history_id)).all()
+
+    prev_hashes = {}
+    changed = []
+    for row in rows:
+        prev_hash = prev_hashes.get(row.token_id)
+        chain_hash = row_hash(prev_hash, row)
+        prev_hashes[row.token_id] = chain_hash
+        changed.append({'row_id': row.history_id, 'row_prev_hash': prev_hash, 'row_hash': chain_hash})
+
+    if changed:
+        conn.execute(update(history).where(history.c.history_id == bindparam('row_id'))
+                     .values(prev_hash=bindparam('row_prev_hash'), chain_hash=bindparam('row_hash')), changed)
+
+
+def upgrade(conn) -> None:
+    # All or nothing: re-running after a partial move would move the moved rows again
+    with conn.begin():
+        token_ids = legacy_token_ids(conn)
+
+        for start in range(0, len(token_ids), REKEY_BATCH):
+            rekey(conn, token_ids[start:start + REKEY_BATCH], -1)
+
+
+def downgrade(conn) -> None:
+    # Mints of this release have a tx_status, so the rows moved by upgrade are the ones without
+    with conn.begin():
+        token_ids = legacy_token_ids(conn)
+
+        for start in range(len(token_ids) - REKEY_BATCH, -REKEY_BATCH, -REKEY_BATCH):
+            rekey(conn, token_ids[max(start, 0):start + REKEY_BATCH], 1)
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Date, DateTime
+from sqlalchemy import Column, Integer, String, Date, DateTime, Index, Text
 from database.DB import Base
 
 
@@ -12,6 +12,11 @@ class User(Base):
     user_type = Column(String, nullable=False)
     manu_name = Column(String, nullable=True)
 
+    # Indexes are created by database/migrations, not create_all. Declared here so the ORM metadata matches.
+    __table_args__ = (
+        Index('ix_user_user_wallet', 'user_wallet'),
+    )
+
 
 class Token(Base):
     __tablename__ = "Token"
@@ -24,6 +29,12 @@ class Token(Base):
     details = Column(String, nullable=False)
 
 
+# Receipt status of a sent transaction, see node/tx_watcher.py. History rows written before it was tracked have none.
+TX_PENDING = 'pending'
+TX_CONFIRMED = 'confirmed'
+TX_FAILED = 'failed'
+
+
 class History(Base):
     __tablename__ = "History"
 
@@ -32,3 +43,78 @@ class History(Base):
     token_from = Column(String, nullable=True)
     token_to = Column(String, nullable=True)
     event_time = Column(DateTime, nullable=False)
+    chain_hash = Column(String(64), nullable=True)  # See database/history_chain.py
+    prev_hash = Column(String(64), nullable=True)  # chain_hash of the token's previous row, None for the mint row
+    tx_status = Column(String(16), nullable=True)
+
+    __table_args__ = (
+        Index('ix_history_token_id_history_id', 'token_id', 'history_id'),
+        # A row can only extend a head no other row extends yet
+        Index('uq_history_token_id_prev_hash', 'token_id', 'prev_hash', unique=True),
+        Index('ix_history_token_from_event_time', 'token_from', 'event_time'),
+        Index('ix_history_token_to_event_time', 'token_to', 'event_time'),
+    )
+
+
+class TokenApproval(Base):
+    __tablename__ = "TokenApproval"
+
+    token_id = Column(Integer, primary_key=True, autoincrement=False, nullable=False)
+    approved = Column(String(42), nullable=True, index=True)
+    block_number = Column(Integer, nullable=False)
+
+
+class SyncState(Base):
+    __tablename__ = "SyncState"
+
+    name = Column(String(64), primary_key=True, nullable=False)
+    block_number = Column(Integer, nullable=False)
+    block_hash = Column(String(66), nullable=True)
+    lease_owner = Column(String(128), nullable=True)
+    lease_until = Column(DateTime, nullable=True)
+
+
+class Ownership(Base):
+    __tablename__ = "Ownership"
+
+    token_id = Column(Integer, primary_key=True, autoincrement=False, nullable=False)
+    owner = Column(String(42), nullable=False, index=True)
+    block_number = Column(Integer, nullable=False)
+
+
+class SchemaVersion(Base):
+    __tablename__ = "SchemaVersion"
+
+    version = Column(Integer, primary_key=True, autoincrement=False, nullable=False)
+    description = Column(String(255), nullable=False)
+    applied_at = Column(DateTime, nullable=False)
+
+
+class HistoryAudit(Base):
+    __tablename__ = "HistoryAudit"
+
+    # Tokens whose History chain failed the last background verification
+    token_id = Column(Integer, primary_key=True, autoincrement=False, nullable=False)
+    history_id = Column(Integer, nullable=False)
+    detail = Column(String(255), nullable=False)
+    detected_at = Column(DateTime, nullable=False)
+
+
+class ChainTransaction(Base):
+    __tablename__ = "ChainTransaction"
+
+    # Transactions sent by the server, settled by the receipt watcher (node/tx_watcher.py)
+    tx_hash = Column(String(66), primary_key=True, nullable=False)
+    kind = Column(String(16), nullable=False)  # mint, transfer or approve
+    token_id = Column(Integer, nullable=True)
+    history_id = Column(Integer, nullable=True)
+    payload = Column(Text, nullable=True)  # JSON Token row of a mint, written once the token id is known
+    status = Column(String(16), nullable=False)
+    block_number = Column(Integer, nullable=True)
+    detail = Column(String(255), nullable=True)
+    submitted_at = Column(DateTime, nullable=False)
+    updated_at = Column(DateTime, nullable=False)
+
+    __table_args__ = (
+        Index('ix_chaintransaction_status_submitted_at', 'status', 'submitted_at'),
+    )
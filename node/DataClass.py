@@ -1,3 +1,5 @@
+from typing import List, Optional
+
 from pydantic import BaseModel
 
 
@@ -5,6 +7,13 @@ class NoAuthAddress(BaseModel):
     address: str
 
 
+class TokenPage(BaseModel):
+    address: str
+    cursor: Optional[int] = None  # next_cursor of the previous page
+    approved_cursor: Optional[int] = None  # approved_next_cursor of the previous page (resellers)
+    limit: Optional[int] = None
+
+
 class Address(BaseModel):
     address: str
     wallet_password: str
@@ -14,6 +23,19 @@ class Address(BaseModel):
     details: str
 
 
+class Product(BaseModel):
+    product_name: str
+    prod_date: str
+    exp_date: str
+    details: str
+
+
+class BatchMint(BaseModel):
+    address: str
+    wallet_password: str
+    products: List[Product]
+
+
 class Transaction(BaseModel):
     sender: str
     receiver: str
@@ -22,6 +44,18 @@ class Transaction(BaseModel):
     wallet_password: str
 
 
+class TransferItem(BaseModel):
+    sender: str
+    receiver: str
+    tid: int
+
+
+class BatchTransfer(BaseModel):
+    transactor: str
+    wallet_password: str
+    items: List[TransferItem]
+
+
 class Approval(BaseModel):
     receiver: str
     tid: int
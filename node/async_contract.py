@@ -0,0 +1,134 @@
+import asyncio
+import os
+import time
+
+from hexbytes import HexBytes
+from web3 import Web3
+from web3._utils.method_formatters import receipt_formatter
+from web3.eth import AsyncEth
+
+from node.batch import batch_request, decode_result
+from node.rpc import PooledHTTPProvider
+from node.tx_pipeline import tx_pipeline
+
+# ABI encoding and decoding need no connection, so contract objects are built on an offline instance and only the
+# requests go through the async provider.
+codec_w3 = Web3()
+
+RECEIPT_TIMEOUT = float(os.environ.get('RECEIPT_TIMEOUT', '120'))
+RECEIPT_POLL_INTERVAL = float(os.environ.get('RECEIPT_POLL_INTERVAL', '0.5'))
+
+
+def async_web3(endpoint_uri: str, **provider_kwargs) -> Web3:
+    """
+    :param provider_kwargs: PooledHTTPProvider settings (pool_size, keepalive_timeout, timeout)
+    """
+    return Web3(PooledHTTPProvider(endpoint_uri, **provider_kwargs), modules={'eth': (AsyncEth,)}, middlewares=[])
+
+
+async def rpc_request(w3: Web3, method: str, params: list):
+    """
+    Raw JSON-RPC request for methods AsyncEth does not wrap (personal_*, eth_getLogs, receipts, ...).
+
+    :return: The unformatted `result` field. Raises ValueError on a JSON-RPC error, like the sync API.
+    """
+    return await w3.manager.coro_request(method, params)
+
+
+async def wait_for_receipt(w3: Web3, tx_hash: HexBytes, timeout: float = RECEIPT_TIMEOUT):
+    """
+    Polls until the transaction is mined. AsyncEth has no wait_for_transaction_receipt in this web3 version.
+
+    :return: The formatted receipt. Raises asyncio.TimeoutError if it is not mined within `timeout` seconds.
+    """
+    deadline = time.monotonic() + timeout
+
+    while True:
+        receipt = await rpc_request(w3, 'eth_getTransactionReceipt', [HexBytes(tx_hash).hex()])
+        if receipt is not None:
+            return receipt_formatter(receipt)
+
+        if time.monotonic() >= deadline:
+            raise asyncio.TimeoutError(f'Transaction {HexBytes(tx_hash).hex()} not mined after {timeout}s')
+
+        await asyncio.sleep(RECEIPT_POLL_INTERVAL)
+
+
+async def wait_for_receipts(w3: Web3, tx_hashes: list, timeout: float = RECEIPT_TIMEOUT) -> list:
+    """
+    Polls the receipts of many transactions, with one batch request per round for the ones still pending.
+
+    :return: The formatted receipt of every hash, in order. None for transactions not mined within `timeout` seconds.
+    """
+    deadline = time.monotonic() + timeout
+    receipts = [None] * len(tx_hashes)
+
+    while True:
+        pending = [i for i, receipt in enumerate(receipts) if receipt is None]
+        responses = await batch_request(w3, [('eth_getTransactionReceipt', [HexBytes(tx_hashes[i]).hex()])
+                                             for i in pending])
+
+        for i, item in zip(pending, responses):
+            if item.get('result') is not None:
+                receipts[i] = receipt_formatter(item['result'])
+
+        if all(receipt is not None for receipt in receipts) or time.monotonic() >= deadline:
+            return receipts
+
+        await asyncio.sleep(RECEIPT_POLL_INTERVAL)
+
+
+class AsyncContractFunction:
+    """
+    A bound contract function (e.g. functions.balanceOf(address)) whose call/transact are awaitable.
+    Attribute access falls through to the wrapped web3 ContractFunction, so it can be handed to batch_call too.
+    """
+
+    def __init__(self, w3: Web3, function):
+        self.w3 = w3
+        self.function = function
+
+    def __getattr__(self, name):
+        return getattr(self.function, name)
+
+    async def call(self, block_identifier='latest'):
+        data = await self.w3.eth.call({'to': self.function.address,
+                                       'data': self.function._encode_transaction_data()}, block_identifier)
+        return decode_result(self.function, data)
+
+    async def transact(self, transaction: dict) -> HexBytes:
+        tx = dict(transaction, to=self.function.address, data=self.function._encode_transaction_data())
+        if 'gas' not in tx:
+            # The sync ContractFunction.transact fills this in the same way
+            tx['gas'] = await self.w3.eth.estimate_gas(tx)
+        if 'nonce' in tx:
+            return await self.w3.eth.send_transaction(tx)
+        return await tx_pipeline.submit(self.w3, tx)
+
+
+class AsyncContractFunctions:
+    def __init__(self, w3: Web3, functions):
+        self.w3 = w3
+        self.functions = functions
+
+    def __getattr__(self, name):
+        factory = getattr(self.functions, name)
+
+        def bind(*args, **kwargs) -> AsyncContractFunction:
+            return AsyncContractFunction(self.w3, factory(*args, **kwargs))
+
+        return bind
+
+
+class AsyncContract:
+    """
+    Async counterpart of w3.eth.contract(...). Usage mirrors web3:
+        await contract_instance.functions.balanceOf(address).call()
+    """
+
+    def __init__(self, w3: Web3, abi: list, address: str):
+        self.w3 = w3
+        self.contract = codec_w3.eth.contract(abi=abi, address=address)
+        self.address = self.contract.address
+        self.events = self.contract.events
+        self.functions = AsyncContractFunctions(w3, self.contract.functions)
@@ -0,0 +1,112 @@
+import json
+import os
+
+from hexbytes import HexBytes
+from web3 import Web3
+from web3._utils.abi import get_abi_output_types, map_abi_data
+from web3._utils.normalizers import BASE_RETURN_NORMALIZERS
+from web3._utils.request import async_make_post_request
+
+from node.rpc import read_only
+
+# Maximum number of calls sent in one JSON-RPC batch array. geth accepts large batches, but very large bodies
+# hold a single connection for a long time.
+BATCH_SIZE = int(os.environ.get('RPC_BATCH_SIZE', '100'))
+
+
+def encode_call(fn, block_identifier) -> tuple:
+    if isinstance(block_identifier, int):
+        block_identifier = hex(block_identifier)
+
+    return 'eth_call', [{'to': fn.address, 'data': fn._encode_transaction_data()}, block_identifier]
+
+
+def decode_result(fn, data: str):
+    output_types = get_abi_output_types(fn.abi)
+    decoded = fn.web3.codec.decode_abi(output_types, HexBytes(data))
+    normalized = map_abi_data(BASE_RETURN_NORMALIZERS, output_types, decoded)
+
+    return normalized[0] if len(normalized) == 1 else normalized
+
+
+async def batch_request(w3: Web3, requests: list) -> list:
+    """
+    Sends JSON-RPC requests as batch arrays instead of one HTTP round trip per request.
+
+    :param w3: Web3 instance with an AsyncHTTPProvider
+    :param requests: (method, params) pairs
+    :return: One {'result': raw result} or {'error': message} per request, in the order of `requests`.
+    """
+    results = []
+
+    for start in range(0, len(requests), BATCH_SIZE):
+        chunk = requests[start:start + BATCH_SIZE]
+        payload = [{'jsonrpc': '2.0', 'id': i, 'method': method, 'params': params}
+                   for i, (method, params) in enumerate(chunk)]
+
+        body = json.dumps(payload).encode('utf-8')
+        if hasattr(w3.provider, 'post'):
+            # PooledHTTPProvider: keep-alive connection, timed under the methods of the batch
+            methods = sorted({method for method, _ in chunk})
+            raw_response = await w3.provider.post(body, 'batch:' + '+'.join(methods), read_only(methods))
+        else:
+            raw_response = await async_make_post_request(w3.provider.endpoint_uri, body,
+                                                         **w3.provider.get_request_kwargs())
+        response = json.loads(raw_response)
+
+        if not isinstance(response, list):
+            # The node rejected the whole batch
+            raise ValueError(response.get('error', response))
+
+        # Batch responses may come back in any order
+        by_id = {item.get('id'): item for item in response}
+
+        for i in range(len(chunk)):
+            item = by_id.get(i)
+            if item is None:
+                results.append({'error': 'Missing response'})
+            elif 'error' in item:
+                results.append({'error': item['error'].get('message', str(item['error']))})
+            else:
+                results.append({'result': item.get('result')})
+
+    return results
+
+
+async def batch_call(w3: Web3, calls: list, block_identifier='latest') -> list:
+    """
+    Sends contract view calls as JSON-RPC batch arrays instead of one HTTP round trip per call.
+
+    :param w3: Web3 instance with an AsyncHTTPProvider
+    :param calls: Bound contract functions, e.g. contract_instance.functions.getApproved(1)
+    :param block_identifier: Block every call is executed against
+    :return: One {'result': value} or {'error': message} per call, in the order of `calls`.
+    """
+    results = []
+
+    responses = await batch_request(w3, [encode_call(fn, block_identifier) for fn in calls])
+    for fn, item in zip(calls, responses):
+        if 'error' in item:
+            results.append(item)
+            continue
+
+        try:
+            results.append({'result': decode_result(fn, item['result'])})
+        except Exception as e:
+            results.append({'error': str(e)})
+
+    return results
+
+
+async def batch_call_or_raise(w3: Web3, calls: list, block_identifier='latest') -> list:
+    """
+    Same as batch_call, but returns plain values and raises if any call failed.
+    """
+    values = []
+
+    for item in await batch_call(w3, calls, block_identifier):
+        if 'error' in item:
+            raise ValueError(item['error'])
+        values.append(item['result'])
+
+    return values
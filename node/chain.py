@@ -0,0 +1,39 @@
+import json
+import os
+import sys
+
+from web3 import Web3
+
+from node.async_contract import AsyncContract, async_web3
+from node.rpc import rpc_stats
+
+# The process-wide connection to the node. Every router and background job uses this Web3 instance, whose provider
+# keeps a pool of keep-alive connections, and this contract object, whose ABI is processed once at import.
+# SERVER_ADDRESS may list several nodes, comma-separated, the primary first (see node/rpc.py).
+truffleFile = json.load(open('./contract/GuaranteeToken.json'))
+ABI = truffleFile['abi']
+
+contract_address_env = os.environ.get('CONTRACT_ADDRESS')
+server_address_env = os.environ.get('SERVER_ADDRESS')
+
+if contract_address_env is None:
+    print('Contract Address Environment Variable Missing!!')
+    sys.exit(1)
+
+if server_address_env is None:
+    print('Server Address Environment Variable Missing!!')
+    sys.exit(1)
+
+CONTRACT_ADDRESS = Web3.toChecksumAddress(contract_address_env)
+
+w3 = async_web3(server_address_env)
+
+contract_instance = AsyncContract(w3, ABI, CONTRACT_ADDRESS)
+
+
+def rpc_timings() -> dict:
+    return rpc_stats.stats()
+
+
+async def close() -> None:
+    await w3.provider.close()
@@ -0,0 +1,15 @@
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+# Blocking work that has no async equivalent (bcrypt, JWT signing, ...) runs here instead of on the event loop.
+# The pool is bounded so a burst of requests queues up instead of spawning unlimited threads.
+BLOCKING_WORKERS = int(os.environ.get('BLOCKING_WORKERS', '8'))
+
+executor = ThreadPoolExecutor(max_workers=BLOCKING_WORKERS, thread_name_prefix='blocking')
+
+
+async def run_blocking(func, *args, **kwargs):
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(executor, functools.partial(func, *args, **kwargs))
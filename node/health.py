@@ -0,0 +1,161 @@
+import asyncio
+import datetime
+import json
+import os
+import time
+
+from node import chain
+from node.rpc import Endpoint, PooledHTTPProvider
+
+# Handlers used to call isConnected() (a web3_clientVersion round trip) before any real work. Instead, every worker
+# probes the node in the background and handlers check the cached state, failing fast while the node is down.
+HEALTH_INTERVAL = float(os.environ.get('HEALTH_INTERVAL', '2'))
+HEALTH_TIMEOUT = float(os.environ.get('HEALTH_TIMEOUT', '2'))
+# Consecutive failed requests or probes that open the circuit
+HEALTH_FAILURE_THRESHOLD = int(os.environ.get('HEALTH_FAILURE_THRESHOLD', '3'))
+# A node this many blocks behind its peers serves stale state and counts as unavailable
+HEALTH_MAX_SYNC_LAG = int(os.environ.get('HEALTH_MAX_SYNC_LAG', '64'))
+
+CLOSED = 'closed'
+OPEN = 'open'
+
+# Latest block and sync status in one batch request
+PROBE_BODY = json.dumps([{'jsonrpc': '2.0', 'id': 0, 'method': 'eth_getBlockByNumber', 'params': ['latest', False]},
+                         {'jsonrpc': '2.0', 'id': 1, 'method': 'eth_syncing', 'params': []}]).encode('utf-8')
+
+
+def quantity(value) -> int:
+    return int(value, 16) if isinstance(value, str) else value
+
+
+class NodeHealth:
+    """
+    Circuit breaker in front of the nodes. It opens after `failure_threshold` consecutive failures, counting both the
+    background probes and requests of the shared client that could not reach any node, and closes again on the first
+    success. While it is open, available() is False without any request being sent.
+
+    Every probe asks each node of the shared client for its latest block and sync status. A node that answers is taken
+    back into rotation if it was ejected, and its block number decides whether it is in sync enough to serve reads.
+
+    Without a recent probe (the monitor is not running, e.g. in scripts), available() probes inline.
+    """
+
+    def __init__(self, provider: PooledHTTPProvider, interval: float, timeout: float, failure_threshold: int,
+                 max_sync_lag: int):
+        self.provider = provider
+        self.interval = interval
+        self.timeout = timeout
+        self.failure_threshold = failure_threshold
+        self.max_sync_lag = max_sync_lag
+        self.state = CLOSED
+        self.failures = 0
+        self.last_error = None
+        self.opened_at = None
+        self.last_probe = None
+        self.probing = False
+        self.block_number = None
+        self.block_time = None
+        self.sync_lag = None
+
+    def record(self, reachable: bool, error: Exception = None) -> None:
+        if reachable:
+            self.failures = 0
+            if self.state == OPEN:
+                print('Node health: node reachable again, circuit closed')
+                self.state = CLOSED
+                self.opened_at = None
+            return
+
+        self.failures += 1
+        self.last_error = str(error) or type(error).__name__
+        if self.state == CLOSED and self.failures >= self.failure_threshold:
+            print(f'Node health: {self.failures} consecutive failures, circuit open ({self.last_error})')
+            self.state = OPEN
+            self.opened_at = datetime.datetime.utcnow()
+
+    async def probe_endpoint(self, endpoint: Endpoint) -> tuple:
+        """
+        :return: (latest block number, latest block timestamp, blocks still to sync) of one node
+        """
+        raw_response = await self.provider.send(endpoint, PROBE_BODY, 'health', self.timeout)
+        by_id = {item.get('id'): item for item in json.loads(raw_response)}
+        block, syncing = by_id.get(0, {}), by_id.get(1, {})
+        if block.get('result') is None:
+            raise ValueError(block.get('error', 'No latest block'))
+
+        status = syncing.get('result')
+        sync_lag = max(0, quantity(status['highestBlock']) - quantity(status['currentBlock'])) if status else 0
+
+        return quantity(block['result']['number']), quantity(block['result']['timestamp']), sync_lag
+
+    async def probe(self) -> None:
+        """
+        Probes every node at once. The breaker counts a success if any node answered.
+        """
+        self.probing = True
+        try:
+            endpoints = self.provider.endpoints
+            answers = await asyncio.gather(*[self.probe_endpoint(endpoint) for endpoint in endpoints],
+                                           return_exceptions=True)
+
+            reachable = [(endpoint, answer) for endpoint, answer in zip(endpoints, answers)
+                         if not isinstance(answer, BaseException)]
+            if not reachable:
+                raise answers[0]
+
+            highest = max(block_number for _, (block_number, _, _) in reachable)
+            for endpoint, (block_number, _, sync_lag) in reachable:
+                endpoint.block_number = block_number
+                endpoint.sync_lag = max(sync_lag, highest - block_number)
+
+            # The breaker follows the node in best shape
+            best, (self.block_number, self.block_time, _) = min(reachable, key=lambda pair: pair[0].sync_lag)
+            self.sync_lag = best.sync_lag
+
+            self.record(True)
+        except Exception as e:
+            self.record(False, e)
+        finally:
+            self.last_probe = time.monotonic()
+            self.probing = False
+
+    async def available(self) -> bool:
+        """
+        :return: True if requests may be sent to the node
+        """
+        if not self.probing and (self.last_probe is None or time.monotonic() - self.last_probe > 3 * self.interval):
+            await self.probe()
+
+        return self.healthy()
+
+    def healthy(self) -> bool:
+        return self.state == CLOSED and (self.sync_lag or 0) <= self.max_sync_lag
+
+    def status(self) -> dict:
+        return {'state': self.state,
+                'available': self.healthy(),
+                'blockNumber': self.block_number,
+                'blockAgeSeconds': None if self.block_time is None else round(time.time() - self.block_time, 1),
+                'syncLag': self.sync_lag,
+                'consecutiveFailures': self.failures,
+                'lastError': self.last_error,
+                'openedAt': None if self.opened_at is None else self.opened_at.strftime('%Y/%m/%d %H:%M:%S'),
+                'lastProbeSecondsAgo': None if self.last_probe is None else
+                round(time.monotonic() - self.last_probe, 1),
+                'endpoints': [endpoint.status() for endpoint in self.provider.endpoints]}
+
+    async def run(self) -> None:
+        while True:
+            await self.probe()
+            await asyncio.sleep(self.interval)
+
+
+node_health = NodeHealth(chain.w3.provider, HEALTH_INTERVAL, HEALTH_TIMEOUT, HEALTH_FAILURE_THRESHOLD,
+                         HEALTH_MAX_SYNC_LAG)
+chain.w3.provider.listeners.append(node_health.record)
+
+
+async def start_health_monitor() -> None:
+    # Every worker keeps its own view of the node, so no lease
+    await node_health.probe()
+    asyncio.ensure_future(node_health.run())
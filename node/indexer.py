@@ -0,0 +1,281 @@
+import asyncio
+import datetime
+import os
+import socket
+
+from sqlalchemy import or_, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from web3 import Web3
+from web3._utils.method_formatters import log_entry_formatter
+
+from database import DB, models
+from node.async_contract import rpc_request
+from node.chain import CONTRACT_ADDRESS, contract_instance, w3
+from node.health import node_health
+from node.multicall import aggregate
+
+approval_event = contract_instance.events.Approval()
+transfer_event = contract_instance.events.Transfer()
+
+APPROVAL_TOPIC = Web3.keccak(text='Approval(address,address,uint256)').hex()
+TRANSFER_TOPIC = Web3.keccak(text='Transfer(address,address,uint256)').hex()
+ZERO_ADDRESS = '0x0000000000000000000000000000000000000000'
+
+# Tuning knobs. START_BLOCK should be the contract deployment block so the first sync does not scan empty history.
+STATE_NAME = 'GuaranteeToken'
+START_BLOCK = int(os.environ.get('INDEXER_START_BLOCK', '0'))
+BLOCK_RANGE = int(os.environ.get('INDEXER_BLOCK_RANGE', '2000'))
+POLL_INTERVAL = float(os.environ.get('INDEXER_POLL_INTERVAL', '3'))
+CONFIRMATIONS = int(os.environ.get('INDEXER_CONFIRMATIONS', '0'))
+REORG_DEPTH = int(os.environ.get('INDEXER_REORG_DEPTH', '64'))
+MAX_LAG = int(os.environ.get('INDEXER_MAX_LAG', '5'))
+LEASE_SECONDS = 30
+
+# Set TOKEN_SOURCE=chain to bypass the index and always enumerate wallets from the node.
+TOKEN_SOURCE = os.environ.get('TOKEN_SOURCE', 'index')
+
+# gunicorn runs several workers. Only the worker holding the lease on the SyncState row writes the index.
+WORKER_ID = f'{socket.gethostname()}:{os.getpid()}'
+
+
+async def index_is_fresh(db: AsyncSession) -> bool:
+    """
+    :return: True if the index is close enough to the chain head to answer reads.
+    """
+    if TOKEN_SOURCE == 'chain':
+        return False
+
+    state = await db.get(models.SyncState, STATE_NAME)
+    if state is None:
+        return False
+
+    return await w3.eth.block_number - state.block_number <= MAX_LAG + CONFIRMATIONS
+
+
+async def owned_token_ids(db: AsyncSession, address: str, after: int = None, limit: int = None) -> list:
+    """
+    :param after: Only return token ids greater than this one
+    :param limit: Maximum number of ids returned
+    :return: Sorted token ids owned by `address`, answered from the ownership index.
+    """
+    query = select(models.Ownership.token_id).filter(models.Ownership.owner == address)
+    if after is not None:
+        query = query.filter(models.Ownership.token_id > after)
+
+    return (await db.scalars(query.order_by(models.Ownership.token_id).limit(limit))).all()
+
+
+async def approved_token_ids(db: AsyncSession, address: str, after: int = None, limit: int = None) -> list:
+    """
+    :param after: Only return token ids greater than this one
+    :param limit: Maximum number of ids returned
+    :return: Sorted token ids currently approved to `address`, answered from the approval index.
+    """
+    query = select(models.TokenApproval.token_id).filter(models.TokenApproval.approved == address)
+    if after is not None:
+        query = query.filter(models.TokenApproval.token_id > after)
+
+    return (await db.scalars(query.order_by(models.TokenApproval.token_id).limit(limit))).all()
+
+
+async def ensure_sync_state(db: AsyncSession, name: str = STATE_NAME) -> None:
+    if await db.get(models.SyncState, name):
+        return
+
+    db.add(models.SyncState(name=name, block_number=START_BLOCK - 1))
+    try:
+        await db.commit()
+    except IntegrityError:
+        # Another worker created it first
+        await db.rollback()
+
+
+async def acquire_lease(db: AsyncSession, name: str = STATE_NAME) -> bool:
+    """
+    Takes or renews the lease on a SyncState row, so a background job runs in only one gunicorn worker at a time.
+    """
+    now = datetime.datetime.utcnow()
+    result = await db.execute(update(models.SyncState)
+                              .filter(models.SyncState.name == name,
+                                      or_(models.SyncState.lease_owner == WORKER_ID,
+                                          models.SyncState.lease_until.is_(None),
+                                          models.SyncState.lease_until < now))
+                              .values(lease_owner=WORKER_ID,
+                                      lease_until=now + datetime.timedelta(seconds=LEASE_SECONDS))
+                              .execution_options(synchronize_session=False))
+    await db.commit()
+
+    return result.rowcount == 1
+
+
+def collect_events(logs: list) -> tuple:
+    """
+    Folds Approval/Transfer logs into the final state of every touched token.
+    ERC-721 resets the approved address on every transfer, so a Transfer clears it as well.
+
+    :return: ({token_id: (approved address or None, block_number)}, {token_id: (owner, block_number)})
+    """
+    approvals = {}
+    owners = {}
+
+    for log in sorted(logs, key=lambda x: (x['blockNumber'], x['logIndex'])):
+        topic = log['topics'][0].hex()
+        if topic == APPROVAL_TOPIC:
+            event = approval_event.processLog(log)
+            approved = event['args']['approved']
+            approvals[event['args']['tokenId']] = (None if approved == ZERO_ADDRESS else approved,
+                                                   event['blockNumber'])
+        elif topic == TRANSFER_TOPIC:
+            event = transfer_event.processLog(log)
+            approvals[event['args']['tokenId']] = (None, event['blockNumber'])
+            owners[event['args']['tokenId']] = (event['args']['to'], event['blockNumber'])
+
+    return approvals, owners
+
+
+async def write_approvals(db: AsyncSession, approvals: dict) -> None:
+    if not approvals:
+        return
+
+    rows = await db.scalars(select(models.TokenApproval)
+                            .filter(models.TokenApproval.token_id.in_(list(approvals.keys()))))
+    existing = {row.token_id: row for row in rows}
+
+    for token_id, (approved, block_number) in approvals.items():
+        row = existing.get(token_id)
+        if row is None:
+            db.add(models.TokenApproval(token_id=token_id, approved=approved, block_number=block_number))
+        else:
+            row.approved = approved
+            row.block_number = block_number
+
+
+async def write_owners(db: AsyncSession, owners: dict) -> None:
+    if not owners:
+        return
+
+    rows = await db.scalars(select(models.Ownership)
+                            .filter(models.Ownership.token_id.in_(list(owners.keys()))))
+    existing = {row.token_id: row for row in rows}
+
+    for token_id, (owner, block_number) in owners.items():
+        row = existing.get(token_id)
+        if row is None:
+            db.add(models.Ownership(token_id=token_id, owner=owner, block_number=block_number))
+        else:
+            row.owner = owner
+            row.block_number = block_number
+
+
+async def block_hash(block_number: int) -> str:
+    # Raw request: the PoA extraData field does not fit web3's block formatter
+    block = await rpc_request(w3, 'eth_getBlockByNumber', [hex(block_number), False])
+    return block['hash']
+
+
+async def rewind(db: AsyncSession, state: models.SyncState) -> None:
+    """
+    Handles a reorg below the checkpoint. Rows written from the last REORG_DEPTH blocks may come from orphaned
+    blocks, so they are re-read from the canonical chain and the checkpoint moves back to rescan that range.
+    """
+    fork_block = max(START_BLOCK - 1, state.block_number - REORG_DEPTH)
+    print(f'Reorg detected at block {state.block_number}, rewinding to {fork_block}')
+
+    owner_rows = (await db.scalars(select(models.Ownership)
+                                   .filter(models.Ownership.block_number > fork_block))).all()
+    approval_rows = (await db.scalars(select(models.TokenApproval)
+                                      .filter(models.TokenApproval.block_number > fork_block))).all()
+
+    # Read the repaired state of both tables at one block
+    head, owners = await aggregate(w3, [contract_instance.functions.ownerOf(row.token_id) for row in owner_rows])
+    _, approvals = await aggregate(w3, [contract_instance.functions.getApproved(row.token_id)
+                                        for row in approval_rows], head)
+
+    for row, item in zip(owner_rows, owners):
+        if 'error' in item:
+            # Token does not exist on the canonical chain
+            await db.delete(row)
+        else:
+            row.owner = item['result']
+            row.block_number = fork_block
+
+    for row, item in zip(approval_rows, approvals):
+        approved = item.get('result', ZERO_ADDRESS)
+        row.approved = None if approved == ZERO_ADDRESS else approved
+        row.block_number = fork_block
+
+    state.block_number = fork_block
+    state.block_hash = await block_hash(fork_block) if fork_block >= 0 else None
+    await db.commit()
+
+
+async def sync_once(db: AsyncSession) -> bool:
+    """
+    Indexes the next block range after the checkpoint.
+
+    :return: True if the index is still behind the chain head.
+    """
+    state = await db.get(models.SyncState, STATE_NAME)
+
+    # The checkpointed block must still be on the canonical chain
+    if state.block_hash and await block_hash(state.block_number) != state.block_hash:
+        await rewind(db, state)
+
+    head = await w3.eth.block_number - CONFIRMATIONS
+
+    from_block = state.block_number + 1
+    if from_block > head:
+        return False
+
+    to_block = min(head, from_block + BLOCK_RANGE - 1)
+    logs = await rpc_request(w3, 'eth_getLogs', [{
+        'address': CONTRACT_ADDRESS,
+        'fromBlock': hex(from_block),
+        'toBlock': hex(to_block),
+        'topics': [[APPROVAL_TOPIC, TRANSFER_TOPIC]]
+    }])
+    logs = [log_entry_formatter(log) for log in logs]
+
+    approvals, owners = collect_events(logs)
+    await write_approvals(db, approvals)
+    await write_owners(db, owners)
+
+    state.block_number = to_block
+    state.block_hash = await block_hash(to_block)
+    await db.commit()
+
+    print(f'Indexed blocks {from_block}-{to_block} ({len(logs)} logs)')
+    return to_block < head
+
+
+async def run_indexer() -> None:
+    while True:
+        if not node_health.healthy():
+            # Circuit open: wait for the health monitor instead of failing against the node every round
+            await asyncio.sleep(POLL_INTERVAL)
+            continue
+
+        async with DB.AsyncSessionLocal() as db:
+            try:
+                await ensure_sync_state(db)
+                if await acquire_lease(db):
+                    # The head, the logs up to it and the checkpoint hash must all come from the same node
+                    with w3.provider.pinned():
+                        while await sync_once(db):
+                            if not await acquire_lease(db):
+                                print('Indexer: lease lost, stopping this catch-up')
+                                break
+            except Exception as e:
+                print(f'Indexer error: {e}')
+                await db.rollback()
+
+        await asyncio.sleep(POLL_INTERVAL)
+
+
+async def start_indexer() -> None:
+    if os.environ.get('INDEXER_ENABLED', '1') == '0':
+        print('Chain indexer disabled')
+        return
+
+    asyncio.ensure_future(run_indexer())
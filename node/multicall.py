@@ -0,0 +1,147 @@
+import os
+
+from web3 import Web3
+
+from node.async_contract import AsyncContractFunction, codec_w3
+from node.batch import batch_call, decode_result
+
+# Optional Multicall3 deployment on the private chain. Without it, aggregated reads fall back to a JSON-RPC batch
+# pinned to the same block, which gives the same consistency at the cost of a larger request body.
+multicall_address_env = os.environ.get('MULTICALL_ADDRESS')
+
+# Calls per aggregate3 eth_call. Each chunk must fit in the node's eth_call gas cap.
+MULTICALL_SIZE = int(os.environ.get('MULTICALL_SIZE', '500'))
+
+MULTICALL_ABI = [
+    {
+        "inputs": [
+            {
+                "components": [
+                    {"internalType": "address", "name": "target", "type": "address"},
+                    {"internalType": "bool", "name": "allowFailure", "type": "bool"},
+                    {"internalType": "bytes", "name": "callData", "type": "bytes"}
+                ],
+                "internalType": "struct Multicall3.Call3[]",
+                "name": "calls",
+                "type": "tuple[]"
+            }
+        ],
+        "name": "aggregate3",
+        "outputs": [
+            {
+                "components": [
+                    {"internalType": "bool", "name": "success", "type": "bool"},
+                    {"internalType": "bytes", "name": "returnData", "type": "bytes"}
+                ],
+                "internalType": "struct Multicall3.Result[]",
+                "name": "returnData",
+                "type": "tuple[]"
+            }
+        ],
+        "stateMutability": "payable",
+        "type": "function"
+    }
+]
+
+
+# Built once; each call is bound to the caller's Web3 instance
+multicall_contract = codec_w3.eth.contract(abi=MULTICALL_ABI, address=Web3.toChecksumAddress(multicall_address_env)) \
+    if multicall_address_env else None
+
+
+async def multicall(w3: Web3, calls: list, block_number: int) -> list:
+    results = []
+
+    for start in range(0, len(calls), MULTICALL_SIZE):
+        chunk = calls[start:start + MULTICALL_SIZE]
+        encoded = [(fn.address, True, fn._encode_transaction_data()) for fn in chunk]
+
+        aggregate3 = AsyncContractFunction(w3, multicall_contract.functions.aggregate3(encoded))
+        returned = await aggregate3.call(block_identifier=block_number)
+
+        for fn, (success, return_data) in zip(chunk, returned):
+            if not success:
+                results.append({'error': 'execution reverted'})
+                continue
+            try:
+                results.append({'result': decode_result(fn, return_data)})
+            except Exception as e:
+                results.append({'error': str(e)})
+
+    return results
+
+
+async def aggregate(w3: Web3, calls: list, block_number: int = None) -> tuple:
+    """
+    Runs many contract view calls against one pinned block, so every result reflects the same chain state.
+
+    :param w3: Web3 instance
+    :param calls: Bound contract functions, e.g. contract_instance.functions.ownerOf(1)
+    :param block_number: Block to pin. Defaults to the current head.
+    :return: (block_number, [{'result': value} or {'error': message}, ...]) in the order of `calls`.
+    """
+    if block_number is None:
+        block_number = await w3.eth.block_number
+
+    if not calls:
+        return block_number, []
+
+    if multicall_address_env:
+        return block_number, await multicall(w3, calls, block_number)
+
+    return block_number, await batch_call(w3, calls, block_number)
+
+
+async def aggregate_or_raise(w3: Web3, calls: list, block_number: int = None) -> tuple:
+    """
+    Same as aggregate, but returns plain values and raises if any call failed.
+    """
+    block_number, results = await aggregate(w3, calls, block_number)
+
+    values = []
+    for item in results:
+        if 'error' in item:
+            raise ValueError(item['error'])
+        values.append(item['result'])
+
+    return block_number, values
+
+
+async def wallet_token_ids(w3: Web3, contract_instance, address: str, block_number: int = None) -> tuple:
+    """
+    Enumerates a wallet with balanceOf and tokenOfOwnerByIndex read at the same block.
+
+    :return: (block_number, token ids in index order)
+    """
+    block_number, (num_of_tokens,) = await aggregate_or_raise(w3, [contract_instance.functions.balanceOf(address)],
+                                                              block_number)
+
+    return await aggregate_or_raise(w3, [contract_instance.functions.tokenOfOwnerByIndex(address, n)
+                                         for n in range(num_of_tokens)], block_number)
+
+
+async def approved_token_ids(w3: Web3, contract_instance, address: str, after: int = None, limit: int = None,
+                             block_number: int = None) -> tuple:
+    """
+    Scans getApproved of every token id for `address`, in chunks of MULTICALL_SIZE read at the same block. Approvals
+    cannot be enumerated per wallet, so this is the slow path behind the approval index.
+
+    :param after: Only return token ids greater than this one
+    :param limit: Stop once this many ids were found
+    :return: (block_number, sorted token ids approved to `address`)
+    """
+    block_number, (max_id,) = await aggregate_or_raise(w3, [contract_instance.functions.getMaxTokenID()],
+                                                       block_number)
+    approved = []
+
+    for start in range(0 if after is None else after + 1, max_id, MULTICALL_SIZE):
+        token_ids = range(start, min(start + MULTICALL_SIZE, max_id))
+        _, results = await aggregate(w3, [contract_instance.functions.getApproved(tid) for tid in token_ids],
+                                     block_number)
+
+        # Burned tokens revert
+        approved += [tid for tid, item in zip(token_ids, results) if item.get('result') == address]
+        if limit is not None and len(approved) >= limit:
+            return block_number, approved[:limit]
+
+    return block_number, approved
@@ -0,0 +1,330 @@
+import asyncio
+import contextlib
+import contextvars
+import os
+import time
+import weakref
+from collections import deque
+
+import aiohttp
+from web3.providers.async_rpc import AsyncHTTPProvider
+
+from node.stats import latency_ms
+
+# Keep-alive connections to the node per process. web3's own AsyncHTTPProvider opens a new aiohttp session, and so a
+# new TCP connection, for every request.
+RPC_POOL_SIZE = int(os.environ.get('RPC_POOL_SIZE', '32'))
+# Seconds an idle connection is kept. geth closes idle HTTP connections after 120 seconds.
+RPC_KEEPALIVE_TIMEOUT = float(os.environ.get('RPC_KEEPALIVE_TIMEOUT', '60'))
+RPC_TIMEOUT = float(os.environ.get('RPC_TIMEOUT', '10'))
+# Latency samples kept per JSON-RPC method for /node/rpcStats
+RPC_STATS_WINDOW = int(os.environ.get('RPC_STATS_WINDOW', '1000'))
+
+# With several nodes in SERVER_ADDRESS (comma-separated, primary first): consecutive failures that eject a node, and
+# how long the first ejection lasts. Repeated ejections double up to RPC_EJECT_MAX seconds.
+RPC_EJECT_FAILURES = int(os.environ.get('RPC_EJECT_FAILURES', '3'))
+RPC_EJECT_SECONDS = float(os.environ.get('RPC_EJECT_SECONDS', '5'))
+RPC_EJECT_MAX = float(os.environ.get('RPC_EJECT_MAX', '120'))
+# Nodes more blocks than this behind the highest known block receive no reads
+RPC_MAX_READ_LAG = int(os.environ.get('RPC_MAX_READ_LAG', '4'))
+
+# Methods any node answers alike. Everything else (sends, personal_* unlocks, pending nonces, gas estimates against the
+# pending state) goes to the primary, whose transaction pool and unlocked accounts the writes depend on.
+READ_METHODS = frozenset([
+    'eth_call', 'eth_getBalance', 'eth_getCode', 'eth_blockNumber', 'eth_getBlockByNumber', 'eth_getBlockByHash',
+    'eth_getLogs', 'eth_getTransactionReceipt', 'eth_getTransactionByHash', 'eth_chainId', 'eth_gasPrice',
+    'eth_syncing', 'net_version', 'web3_clientVersion',
+])
+
+# A replica behind the block a read was pinned to answers with one of these; the read is then sent to the primary
+STALE_READ_MARKERS = (b'header not found', b'missing trie node', b'unknown block')
+
+# Weight of the latest sample in a node's moving average latency
+LATENCY_SMOOTHING = 0.2
+
+
+class RpcStats:
+    """
+    Call and error counts per JSON-RPC method, plus the latencies of the last `window` calls. Batches are recorded
+    under `batch:` and the methods they contain.
+    """
+
+    def __init__(self, window: int):
+        self.window = window
+        self.calls = {}
+        self.errors = {}
+        self.samples = {}
+
+    def record(self, method: str, latency: float, failed: bool) -> None:
+        if method not in self.samples:
+            self.samples[method] = deque(maxlen=self.window)
+            self.calls[method] = 0
+            self.errors[method] = 0
+
+        self.samples[method].append(latency)
+        self.calls[method] += 1
+        if failed:
+            self.errors[method] += 1
+
+    def stats(self) -> dict:
+        result = {}
+
+        for method in sorted(self.samples):
+            result[method] = {
+                'calls': self.calls[method],
+                'errors': self.errors[method],
+                'latencyMs': latency_ms(self.samples[method]),
+            }
+
+        return result
+
+
+rpc_stats = RpcStats(RPC_STATS_WINDOW)
+
+
+def read_only(methods) -> bool:
+    return all(method in READ_METHODS for method in methods)
+
+
+class Endpoint:
+    """
+    One node behind PooledHTTPProvider: its keep-alive sessions (one per event loop, as aiohttp sessions belong to
+    the loop that created them), moving average latency, and ejection state.
+    """
+
+    def __init__(self, uri: str, pool_size: int, keepalive_timeout: float, timeout: float):
+        self.uri = uri
+        self.pool_size = pool_size
+        self.keepalive_timeout = keepalive_timeout
+        self.timeout = timeout
+        self.sessions = weakref.WeakKeyDictionary()
+        self.latency = None
+        self.current_weight = 0.0
+        self.failures = 0
+        self.ejections = 0
+        self.ejected_until = 0.0
+        self.block_number = None
+        self.sync_lag = None
+        self.requests = 0
+
+    def session(self) -> aiohttp.ClientSession:
+        loop = asyncio.get_event_loop()
+        session = self.sessions.get(loop)
+
+        if session is None or session.closed:
+            connector = aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=self.keepalive_timeout,
+                                             ttl_dns_cache=300)
+            session = self.sessions[loop] = aiohttp.ClientSession(
+                connector=connector, timeout=aiohttp.ClientTimeout(total=self.timeout), raise_for_status=True)
+
+        return session
+
+    def ejected(self) -> bool:
+        return self.ejected_until > time.monotonic()
+
+    def record_success(self, latency: float) -> None:
+        self.latency = latency if self.latency is None else \
+            LATENCY_SMOOTHING * latency + (1 - LATENCY_SMOOTHING) * self.latency
+        self.failures = 0
+        if self.ejections:
+            print(f'RPC: {self.uri} answers again, back in rotation')
+        self.ejections = 0
+        self.ejected_until = 0.0
+
+    def record_failure(self, error: Exception) -> None:
+        if self.ejected():
+            # Requests that were in flight when it was ejected
+            return
+
+        self.failures += 1
+        if self.failures < RPC_EJECT_FAILURES:
+            return
+
+        self.ejections += 1
+        seconds = min(RPC_EJECT_SECONDS * 2 ** (self.ejections - 1), RPC_EJECT_MAX)
+        self.ejected_until = time.monotonic() + seconds
+        # Once the ejection ends, a single failure ejects it again
+        self.failures = RPC_EJECT_FAILURES - 1
+        print(f'RPC: ejected {self.uri} for {seconds:.0f}s ({str(error) or type(error).__name__})')
+
+    def status(self) -> dict:
+        return {'uri': self.uri,
+                'ejected': self.ejected(),
+                'latencyMs': None if self.latency is None else round(self.latency * 1000, 3),
+                'blockNumber': self.block_number,
+                'syncLag': self.sync_lag,
+                'requests': self.requests,
+                'consecutiveFailures': self.failures}
+
+    async def close(self) -> None:
+        session = self.sessions.pop(asyncio.get_event_loop(), None)
+        if session is not None:
+            await session.close()
+
+
+class PooledHTTPProvider(AsyncHTTPProvider):
+    """
+    AsyncHTTPProvider that sends every request over pooled keep-alive aiohttp sessions and times it per method.
+
+    `endpoint_uri` may list several nodes, comma-separated, the primary first. Reads go to the nodes in sync by
+    latency-weighted smooth round robin and move on to another node if one cannot be reached. Writes and every other
+    method go to the first node that is not ejected, and fail over to the next only if the connection could not be
+    made, so a request the node may have received is never sent twice. A node is ejected after RPC_EJECT_FAILURES
+    consecutive failures and taken back once it answers again, to a request or to a health probe. Requests that must
+    all see the same chain run inside pinned().
+    """
+
+    def __init__(self, endpoint_uri: str, pool_size: int = RPC_POOL_SIZE,
+                 keepalive_timeout: float = RPC_KEEPALIVE_TIMEOUT, timeout: float = RPC_TIMEOUT):
+        uris = [uri.strip() for uri in endpoint_uri.split(',') if uri.strip()]
+        super().__init__(uris[0])
+        self.endpoints = [Endpoint(uri, pool_size, keepalive_timeout, timeout) for uri in uris]
+        # Called with (True, None) after every answered request and (False, error) when no node could be reached,
+        # see node/health.py
+        self.listeners = []
+        # Node every request goes to inside pinned()
+        self.pinned_endpoint = contextvars.ContextVar(f'pinned_endpoint_{id(self)}', default=None)
+
+    @contextlib.contextmanager
+    def pinned(self):
+        """
+        Sends every request made inside the block, reads included, to the first node in rotation and nowhere else.
+        For requests that must all see the same chain, e.g. a log range read up to a head read just before: a replica
+        a few blocks behind returns the part of the range it has without an error.
+        """
+        token = self.pinned_endpoint.set(self.writer_order()[0])
+        try:
+            yield
+        finally:
+            self.pinned_endpoint.reset(token)
+
+    def writer_order(self) -> list:
+        """
+        :return: Nodes in the order writes try them: the ones in rotation by priority, then the ejected ones by the
+                 end of their ejection, so a request still has somewhere to go when every node is ejected
+        """
+        in_rotation = [endpoint for endpoint in self.endpoints if not endpoint.ejected()]
+        ejected = sorted((endpoint for endpoint in self.endpoints if endpoint.ejected()),
+                         key=lambda endpoint: endpoint.ejected_until)
+        return in_rotation + ejected
+
+    def pick_reader(self) -> Endpoint:
+        """
+        Smooth weighted round robin over the nodes in rotation and in sync. A node's weight is the inverse of its
+        average latency, so a node twice as fast gets twice the reads while the slower one still gets some.
+        """
+        known = [endpoint.block_number for endpoint in self.endpoints if endpoint.block_number is not None]
+        highest = max(known) if known else None
+        readers = [endpoint for endpoint in self.endpoints if not endpoint.ejected() and
+                   (highest is None or endpoint.block_number is None or
+                    highest - endpoint.block_number <= RPC_MAX_READ_LAG)]
+        if not readers:
+            return self.writer_order()[0]
+
+        measured = [endpoint.latency for endpoint in readers if endpoint.latency is not None]
+        # Unmeasured nodes get the best latency seen, so they are tried soon
+        default_latency = min(measured) if measured else 1.0
+        weights = [1 / max(endpoint.latency or default_latency, 1e-4) for endpoint in readers]
+
+        for endpoint, weight in zip(readers, weights):
+            endpoint.current_weight += weight
+        chosen = max(readers, key=lambda endpoint: endpoint.current_weight)
+        chosen.current_weight -= sum(weights)
+
+        return chosen
+
+    async def send(self, endpoint: Endpoint, data: bytes, method: str, timeout: float = None) -> bytes:
+        """
+        Posts a raw JSON-RPC body to one node and records its latency under `method` and for the node.
+        """
+        started = time.perf_counter()
+        failed = True
+        endpoint.requests += 1
+
+        # Without a timeout of its own, the request keeps the session's; passing None would disable it
+        kwargs = {'timeout': aiohttp.ClientTimeout(total=timeout)} if timeout else {}
+
+        try:
+            async with endpoint.session().post(endpoint.uri, data=data, headers=self.get_request_headers(),
+                                               **kwargs) as response:
+                raw_response = await response.read()
+            failed = False
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            endpoint.record_failure(e)
+            raise
+        finally:
+            rpc_stats.record(method, time.perf_counter() - started, failed)
+
+        endpoint.record_success(time.perf_counter() - started)
+        return raw_response
+
+    async def post(self, data: bytes, method: str, read: bool) -> bytes:
+        """
+        Posts a raw JSON-RPC body to the node chosen for it, failing over as described on the class.
+
+        :param method: Label for the timings, e.g. the method or `batch:` and the methods of a batch
+        :param read: True if every method in the body is in READ_METHODS
+        """
+        pinned = self.pinned_endpoint.get()
+        if pinned is not None:
+            try:
+                raw_response = await self.send(pinned, data, method)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                # Other nodes may still answer
+                if len(self.endpoints) == 1:
+                    self.notify(False, e)
+                raise
+            self.notify(True, None)
+            return raw_response
+
+        writers = self.writer_order()
+        if read:
+            reader = self.pick_reader()
+            candidates = [reader] + [endpoint for endpoint in writers if endpoint is not reader]
+        else:
+            candidates = writers
+
+        error = None
+        for endpoint in candidates:
+            try:
+                raw_response = await self.send(endpoint, data, method)
+            except aiohttp.ClientConnectorError as e:
+                # Not connected, so the node never saw the request
+                error = e
+                continue
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                error = e
+                if read:
+                    continue
+                break
+
+            if read and endpoint is not writers[0] and any(marker in raw_response for marker in STALE_READ_MARKERS):
+                # A replica behind the block the read asks for
+                try:
+                    raw_response = await self.send(writers[0], data, method)
+                except (aiohttp.ClientError, asyncio.TimeoutError):
+                    pass
+
+            self.notify(True, None)
+            return raw_response
+
+        self.notify(False, error)
+        raise error
+
+    def notify(self, reachable: bool, error: Exception) -> None:
+        for listener in self.listeners:
+            listener(reachable, error)
+
+    async def make_request(self, method, params):
+        request_data = self.encode_rpc_request(method, params)
+        raw_response = await self.post(request_data, method, method in READ_METHODS)
+        response = self.decode_rpc_response(raw_response)
+
+        if 'error' in response:
+            rpc_stats.errors[method] += 1
+
+        return response
+
+    async def close(self) -> None:
+        for endpoint in self.endpoints:
+            await endpoint.close()
@@ -0,0 +1,150 @@
+import glob
+import hashlib
+import hmac
+import json
+import os
+import sys
+import time
+
+from eth_account import Account
+from hexbytes import HexBytes
+from web3 import Web3
+
+from node.executor import run_blocking
+
+# TX_SIGNER=local decrypts wallet keystores and signs transactions in-process, then relays them with
+# eth_sendRawTransaction. The default, node, keeps unlocking the account inside geth (personal_unlockAccount) on
+# every write, which runs geth's scrypt keystore decryption each time.
+TX_SIGNER = os.environ.get('TX_SIGNER', 'node')
+
+# geth's own keystore directory (UTC--...--<address> files), shared with the node, e.g. as a read-only mount. Wallets
+# are always created inside geth, so every instance and both signer modes see the same accounts.
+keystore_dir_env = os.environ.get('KEYSTORE_DIR')
+
+# Seconds a decrypted key stays in memory after its password was checked
+KEY_CACHE_TTL = float(os.environ.get('KEY_CACHE_TTL', '300'))
+
+if TX_SIGNER == 'local' and keystore_dir_env is None:
+    print('Keystore Directory Environment Variable Missing!!')
+    sys.exit(1)
+
+
+class LocalSigner:
+    """
+    Checks wallet passwords against the keystore files and signs transactions with the decrypted keys. A decrypted
+    key is cached for `ttl` seconds together with a salted digest of the password that opened it, so repeated writes
+    skip the scrypt decryption while a wrong password is still rejected.
+    """
+
+    def __init__(self, keystore_dir: str, ttl: float):
+        self.keystore_dir = keystore_dir
+        self.ttl = ttl
+        self.salt = os.urandom(16)
+        self.keystores = {}
+        self.keys = {}  # address -> (private key, password digest, expires_at)
+        self.chain_id = None
+
+    def password_digest(self, password: str) -> bytes:
+        return hashlib.sha256(self.salt + password.encode('utf-8')).digest()
+
+    def scan(self) -> dict:
+        """
+        Reads every keystore file of the directory. Blocking, run it in the executor.
+        """
+        keystores = {}
+        for path in glob.glob(os.path.join(self.keystore_dir, '*')):
+            try:
+                with open(path) as f:
+                    keystore = json.load(f)
+                keystores[Web3.toChecksumAddress(keystore['address'])] = keystore
+            except (OSError, ValueError, KeyError):
+                continue
+
+        return keystores
+
+    async def keystore(self, address: str) -> dict:
+        if address not in self.keystores:
+            # Rescan, so accounts geth created after startup are found
+            self.keystores.update(await run_blocking(self.scan))
+
+        return self.keystores.get(address)
+
+    async def unlock(self, address: str, password: str) -> bool:
+        """
+        :return: True if `password` opens the keystore of `address`. The key then stays usable for `ttl` seconds.
+        """
+        digest = self.password_digest(password)
+        cached = self.keys.get(address)
+        if cached is not None and cached[2] > time.monotonic() and hmac.compare_digest(cached[1], digest):
+            return True
+
+        keystore = await self.keystore(address)
+        if keystore is None:
+            return False
+
+        try:
+            private_key = await run_blocking(Account.decrypt, keystore, password)
+        except ValueError:
+            return False
+
+        self.keys[address] = (private_key, digest, time.monotonic() + self.ttl)
+        return True
+
+    def private_key(self, address: str) -> bytes:
+        cached = self.keys.get(address)
+        if cached is None or cached[2] <= time.monotonic():
+            self.keys.pop(address, None)
+            # Same wording as geth, so callers handle both signers alike
+            raise ValueError('authentication needed: password or unlock')
+
+        return cached[0]
+
+    async def sign_many(self, w3: Web3, transactions: list) -> list:
+        """
+        :param transactions: Complete transactions including nonce. gasPrice and chainId are filled in.
+        :return: Raw signed transactions
+        """
+        if self.chain_id is None:
+            chain_id = await w3.manager.coro_request('eth_chainId', [])
+            self.chain_id = int(chain_id, 16) if isinstance(chain_id, str) else chain_id
+
+        gas_price = await w3.eth.gas_price
+        unsigned = [dict(tx, chainId=self.chain_id) for tx in transactions]
+        for tx in unsigned:
+            if 'gasPrice' not in tx and 'maxFeePerGas' not in tx:
+                tx['gasPrice'] = gas_price
+
+        keys = [self.private_key(tx['from']) for tx in unsigned]
+
+        def sign() -> list:
+            return [Account.sign_transaction(tx, key).rawTransaction for tx, key in zip(unsigned, keys)]
+
+        # Pure Python ECDSA, a few milliseconds per transaction
+        return await run_blocking(sign)
+
+    async def sign(self, w3: Web3, transaction: dict) -> HexBytes:
+        return (await self.sign_many(w3, [transaction]))[0]
+
+
+signer = LocalSigner(keystore_dir_env, KEY_CACHE_TTL) if TX_SIGNER == 'local' else None
+
+
+async def unlock_account(w3: Web3, address: str, password: str) -> bool:
+    """
+    Checks the wallet password before a write: in-process with TX_SIGNER=local, otherwise by unlocking the account in
+    geth. Raises ValueError on a JSON-RPC error, like personal_unlockAccount.
+    """
+    if signer is not None:
+        return await signer.unlock(address, password)
+
+    return await w3.manager.coro_request('personal_unlockAccount', [address, password])
+
+
+async def new_account(w3: Web3, password: str) -> str:
+    """
+    Creates a wallet inside geth with either signer. Its keystore file lands in geth's keystore directory, which
+    TX_SIGNER=local reads as KEYSTORE_DIR.
+
+    :return: Address of the new wallet
+    """
+    return await w3.manager.coro_request('personal_newAccount', [password])
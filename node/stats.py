@@ -0,0 +1,11 @@
+def latency_ms(latencies: list) -> dict:
+    """
+    :param latencies: Samples in seconds, at least one
+    :return: avg, p50, p95 and max of the samples in milliseconds, as reported by the stats endpoints
+    """
+    latencies = sorted(latencies)
+
+    return {'avg': round(sum(latencies) / len(latencies) * 1000, 3),
+            'p50': round(latencies[len(latencies) // 2] * 1000, 3),
+            'p95': round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000, 3),
+            'max': round(latencies[-1] * 1000, 3)}
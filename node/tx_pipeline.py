@@ -0,0 +1,336 @@
+import asyncio
+import heapq
+import os
+import random
+import re
+
+import aiohttp
+from hexbytes import HexBytes
+from web3 import Web3
+
+from node.batch import batch_request
+from node.signer import signer
+
+# Transactions of one sender that may be between nonce allocation and the node's answer at the same time
+TX_MAX_IN_FLIGHT = int(os.environ.get('TX_MAX_IN_FLIGHT', '64'))
+TX_SUBMIT_RETRIES = int(os.environ.get('TX_SUBMIT_RETRIES', '5'))
+TX_RETRY_BACKOFF = float(os.environ.get('TX_RETRY_BACKOFF', '0.2'))
+
+NONCE_TOO_LOW = 'low'
+NONCE_TOO_HIGH = 'high'
+ALREADY_KNOWN = 'known'
+
+# geth / eth-tester messages for a nonce that is already used
+NONCE_USED_MESSAGES = ('nonce too low', 'replacement transaction underpriced')
+# geth messages for a transaction whose hash is already in the pool
+ALREADY_KNOWN_MESSAGES = ('already known', 'known transaction')
+
+
+def nonce_error(message: str) -> str:
+    """
+    :return: ALREADY_KNOWN if the node has this very transaction, NONCE_TOO_LOW if the nonce was already used (by this
+             or another worker), NONCE_TOO_HIGH if an earlier nonce has not reached the node yet, None for any other
+             error
+    """
+    message = message.lower()
+
+    if any(known in message for known in ALREADY_KNOWN_MESSAGES):
+        return ALREADY_KNOWN
+
+    if any(used in message for used in NONCE_USED_MESSAGES):
+        return NONCE_TOO_LOW
+
+    if 'nonce too high' in message:
+        return NONCE_TOO_HIGH
+
+    # eth-tester: "Invalid transaction nonce: Expected 6, but got 5"
+    expected = re.search(r'expected (\d+), but got (\d+)', message)
+    if expected:
+        return NONCE_TOO_LOW if int(expected.group(2)) < int(expected.group(1)) else NONCE_TOO_HIGH
+
+    return None
+
+
+def rpc_transaction(transaction: dict) -> dict:
+    return {key: hex(value) if isinstance(value, int) else value for key, value in transaction.items()}
+
+
+def transaction_hash(raw_transaction: HexBytes) -> HexBytes:
+    return HexBytes(Web3.keccak(raw_transaction))
+
+
+def maybe_delivered(error: Exception) -> bool:
+    """
+    :return: True if the request failed after it may have reached the node, e.g. a timeout waiting for the answer. The
+             node may then have accepted the transaction.
+    """
+    if isinstance(error, aiohttp.ClientConnectorError):
+        # Never connected
+        return False
+
+    return isinstance(error, (aiohttp.ClientError, asyncio.TimeoutError, ConnectionError))
+
+
+class SenderState:
+    __slots__ = ('lock', 'semaphore', 'next_nonce', 'released', 'in_flight')
+
+    def __init__(self, max_in_flight: int):
+        self.lock = asyncio.Lock()
+        self.semaphore = asyncio.Semaphore(max_in_flight)
+        self.next_nonce = None
+        self.released = []  # heap of allocated nonces that were never used
+        self.in_flight = 0
+
+
+class TxPipeline:
+    """
+    Assigns nonces to outgoing transactions locally, so one wallet can have many transactions in flight instead of
+    each write waiting for geth to pick the nonce.
+
+    Nonces are tracked per sender and per process, without coordinating with the other gunicorn workers. Whenever a
+    sender has nothing in flight, its next nonce is re-read from the node's pending count, which already contains
+    every transaction the other workers sent. A nonce that turns out to be used anyway is answered by re-reading the
+    pending count and retrying with a fresh nonce. A nonce given back after a send the node rejected or never
+    received is reused by the next transaction, so no gap is left in front of the transactions that follow it. A send
+    that may have reached the node keeps its nonce, see deliver(). Retries back off exponentially.
+    """
+
+    def __init__(self, max_in_flight: int, retries: int, backoff: float):
+        self.max_in_flight = max_in_flight
+        self.retries = retries
+        self.backoff = backoff
+        self.senders = {}
+        self.stats = {'submitted': 0, 'retries': 0, 'resyncs': 0, 'failed': 0}
+
+    def sender_state(self, sender: str) -> SenderState:
+        state = self.senders.get(sender)
+        if state is None:
+            state = self.senders[sender] = SenderState(self.max_in_flight)
+        return state
+
+    async def allocate(self, w3: Web3, sender: str) -> int:
+        state = self.sender_state(sender)
+
+        async with state.lock:
+            if state.in_flight == 0 or state.next_nonce is None:
+                await self.refresh(w3, state, sender)
+
+            state.in_flight += 1
+
+            if state.released:
+                return heapq.heappop(state.released)
+
+            nonce = state.next_nonce
+            state.next_nonce += 1
+            return nonce
+
+    async def refresh(self, w3: Web3, state: SenderState, sender: str) -> None:
+        """
+        Re-reads the pending nonce. Called with state.lock held.
+        """
+        pending = await w3.eth.get_transaction_count(sender, 'pending')
+
+        # Given-back nonces below the pending count were used by another worker meanwhile
+        state.released = [nonce for nonce in state.released if nonce >= pending]
+        heapq.heapify(state.released)
+
+        if state.released or state.in_flight > 0:
+            state.next_nonce = max(state.next_nonce or 0, pending)
+        else:
+            # Nothing of ours is outstanding, so the node is authoritative (e.g. a transaction was dropped)
+            state.next_nonce = pending
+
+    async def resync(self, w3: Web3, sender: str) -> None:
+        state = self.sender_state(sender)
+        self.stats['resyncs'] += 1
+
+        async with state.lock:
+            await self.refresh(w3, state, sender)
+
+    def finish(self, sender: str, nonce: int, used: bool) -> None:
+        state = self.sender_state(sender)
+        state.in_flight -= 1
+
+        if not used:
+            heapq.heappush(state.released, nonce)
+
+    def sent(self, sender: str, nonce: int, tx_hash: HexBytes) -> HexBytes:
+        self.finish(sender, nonce, used=True)
+        self.stats['submitted'] += 1
+        return tx_hash
+
+    @staticmethod
+    async def sign(w3: Web3, transaction: dict) -> HexBytes:
+        """
+        :return: The raw signed transaction with a local signer, None when the node signs
+        """
+        if signer is None:
+            return None
+
+        return await signer.sign(w3, transaction)
+
+    @staticmethod
+    async def send(w3: Web3, transaction: dict, raw_transaction: HexBytes) -> HexBytes:
+        if raw_transaction is not None:
+            return await w3.eth.send_raw_transaction(raw_transaction)
+
+        return await w3.eth.send_transaction(transaction)
+
+    @staticmethod
+    async def known(w3: Web3, raw_transaction: HexBytes) -> bool:
+        """
+        :return: True if the node has the transaction, pending or mined
+        """
+        # The node the transaction was sent to, not a replica that may not have it yet
+        with w3.provider.pinned():
+            tx_hash = transaction_hash(raw_transaction).hex()
+            item = (await batch_request(w3, [('eth_getTransactionByHash', [tx_hash])]))[0]
+
+        return item.get('result') is not None
+
+    async def deliver(self, w3: Web3, transaction: dict, nonce: int = None, raw_transaction: HexBytes = None,
+                      delivered: bool = False) -> HexBytes:
+        """
+        Sends a transaction until the node has it. After a send that may have reached the node (a timeout, a dropped
+        connection), the same signed transaction is sent again at the same nonce; the node answers "already known"
+        if the first send got through. A transaction is signed again with a fresh nonce only once the node has
+        answered that its nonce is used by a different transaction, so it is never sent twice.
+
+        :param nonce: Nonce allocated to the transaction, None to allocate one
+        :param raw_transaction: The transaction signed at `nonce` with a local signer
+        :param delivered: True if an earlier send of `raw_transaction` may have reached the node
+        :return: Transaction hash. Raises the last error once retries are exhausted or the error is not retryable.
+        """
+        sender = transaction['from']
+        error = None
+
+        for attempt in range(self.retries):
+            if attempt:
+                self.stats['retries'] += 1
+                await asyncio.sleep(self.backoff * 2 ** (attempt - 1) * random.uniform(0.5, 1.5))
+
+            if nonce is None:
+                nonce = await self.allocate(w3, sender)
+                delivered = False
+                try:
+                    raw_transaction = await self.sign(w3, dict(transaction, nonce=nonce))
+                except Exception:
+                    self.finish(sender, nonce, used=False)
+                    raise
+
+            try:
+                return self.sent(sender, nonce, await self.send(w3, dict(transaction, nonce=nonce), raw_transaction))
+            except Exception as e:
+                error = e
+
+            kind = nonce_error(str(error)) if isinstance(error, ValueError) else None
+
+            if raw_transaction is not None and (kind == ALREADY_KNOWN or kind == NONCE_TOO_LOW and delivered and
+                                                await self.known(w3, raw_transaction)):
+                # An earlier send got through; the nonce too low means it is mined already
+                return self.sent(sender, nonce, transaction_hash(raw_transaction))
+
+            if maybe_delivered(error):
+                if raw_transaction is None:
+                    # The node signs eth_sendTransaction, so the hash to look for is unknown and a second send could
+                    # not be told apart from the first. Keep the nonce out of reuse and give up.
+                    break
+                delivered = True
+            elif kind in (NONCE_TOO_LOW, ALREADY_KNOWN):
+                # Used by a different transaction (ALREADY_KNOWN here: another worker's identical eth_sendTransaction)
+                self.finish(sender, nonce, used=True)
+                nonce = None
+                await self.resync(w3, sender)
+            elif kind == NONCE_TOO_HIGH:
+                self.finish(sender, nonce, used=False)
+                nonce = None
+            elif not isinstance(error, (aiohttp.ClientError, ConnectionError)):
+                break
+
+        if nonce is not None:
+            # A nonce whose transaction may be in the pool must not be given to another transaction
+            self.finish(sender, nonce, used=delivered or maybe_delivered(error))
+        self.stats['failed'] += 1
+        raise error
+
+    async def submit(self, w3: Web3, transaction: dict) -> HexBytes:
+        """
+        Sends a transaction from an unlocked account with a locally assigned nonce.
+
+        :param transaction: Complete except for the nonce (from, to, data, gas, ...)
+        :return: Transaction hash. Raises the node's error once retries are exhausted or the error is not retryable.
+        """
+        async with self.sender_state(transaction['from']).semaphore:
+            return await self.deliver(w3, transaction)
+
+    async def submit_many(self, w3: Web3, transactions: list) -> list:
+        """
+        Sends transactions of one sender in JSON-RPC batches with consecutive nonces. Transactions the node rejects
+        are retried one by one through submit().
+
+        :return: Per transaction, in order: (hash, None) or (None, error message)
+        """
+        sender = transactions[0]['from']
+        nonces = [await self.allocate(w3, sender) for _ in transactions]
+
+        try:
+            if signer is not None:
+                raw_transactions = await signer.sign_many(w3, [dict(tx, nonce=nonce)
+                                                               for tx, nonce in zip(transactions, nonces)])
+                requests = [('eth_sendRawTransaction', [raw.hex()]) for raw in raw_transactions]
+            else:
+                raw_transactions = [None] * len(transactions)
+                requests = [('eth_sendTransaction', [rpc_transaction(dict(tx, nonce=nonce))])
+                            for tx, nonce in zip(transactions, nonces)]
+
+            responses = await batch_request(w3, requests)
+        except Exception as e:
+            if not maybe_delivered(e):
+                for nonce in nonces:
+                    self.finish(sender, nonce, used=False)
+                raise
+
+            # The node may have taken any of them: settle each at its own nonce, see deliver()
+            results = [None] * len(transactions)
+
+            async def resend(n: int) -> None:
+                try:
+                    results[n] = (await self.deliver(w3, transactions[n], nonces[n], raw_transactions[n], True),
+                                  None)
+                except Exception as error:
+                    results[n] = (None, str(error))
+
+            await asyncio.gather(*[resend(n) for n in range(len(transactions))])
+            return results
+
+        results = []
+        failed = []
+        for n, (nonce, raw_transaction, item) in enumerate(zip(nonces, raw_transactions, responses)):
+            kind = nonce_error(item['error']) if 'error' in item else None
+
+            if 'result' in item:
+                results.append((self.sent(sender, nonce, HexBytes(item['result'])), None))
+            elif kind == ALREADY_KNOWN and raw_transaction is not None:
+                results.append((self.sent(sender, nonce, transaction_hash(raw_transaction)), None))
+            else:
+                self.finish(sender, nonce, used=kind in (NONCE_TOO_LOW, ALREADY_KNOWN))
+                results.append((None, item['error']))
+                failed.append(n)
+
+        if failed:
+            if any(nonce_error(results[n][1]) in (NONCE_TOO_LOW, ALREADY_KNOWN) for n in failed):
+                await self.resync(w3, sender)
+
+            async def retry(n: int) -> None:
+                try:
+                    results[n] = (await self.submit(w3, transactions[n]), None)
+                except Exception as e:
+                    results[n] = (None, str(e))
+
+            # Errors other than nonce clashes (e.g. insufficient funds) would only fail again
+            await asyncio.gather(*[retry(n) for n in failed if nonce_error(results[n][1]) is not None])
+
+        return results
+
+
+tx_pipeline = TxPipeline(TX_MAX_IN_FLIGHT, TX_SUBMIT_RETRIES, TX_RETRY_BACKOFF)
@@ -0,0 +1,246 @@
+import asyncio
+import datetime
+import json
+import os
+import time
+
+from hexbytes import HexBytes
+from sqlalchemy import and_, delete, or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from web3._utils.method_formatters import receipt_formatter
+from web3.logs import DISCARD
+
+from database import DB, models
+from database.history_chain import mint_history_values
+from node import chain, indexer
+from node.batch import batch_request
+from node.health import node_health
+from node.validation import validation_cache
+from tokens.metadata import token_cache, token_to_dict
+
+# Settles the transactions that write endpoints send without waiting for them to be mined: their receipts are
+# polled in batches, and the ChainTransaction row and the History row the transaction wrote are marked confirmed or
+# failed. Mints that were not mined in time get their Token and History rows here.
+STATE_NAME = 'TxWatcher'
+WATCH_INTERVAL = float(os.environ.get('TX_WATCH_INTERVAL', '2'))
+WATCH_BATCH = int(os.environ.get('TX_WATCH_BATCH', '200'))
+# A transaction still unknown to the node this many seconds after it was sent was dropped from the pool
+DROP_TIMEOUT = float(os.environ.get('TX_DROP_TIMEOUT', '600'))
+# Settled transactions stay visible to /node/tx for this many days
+STATUS_RETENTION_DAYS = int(os.environ.get('TX_STATUS_RETENTION_DAYS', '7'))
+PRUNE_INTERVAL = 3600
+
+KIND_MINT = 'mint'
+KIND_TRANSFER = 'transfer'
+KIND_APPROVE = 'approve'
+
+
+def minted_token_ids(receipt) -> list:
+    """
+    :return: Ids of the tokens the transaction minted, read from its Transfer(0x0, to, tokenId) logs
+    """
+    events = indexer.transfer_event.processReceipt(receipt, errors=DISCARD)
+
+    return [event['args']['tokenId'] for event in events
+            if event['address'] == chain.CONTRACT_ADDRESS and event['args']['from'] == indexer.ZERO_ADDRESS]
+
+
+def mint_payload(minter: str, brand: str, product_name: str, production_date: datetime.date,
+                 expiration_date: datetime.date, details: str) -> str:
+    """
+    :return: The Token row of a mint whose token id is not known yet, for ChainTransaction.payload
+    """
+    return json.dumps({'minter': minter, 'brand': brand, 'product_name': product_name,
+                       'production_date': production_date.isoformat(),
+                       'expiration_date': expiration_date.isoformat(), 'details': details})
+
+
+def track(db: AsyncSession, tx_hash: HexBytes, kind: str, token_id: int = None, history_id: int = None,
+          payload: str = None) -> None:
+    """
+    Hands a sent transaction to the watcher. The caller commits, together with the rows the transaction wrote.
+    """
+    now = datetime.datetime.utcnow()
+    db.add(models.ChainTransaction(tx_hash=HexBytes(tx_hash).hex(), kind=kind, token_id=token_id,
+                                   history_id=history_id, payload=payload, status=models.TX_PENDING,
+                                   submitted_at=now, updated_at=now))
+
+
+def tx_status(tx: models.ChainTransaction) -> dict:
+    return {'txhash': tx.tx_hash,
+            'kind': tx.kind,
+            'status': tx.status,
+            'token_id': tx.token_id,
+            'block_number': tx.block_number,
+            'detail': tx.detail,
+            'submitted_at': tx.submitted_at.strftime('%Y/%m/%d %H:%M:%S'),
+            'updated_at': tx.updated_at.strftime('%Y/%m/%d %H:%M:%S')}
+
+
+async def write_minted_token(db: AsyncSession, tx: models.ChainTransaction, receipt) -> dict:
+    """
+    Writes the Token and mint History rows of a mint that was not mined in time for its request.
+
+    :return: {token_id: token info} for the token cache, or None if the receipt minted no single token
+    """
+    token_ids = minted_token_ids(receipt)
+    if len(token_ids) != 1:
+        return None
+
+    token_id = token_ids[0]
+    row = json.loads(tx.payload)
+    minter = row.pop('minter')
+    token = models.Token(token_id=token_id,
+                         production_date=datetime.date.fromisoformat(row.pop('production_date')),
+                         expiration_date=datetime.date.fromisoformat(row.pop('expiration_date')), **row)
+    tx.token_id = token_id
+
+    # Written already if a previous watcher run stopped after this point
+    if await db.get(models.Token, token_id) is None:
+        db.add(token)
+        db.add(models.History(**mint_history_values(token_id, minter, datetime.datetime.utcnow())))
+
+    return {token_id: token_to_dict(token)}
+
+
+async def settle(db: AsyncSession, tx: models.ChainTransaction, receipt, token_infos: dict) -> None:
+    tx.block_number = receipt['blockNumber']
+    tx.updated_at = datetime.datetime.utcnow()
+    tx.status = models.TX_CONFIRMED if receipt['status'] == 1 else models.TX_FAILED
+
+    if tx.status == models.TX_FAILED:
+        tx.detail = 'Transaction reverted.'
+    elif tx.kind == KIND_MINT and tx.payload is not None:
+        minted = await write_minted_token(db, tx, receipt)
+        if minted is None:
+            tx.status = models.TX_FAILED
+            tx.detail = 'Transaction minted no token.'
+        else:
+            token_infos.update(minted)
+
+    if tx.history_id is not None:
+        await db.execute(update(models.History)
+                         .filter(models.History.history_id == tx.history_id)
+                         .values(tx_status=tx.status)
+                         .execution_options(synchronize_session=False))
+
+
+async def drop_unknown(db: AsyncSession, unmined: list) -> None:
+    """
+    Fails transactions without a receipt that the node does not know at all any more.
+    """
+    responses = await batch_request(chain.w3, [('eth_getTransactionByHash', [tx.tx_hash]) for tx in unmined])
+
+    for tx, item in zip(unmined, responses):
+        if 'result' in item and item['result'] is None:
+            tx.status = models.TX_FAILED
+            tx.detail = 'Transaction was dropped by the node.'
+            tx.updated_at = datetime.datetime.utcnow()
+
+            if tx.history_id is not None:
+                await db.execute(update(models.History)
+                                 .filter(models.History.history_id == tx.history_id)
+                                 .values(tx_status=models.TX_FAILED)
+                                 .execution_options(synchronize_session=False))
+
+
+async def settle_batch(db: AsyncSession, after: tuple) -> tuple:
+    """
+    Polls the receipts of the next WATCH_BATCH pending transactions, oldest first, with one batch request.
+
+    :param after: (submitted_at, tx_hash) of the last transaction of the previous batch, None for the first batch
+    :return: (submitted_at, tx_hash) of the last transaction of this batch, None when no pending one is left
+    """
+    ChainTransaction = models.ChainTransaction
+    query = select(ChainTransaction).filter(ChainTransaction.status == models.TX_PENDING)
+    if after is not None:
+        query = query.filter(or_(ChainTransaction.submitted_at > after[0],
+                                 and_(ChainTransaction.submitted_at == after[0], ChainTransaction.tx_hash > after[1])))
+
+    pending = (await db.scalars(query.order_by(ChainTransaction.submitted_at, ChainTransaction.tx_hash)
+                                .limit(WATCH_BATCH))).all()
+    if not pending:
+        return None
+    last = (pending[-1].submitted_at, pending[-1].tx_hash)
+
+    responses = await batch_request(chain.w3, [('eth_getTransactionReceipt', [tx.tx_hash]) for tx in pending])
+    head = await chain.w3.eth.block_number - indexer.CONFIRMATIONS
+    drop_before = datetime.datetime.utcnow() - datetime.timedelta(seconds=DROP_TIMEOUT)
+
+    token_infos = {}
+    unmined = []
+    for tx, item in zip(pending, responses):
+        if 'error' in item:
+            continue
+
+        if item['result'] is None:
+            if tx.submitted_at < drop_before:
+                unmined.append(tx)
+            continue
+
+        receipt = receipt_formatter(item['result'])
+        if receipt['blockNumber'] > head:
+            continue
+
+        await settle(db, tx, receipt, token_infos)
+
+    if unmined:
+        await drop_unknown(db, unmined)
+
+    await db.commit()
+
+    for tx in pending:
+        if tx.status != models.TX_PENDING and tx.token_id is not None:
+            validation_cache.invalidate(tx.token_id)
+    await token_cache.put_many(token_infos)
+
+    settled = sum(1 for tx in pending if tx.status != models.TX_PENDING)
+    if settled:
+        print(f'Tx watcher: settled {settled} of {len(pending)} pending transaction(s)')
+
+    return last
+
+
+async def prune(db: AsyncSession) -> None:
+    cutoff = datetime.datetime.utcnow() - datetime.timedelta(days=STATUS_RETENTION_DAYS)
+    await db.execute(delete(models.ChainTransaction)
+                     .filter(models.ChainTransaction.status != models.TX_PENDING,
+                             models.ChainTransaction.submitted_at < cutoff)
+                     .execution_options(synchronize_session=False))
+    await db.commit()
+
+
+async def run_watcher() -> None:
+    last_prune = None
+
+    while True:
+        if not node_health.healthy():
+            await asyncio.sleep(WATCH_INTERVAL)
+            continue
+
+        async with DB.AsyncSessionLocal() as db:
+            try:
+                await indexer.ensure_sync_state(db, STATE_NAME)
+                if await indexer.acquire_lease(db, STATE_NAME):
+                    # A replica that never saw a transaction in its pool would have it dropped
+                    with chain.w3.provider.pinned():
+                        after = await settle_batch(db, None)
+                        while after is not None and await indexer.acquire_lease(db, STATE_NAME):
+                            after = await settle_batch(db, after)
+
+                    if last_prune is None or time.monotonic() - last_prune >= PRUNE_INTERVAL:
+                        last_prune = time.monotonic()
+                        await prune(db)
+            except Exception as e:
+                print(f'Tx watcher error: {e}')
+                await db.rollback()
+
+        await asyncio.sleep(WATCH_INTERVAL)
+
+
+async def start_watcher() -> None:
+    if os.environ.get('TX_WATCHER_ENABLED', '1') == '0':
+        print('Tx watcher disabled')
+        return
+
+    asyncio.ensure_future(run_watcher())
@@ -1,39 +1,49 @@
+import asyncio
 import datetime
-import json
 import os
 import jwt
-import sys
 
 from fastapi import APIRouter, Depends, Header
 from fastapi.responses import JSONResponse
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import Optional
-from web3 import Web3, HTTPProvider
-from web3.middleware import geth_poa_middleware
-
-from database import DB, models
-from node.DataClass import NoAuthAddress, Address, Transaction, Approval, Validation
+from hexbytes import HexBytes
+from web3 import Web3
+from web3._utils.method_formatters import receipt_formatter
+
+from database import DB, migrate, models
+from database.history_chain import add_transfer_histories, mint_history_values, new_history
+from account.session import session_cache
+from node import chain, indexer, tx_watcher, verifier
+from node.async_contract import AsyncContract, rpc_request, wait_for_receipt, wait_for_receipts
+from node.chain import CONTRACT_ADDRESS, contract_instance, w3
+from node.signer import unlock_account
+from node.batch import batch_request
+from node.tx_pipeline import rpc_transaction, tx_pipeline
+from node.tx_watcher import KIND_APPROVE, KIND_MINT, KIND_TRANSFER, minted_token_ids, mint_payload, track, \
+    tx_status
+from node.executor import run_blocking
+from node.health import node_health, start_health_monitor
+from node.multicall import aggregate, approved_token_ids as chain_approved_token_ids, wallet_token_ids
+from node.validation import CustodyChain, validation_cache
+from node.DataClass import NoAuthAddress, Address, BatchMint, BatchTransfer, Transaction, Approval, Validation, \
+    TokenPage
+from tokens.metadata import fetch_tokens, load_token_infos, token_cache, token_to_dict
 
 node_router = APIRouter()
 
-truffleFile = json.load(open('./contract/GuaranteeToken.json'))
-ABI = truffleFile['abi']
-
-contract_address_env = os.environ.get('CONTRACT_ADDRESS')
-server_address_env = os.environ.get('SERVER_ADDRESS')
-
-if contract_address_env is None:
-    print('Contract Address Environment Variable Missing!!')
-    sys.exit(1)
-
-if server_address_env is None:
-    print('Server Address Environment Variable Missing!!')
-    sys.exit(1)
+# /node/tokens and /node/getTokenInfo page size when the request has no limit, and the largest limit accepted
+TOKEN_PAGE_SIZE = int(os.environ.get('TOKEN_PAGE_SIZE', '100'))
+TOKEN_MAX_PAGE_SIZE = int(os.environ.get('TOKEN_MAX_PAGE_SIZE', '1000'))
 
-CONTRACT_ADDRESS = Web3.toChecksumAddress(contract_address_env)
+# Products per /node/mint/batch request
+MINT_BATCH_LIMIT = int(os.environ.get('MINT_BATCH_LIMIT', '500'))
+# Two storage slots going from zero to non-zero
+MINT_GAS_HEADROOM = 2 * 20000
 
-w3 = Web3(HTTPProvider(server_address_env))
-w3.middleware_onion.inject(geth_poa_middleware, layer=0)
+# Items per /node/transfer/batch request
+TRANSFER_BATCH_LIMIT = int(os.environ.get('TRANSFER_BATCH_LIMIT', '500'))
 
 
 def not_connected_exception() -> JSONResponse:
@@ -71,6 +81,13 @@ def invalid_approval_exception() -> JSONResponse:
     )
 
 
+def invalid_page_exception() -> JSONResponse:
+    return JSONResponse(
+        status_code=400,
+        content={'error': 'Page parameter is not valid!'}
+    )
+
+
 def invalid_login_token_exception() -> JSONResponse:
     return JSONResponse(
         status_code=401,
@@ -127,13 +144,7 @@ def invalid_token_info_input_exception() -> JSONResponse:
     )
 
 
-def validate_login_token(token: str) -> dict:
-    try:
-        db = next(DB.get_db())
-    except Exception:
-        print('DB instance error')
-        return {'result': 'invalid'}
-
+async def validate_login_token(token: str) -> dict:
     try:
         extracted = jwt.decode(token, algorithms='HS256', options={'verify_signature': False,
                                                                    'require': ['exp', 'uid']})
@@ -147,27 +158,36 @@ def validate_login_token(token: str) -> dict:
         print('Token TypeError')
         return {'result': 'invalid'}
 
-    try:
-        passphrase = db.query(models.User).filter(models.User.user_id == extracted['uid']).first().passphrase
-        validated = jwt.decode(token, algorithms='HS256', key=passphrase, options={'verify_signature': True,
-                                                                                   'require': ['exp', 'uid']})
-
-        if validated != extracted:
-            raise jwt.exceptions.InvalidSignatureError
-
-    except jwt.exceptions.InvalidSignatureError:
-        print('Token InvalidSignatureError')
-        return {'result': 'invalid'}
-    except jwt.exceptions.ExpiredSignatureError:
-        print('Token ExpiredSignatureError')
-        return {'result': 'invalid'}
-    except AttributeError:
-        # DB query returned NoneType
-        print('DB query returned NoneType')
-        return {'result': 'invalid'}
-    except TypeError:
-        # Somehow Token string has error
-        return {'result': 'invalid'}
+    if await session_cache.get(extracted['uid'], token):
+        # Verified against the current passphrase before; the expiry is still checked below
+        validated = extracted
+    else:
+        try:
+            async with DB.AsyncSessionLocal() as db:
+                user = (await db.scalars(select(models.User)
+                                         .filter(models.User.user_id == extracted['uid']))).first()
+            passphrase = user.passphrase
+            validated = jwt.decode(token, algorithms='HS256', key=passphrase, options={'verify_signature': True,
+                                                                                       'require': ['exp', 'uid']})
+
+            if validated != extracted:
+                raise jwt.exceptions.InvalidSignatureError
+
+        except jwt.exceptions.InvalidSignatureError:
+            print('Token InvalidSignatureError')
+            return {'result': 'invalid'}
+        except jwt.exceptions.ExpiredSignatureError:
+            print('Token ExpiredSignatureError')
+            return {'result': 'invalid'}
+        except AttributeError:
+            # DB query returned NoneType
+            print('DB query returned NoneType')
+            return {'result': 'invalid'}
+        except TypeError:
+            # Somehow Token string has error
+            return {'result': 'invalid'}
+
+        await session_cache.put(validated['uid'], token, int(validated['exp']))
 
     current_time = datetime.datetime.now().timestamp()
 
@@ -182,13 +202,106 @@ def is_string_blank(string):
     return not bool(string and string.strip())
 
 
+async def owned_token_ids(db: AsyncSession, contract_instance: AsyncContract, address: str, after: int = None,
+                          limit: int = None) -> list:
+    """
+    :param after: Only return token ids greater than this one
+    :param limit: Maximum number of ids returned
+    :return: Sorted token ids owned by `address`. Served from the ownership index while it is caught up,
+    otherwise enumerated from the chain.
+    """
+    if await indexer.index_is_fresh(db):
+        return await indexer.owned_token_ids(db, address, after, limit)
+
+    # balanceOf and every tokenOfOwnerByIndex call are read at one pinned block. Enumeration order follows
+    # transfers, not token ids, so the whole wallet is read and sorted before the page is cut.
+    _, result = await wallet_token_ids(w3, contract_instance, address)
+
+    result = sorted(tid for tid in result if after is None or tid > after)
+    return result[:limit] if limit is not None else result
+
+
+async def approved_token_ids(db: AsyncSession, contract_instance: AsyncContract, address: str, after: int = None,
+                             limit: int = None) -> list:
+    """
+    :param after: Only return token ids greater than this one
+    :param limit: Maximum number of ids returned
+    :return: Sorted token ids approved to `address`. Served from the approval index while it is caught up,
+    otherwise scanned from the chain.
+    """
+    if await indexer.index_is_fresh(db):
+        return await indexer.approved_token_ids(db, address, after, limit)
+
+    _, result = await chain_approved_token_ids(w3, contract_instance, address, after, limit)
+    return result
+
+
+def page_limit(page: TokenPage) -> int:
+    """
+    :return: Requested page size, or None if it is out of range
+    """
+    limit = page.limit if page.limit is not None else TOKEN_PAGE_SIZE
+    return limit if 0 < limit <= TOKEN_MAX_PAGE_SIZE else None
+
+
+def split_page(token_ids: list, limit: int) -> tuple:
+    """
+    :param token_ids: Up to limit + 1 ids; the extra one only signals that another page follows
+    :return: (ids of this page, cursor of the next page or None)
+    """
+    if len(token_ids) > limit:
+        return token_ids[:limit], token_ids[limit - 1]
+    return token_ids, None
+
+
+@node_router.on_event("startup")
+async def start_background_jobs():
+    # Normally a no-op: deploys run `python -m database.migrate` first. On a fresh database, migration 0 creates the
+    # core tables and the later ones build on them.
+    await run_blocking(migrate.upgrade, DB.engine)
+
+    await start_health_monitor()
+    await indexer.start_indexer()
+    await verifier.start_verifier()
+    await tx_watcher.start_watcher()
+
+
+@node_router.on_event("shutdown")
+async def close_chain_client():
+    await chain.close()
+
+
+@node_router.get("/health")
+async def get_node_health() -> JSONResponse:
+    """
+    :return: Circuit state, latest block and sync lag of the nodes as seen by this worker's health monitor, and the
+             latency and ejection state of each node. 503 while requests to the nodes are refused.
+    """
+    return JSONResponse(
+        status_code=200 if node_health.healthy() else 503,
+        content={'result': node_health.status()}
+    )
+
+
+@node_router.get("/rpcStats")
+async def get_rpc_stats() -> JSONResponse:
+    """
+    :return: Call count, error count and latency percentiles per JSON-RPC method sent to the node by this worker
+    """
+    return JSONResponse(
+        status_code=200,
+        content={'result': chain.rpc_timings()}
+    )
+
+
 @node_router.get("/")
-async def ping_server(db: Session = Depends(DB.get_db), x_access_token: Optional[str] = Header(None)) -> JSONResponse:
-    if w3.isConnected() is False:
+async def ping_server(db: AsyncSession = Depends(DB.get_db),
+                      x_access_token: Optional[str] = Header(None)) -> JSONResponse:
+    if not await node_health.available():
         return not_connected_exception()
 
     try:
-        db.query(models.History).filter(models.Token.token_id == 0).first()
+        (await db.scalars(select(models.History).filter(models.Token.token_id == 0))).first()
     except Exception:
         # DB connection Error
         return JSONResponse(
@@ -202,7 +315,7 @@ async def ping_server(db: Session = Depends(DB.get_db), x_access_token: Optional
             content={'status': 'Geth node is connected.'}
         )
 
-    result = validate_login_token(x_access_token)
+    result = await validate_login_token(x_access_token)
     if result.get('result', 'invalid') == 'invalid':
         return JSONResponse(
             status_code=200,
@@ -215,20 +328,35 @@ async def ping_server(db: Session = Depends(DB.get_db), x_access_token: Optional
         )
 
 
+def parse_product_dates(product) -> tuple:
+    """
+    :param product: Address or Product
+    :return: (production date, expiration date), or None if a field is blank or a date is malformed
+    """
+    if any(is_string_blank(value) for value in (product.product_name, product.prod_date, product.exp_date,
+                                                product.details)):
+        return None
+
+    try:
+        return (datetime.datetime.strptime(product.prod_date, "%Y-%m-%d").date(),
+                datetime.datetime.strptime(product.exp_date, "%Y-%m-%d").date())
+    except ValueError:
+        return None
+
+
 @node_router.post("/mint")
-async def mint_token(dest: Address, db: Session = Depends(DB.get_db),
+async def mint_token(dest: Address, db: AsyncSession = Depends(DB.get_db),
                      x_access_token: Optional[str] = Header(None)) -> JSONResponse:
-    if w3.isConnected() is False:
+    if not await node_health.available():
         return not_connected_exception()
 
     # Check login token validity
-    token_validity = validate_login_token(x_access_token)
+    token_validity = await validate_login_token(x_access_token)
 
     if token_validity.get('result', 'invalid') == 'invalid':
         return invalid_login_token_exception()
 
     # Check destination address
-    contract_instance = w3.eth.contract(abi=ABI, address=CONTRACT_ADDRESS)
     try:
         addr = dest.address
         destination = Web3.toChecksumAddress(addr)
@@ -236,20 +364,14 @@ async def mint_token(dest: Address, db: Session = Depends(DB.get_db),
         return address_invalid_exception()
 
     # Check if token info is valid
-    if is_string_blank(dest.product_name):
-        return invalid_token_info_input_exception()
-
-    if is_string_blank(dest.prod_date):
-        return invalid_token_info_input_exception()
-
-    if is_string_blank(dest.exp_date):
+    product_dates = parse_product_dates(dest)
+    if product_dates is None:
         return invalid_token_info_input_exception()
 
-    if is_string_blank(dest.details):
-        return invalid_token_info_input_exception()
+    production_date, expiration_date = product_dates
 
     # Check if user owns the wallet
-    wallet_user = db.query(models.User).filter(models.User.user_wallet == destination).first()
+    wallet_user = (await db.scalars(select(models.User).filter(models.User.user_wallet == destination))).first()
 
     if not wallet_user:
         return user_doesnt_exist_exception()
@@ -268,7 +390,7 @@ async def mint_token(dest: Address, db: Session = Depends(DB.get_db),
 
     # Unlock wallet
     try:
-        account_unlock = w3.geth.personal.unlock_account(destination, dest.wallet_password)
+        account_unlock = await unlock_account(w3, destination, dest.wallet_password)
     except ValueError as e:
         print(f'Error: {e}')
         return wallet_password_mismatch_exception()
@@ -281,39 +403,48 @@ async def mint_token(dest: Address, db: Session = Depends(DB.get_db),
     tx = contract_instance.functions.safeMint(destination)
 
     try:
-        result = tx.transact({'from': destination})
+        result = await tx.transact({'from': destination})
     except Exception as e:
         print(e)
         return invalid_transfer_exception()
 
-    # Add transaction history to K-V DB
-    tx_info = w3.eth.get_transaction(result.hex())
-    minter = tx_info['from']
-
-    # Get token id
-    sync_tid = contract_instance.functions.getMaxTokenID()
-
+    # The minted token id comes from the Transfer log of this very transaction, so concurrent mints cannot mix up
+    # their ids.
     try:
-        sync_result = sync_tid.transact({'from': destination})
-    except Exception as e:
-        print(e)
-        return invalid_transfer_exception()
-    else:
-        print(f'Sync Success: {sync_result.hex()}')
-
-    try:
-        token_id = sync_tid.call()
-        print(f'token_id: {token_id}')
+        receipt = await wait_for_receipt(w3, result)
+    except asyncio.TimeoutError:
+        # Not mined in time. The receipt watcher writes the Token and History rows once it is.
+        track(db, result, KIND_MINT, payload=mint_payload(destination, manufacturer_name, dest.product_name,
+                                                          production_date, expiration_date, dest.details))
+        await db.commit()
+        return JSONResponse(
+            status_code=200,
+            content={'result': 'pending', 'txhash': result.hex()}
+        )
     except Exception as e:
         print(f'Error: {e}')
         return node_sync_exception()
 
-    history = models.History(token_id=token_id, token_from=None, token_to=minter, event_time=datetime.datetime.utcnow())
+    token_ids = minted_token_ids(receipt)
+    if receipt['status'] != 1 or len(token_ids) != 1:
+        print(f'Mint failed: {result.hex()}')
+        return invalid_transfer_exception()
+
+    # Add transaction history to K-V DB. The transaction was sent from `destination`.
+    minter = destination
+    token_id = token_ids[0]
+    print(f'token_id: {token_id}')
+
+    history = await new_history(db, token_id, None, minter)
+    history.tx_status = models.TX_CONFIRMED
     token_info = models.Token(token_id=token_id, brand=manufacturer_name, product_name=dest.product_name,
-                              production_date=dest.prod_date, expiration_date=dest.exp_date, details=dest.details)
+                              production_date=production_date, expiration_date=expiration_date, details=dest.details)
     db.add(history)
     db.add(token_info)
-    db.commit()
+    await db.commit()
+    validation_cache.invalidate(token_id)
+
+    await token_cache.put_many({token_id: token_to_dict(token_info)})
 
     return JSONResponse(
         status_code=200,
@@ -321,26 +452,149 @@ async def mint_token(dest: Address, db: Session = Depends(DB.get_db),
     )
 
 
+def invalid_mint_batch_exception(invalid: list) -> JSONResponse:
+    return JSONResponse(
+        status_code=406,
+        content={'error': f'Give 1 to {MINT_BATCH_LIMIT} products with valid token info.', 'invalid': invalid}
+    )
+
+
+@node_router.post("/mint/batch")
+async def mint_token_batch(batch: BatchMint, db: AsyncSession = Depends(DB.get_db),
+                           x_access_token: Optional[str] = Header(None)) -> JSONResponse:
+    """
+    Mints one token per product for a production run. The login, wallet and unlock checks run once, every product
+    is validated before anything is sent, and the safeMint transactions go out in JSON-RPC batches with consecutive
+    nonces from the transaction pipeline instead of one round trip each. Token and History rows are inserted in bulk.
+
+    :return: Per product, in order: txhash and token_id, or txhash and an error. `pending` transactions were sent but
+             not mined in time; the receipt watcher writes their Token and History rows once they are.
+    """
+    if not await node_health.available():
+        return not_connected_exception()
+
+    # Check login token validity
+    token_validity = await validate_login_token(x_access_token)
+
+    if token_validity.get('result', 'invalid') == 'invalid':
+        return invalid_login_token_exception()
+
+    try:
+        destination = Web3.toChecksumAddress(batch.address)
+    except ValueError:
+        return address_invalid_exception()
+
+    # Check if token info is valid, for the whole batch before anything is minted
+    product_dates = [parse_product_dates(product) for product in batch.products]
+    invalid = [index for index, dates in enumerate(product_dates) if dates is None]
+    if invalid or not 0 < len(batch.products) <= MINT_BATCH_LIMIT:
+        return invalid_mint_batch_exception(invalid)
+
+    # Check if user owns the wallet
+    wallet_user = (await db.scalars(select(models.User).filter(models.User.user_wallet == destination))).first()
+
+    if not wallet_user:
+        return user_doesnt_exist_exception()
+
+    if wallet_user.user_id != token_validity['token']['uid']:
+        return user_doesnt_own_wallet_exception()
+
+    if wallet_user.user_type != "manufacturer":
+        return invalid_permission_exception()
+
+    # Unlock wallet
+    try:
+        account_unlock = await unlock_account(w3, destination, batch.wallet_password)
+    except ValueError as e:
+        print(f'Error: {e}')
+        return wallet_password_mismatch_exception()
+    else:
+        if account_unlock is False:
+            return wallet_password_mismatch_exception()
+
+    tx = contract_instance.functions.safeMint(destination)
+    base_tx = {'from': destination, 'to': CONTRACT_ADDRESS, 'data': tx._encode_transaction_data()}
+
+    try:
+        # One estimate covers the batch. The estimate may write zeros to the enumeration index slots (the wallet's
+        # first token, the contract's first token), which later mints of the batch write non-zero, so leave room
+        # for that. Unused gas is refunded.
+        base_tx['gas'] = await w3.eth.estimate_gas(base_tx) + MINT_GAS_HEADROOM
+        sent = await tx_pipeline.submit_many(w3, [base_tx] * len(batch.products))
+    except Exception as e:
+        print(e)
+        return invalid_transfer_exception()
+
+    tx_hashes = [tx_hash for tx_hash, _ in sent if tx_hash is not None]
+    receipt_by_hash = dict(zip(tx_hashes, await wait_for_receipts(w3, tx_hashes)))
+
+    results = []
+    token_rows = []
+    history_rows = []
+    now = datetime.datetime.utcnow()
+
+    for product, (production_date, expiration_date), (tx_hash, error) in zip(batch.products, product_dates, sent):
+        if tx_hash is None:
+            results.append({'txhash': None, 'error': error})
+            continue
+
+        receipt = receipt_by_hash[tx_hash]
+        if receipt is None:
+            track(db, tx_hash, KIND_MINT, payload=mint_payload(destination, wallet_user.manu_name,
+                                                               product.product_name, production_date,
+                                                               expiration_date, product.details))
+            results.append({'txhash': tx_hash.hex(), 'error': 'pending'})
+            continue
+
+        token_ids = minted_token_ids(receipt)
+        if receipt['status'] != 1 or len(token_ids) != 1:
+            results.append({'txhash': tx_hash.hex(), 'error': 'Mint transaction failed.'})
+            continue
+
+        token_id = token_ids[0]
+        results.append({'txhash': tx_hash.hex(), 'token_id': token_id})
+        token_rows.append({'token_id': token_id, 'brand': wallet_user.manu_name, 'product_name': product.product_name,
+                           'production_date': production_date, 'expiration_date': expiration_date,
+                           'details': product.details})
+        history_rows.append(mint_history_values(token_id, destination, now))
+
+    if token_rows:
+        await db.execute(models.Token.__table__.insert(), token_rows)
+        await db.execute(models.History.__table__.insert(), history_rows)
+    await db.commit()
+
+    if token_rows:
+        for row in token_rows:
+            validation_cache.invalidate(row['token_id'])
+        await token_cache.put_many({row['token_id']: token_to_dict(models.Token(**row)) for row in token_rows})
+
+    print(f'Batch mint: {len(token_rows)} of {len(batch.products)} minted')
+
+    return JSONResponse(
+        status_code=200,
+        content={'result': 'success' if len(token_rows) == len(batch.products) else 'partial', 'items': results}
+    )
+
+
 @node_router.post("/balance")
-async def check_balance(account: NoAuthAddress, db: Session = Depends(DB.get_db),
+async def check_balance(account: NoAuthAddress, db: AsyncSession = Depends(DB.get_db),
                         x_access_token: Optional[str] = Header(None)) -> JSONResponse:
-    if w3.isConnected() is False:
+    if not await node_health.available():
         return not_connected_exception()
 
     # Check login token validity
-    token_validity = validate_login_token(x_access_token)
+    token_validity = await validate_login_token(x_access_token)
 
     if token_validity.get('result', 'invalid') == 'invalid':
         return invalid_login_token_exception()
 
-    contract_instance = w3.eth.contract(abi=ABI, address=CONTRACT_ADDRESS)
     try:
         address = Web3.toChecksumAddress(account.address)
     except ValueError:
         return address_invalid_exception()
 
     # Check if user owns the wallet
-    wallet_user = db.query(models.User).filter(models.User.user_wallet == address).first()
+    wallet_user = (await db.scalars(select(models.User).filter(models.User.user_wallet == address))).first()
 
     if not wallet_user:
         return user_doesnt_own_wallet_exception()
@@ -351,7 +605,7 @@ async def check_balance(account: NoAuthAddress, db: Session = Depends(DB.get_db)
 
     balance = contract_instance.functions.balanceOf(address)
     try:
-        result = balance.call()
+        result = await balance.call()
     except Exception:
         return node_sync_exception()
 
@@ -362,25 +616,24 @@ async def check_balance(account: NoAuthAddress, db: Session = Depends(DB.get_db)
 
 
 @node_router.post("/tokens")
-async def get_token_list(account: NoAuthAddress, db: Session = Depends(DB.get_db),
+async def get_token_list(account: TokenPage, db: AsyncSession = Depends(DB.get_db),
                          x_access_token: Optional[str] = Header(None)) -> JSONResponse:
-    if w3.isConnected() is False:
+    if not await node_health.available():
         return not_connected_exception()
 
     # Check login token validity
-    token_validity = validate_login_token(x_access_token)
+    token_validity = await validate_login_token(x_access_token)
 
     if token_validity.get('result', 'invalid') == 'invalid':
         return invalid_login_token_exception()
 
-    contract_instance = w3.eth.contract(abi=ABI, address=CONTRACT_ADDRESS)
     try:
         address = Web3.toChecksumAddress(account.address)
     except ValueError:
         return address_invalid_exception()
 
     # Check if user owns the wallet
-    wallet_user = db.query(models.User).filter(models.User.user_wallet == address).first()
+    wallet_user = (await db.scalars(select(models.User).filter(models.User.user_wallet == address))).first()
 
     if not wallet_user:
         return user_doesnt_own_wallet_exception()
@@ -389,75 +642,58 @@ async def get_token_list(account: NoAuthAddress, db: Session = Depends(DB.get_db
     if wallet_user_id != token_validity['token']['uid']:
         return user_doesnt_own_wallet_exception()
 
-    balance = contract_instance.functions.balanceOf(address)
+    limit = page_limit(account)
+    if limit is None:
+        return invalid_page_exception()
+
     try:
-        num_of_tokens = balance.call()
+        result = await owned_token_ids(db, contract_instance, address, account.cursor, limit + 1)
     except Exception as e:
         print(f'Error: {e}')
         return node_sync_exception()
 
-    result = []
-    for n in range(num_of_tokens):
-        try:
-            tid = contract_instance.functions.tokenOfOwnerByIndex(address, n).call()
-        except Exception:
-            return node_sync_exception()
-        else:
-            result.append(tid)
+    result, next_cursor = split_page(result, limit)
 
     if wallet_user.user_type == "reseller":
-        # Get approved tokens
-        approved = []
+        # Get approved tokens, from the approval index while it is caught up
         try:
-            max_id = contract_instance.functions.getMaxTokenID().call()
+            approved = await approved_token_ids(db, contract_instance, wallet_user.user_wallet,
+                                                account.approved_cursor, limit + 1)
         except Exception as e:
-            print(e)
+            print(f'Error: {e}')
             return node_sync_exception()
-        else:
-            try:
-                for i in range(max_id):
-                    approved_address = contract_instance.functions.getApproved(i).call()
-                    if approved_address == wallet_user.user_wallet:
-                        # Approved token
-                        approved.append(i)
-            except Exception as e:
-                print(e)
-                return node_sync_exception()
-            else:
-                print("Approval token fetch successful")
-                result.sort()
-                return JSONResponse(
-                    status_code=200,
-                    content={'account': address, 'tokens': result, 'approved': approved}
-                )
-
-    result.sort()
+        approved, approved_next_cursor = split_page(approved, limit)
+        return JSONResponse(
+            status_code=200,
+            content={'account': address, 'tokens': result, 'approved': approved, 'next_cursor': next_cursor,
+                     'approved_next_cursor': approved_next_cursor}
+        )
+
     return JSONResponse(
         status_code=200,
-        content={'account': address, 'tokens': result}
+        content={'account': address, 'tokens': result, 'next_cursor': next_cursor}
     )
 
 
 @node_router.post("/getTokenInfo")
-async def get_token_info(account: NoAuthAddress, db: Session = Depends(DB.get_db),
+async def get_token_info(account: TokenPage, db: AsyncSession = Depends(DB.get_db),
                          x_access_token: Optional[str] = Header(None)) -> JSONResponse:
-    if w3.isConnected() is False:
+    if not await node_health.available():
         return not_connected_exception()
 
     # Check login token validity
-    token_validity = validate_login_token(x_access_token)
+    token_validity = await validate_login_token(x_access_token)
 
     if token_validity.get('result', 'invalid') == 'invalid':
         return invalid_login_token_exception()
 
-    contract_instance = w3.eth.contract(abi=ABI, address=CONTRACT_ADDRESS)
     try:
         address = Web3.toChecksumAddress(account.address)
     except ValueError:
         return address_invalid_exception()
 
     # Check if user owns the wallet
-    wallet_user = db.query(models.User).filter(models.User.user_wallet == address).first()
+    wallet_user = (await db.scalars(select(models.User).filter(models.User.user_wallet == address))).first()
 
     if not wallet_user:
         return user_doesnt_own_wallet_exception()
@@ -466,73 +702,32 @@ async def get_token_info(account: NoAuthAddress, db: Session = Depends(DB.get_db
     if wallet_user_id != token_validity['token']['uid']:
         return user_doesnt_own_wallet_exception()
 
-    balance = contract_instance.functions.balanceOf(address)
+    limit = page_limit(account)
+    if limit is None:
+        return invalid_page_exception()
+
     try:
-        num_of_tokens = balance.call()
+        result = await owned_token_ids(db, contract_instance, address, account.cursor, limit + 1)
     except Exception as e:
         print(f'Error: {e}')
         return node_sync_exception()
 
-    result = []
-    for n in range(num_of_tokens):
-        try:
-            tid = contract_instance.functions.tokenOfOwnerByIndex(address, n).call()
-        except Exception:
-            return node_sync_exception()
-        else:
-            result.append(tid)
+    result, next_cursor = split_page(result, limit)
 
     approvedInfo = []
+    approved_next_cursor = None
     if wallet_user.user_type == "reseller":
-        # Get approved tokens
-        approved = []
+        # Get approved tokens, from the approval index while it is caught up
         try:
-            max_id = contract_instance.functions.getMaxTokenID().call()
+            approved = await approved_token_ids(db, contract_instance, wallet_user.user_wallet,
+                                                account.approved_cursor, limit + 1)
         except Exception as e:
-            print(e)
+            print(f'Error: {e}')
             return node_sync_exception()
-        else:
-            try:
-                for i in range(max_id):
-                    approved_address = contract_instance.functions.getApproved(i).call()
-                    if approved_address == wallet_user.user_wallet:
-                        # Approved token
-                        approved.append(i)
-            except Exception as e:
-                print(e)
-                return node_sync_exception()
-            else:
-                print("Approval token fetch successful")
-
-            for tid in approved:
-                token = db.query(models.Token).filter(models.Token.token_id == tid).first()
-                if token is not None:
-                    tokenInfo = {"TokenID": token.token_id,
-                                 "Brand": token.brand,
-                                 "ProductName": token.product_name,
-                                 "ProductionDate": token.production_date.strftime("%Y-%m-%d"),
-                                 "ExpirationDate": token.expiration_date.strftime("%Y-%m-%d"),
-                                 "Details": token.details
-                                 }
-
-                    approvedInfo.append(tokenInfo)
-
-    tokenInfos = []
-    not_founded = []
-
-    for tokenID in result:
-        token = db.query(models.Token).filter(models.Token.token_id == tokenID).first()
-        if token is not None:
-            tokenInfo = {"TokenID": token.token_id,
-                         "Brand": token.brand,
-                         "ProductName": token.product_name,
-                         "ProductionDate": token.production_date.strftime("%Y-%m-%d"),
-                         "ExpirationDate": token.expiration_date.strftime("%Y-%m-%d"),
-                         "Details": token.details
-                         }
-            tokenInfos.append(tokenInfo)
-        else:
-            not_founded.append(tokenID)
+        approved, approved_next_cursor = split_page(approved, limit)
+        approvedInfo, _ = await load_token_infos(db, approved)
+
+    tokenInfos, not_founded = await load_token_infos(db, result)
 
     tokenInfos.sort(key=lambda x: x["TokenID"])
     if wallet_user.user_type == "reseller":
@@ -541,7 +736,9 @@ async def get_token_info(account: NoAuthAddress, db: Session = Depends(DB.get_db
             content={
                 "tokenInfo": tokenInfos,
                 "approvedInfo": approvedInfo,
-                "NotFounded": not_founded
+                "NotFounded": not_founded,
+                "next_cursor": next_cursor,
+                "approved_next_cursor": approved_next_cursor
             }
         )
     else:
@@ -549,24 +746,24 @@ async def get_token_info(account: NoAuthAddress, db: Session = Depends(DB.get_db
             status_code=200,
             content={
                 "tokenInfo": tokenInfos,
-                "NotFounded": not_founded
+                "NotFounded": not_founded,
+                "next_cursor": next_cursor
             }
         )
 
 
 @node_router.post("/transfer")
-async def transfer(body: Transaction, db: Session = Depends(DB.get_db),
+async def transfer(body: Transaction, db: AsyncSession = Depends(DB.get_db),
                    x_access_token: Optional[str] = Header(None)) -> JSONResponse:
-    if w3.isConnected() is False:
+    if not await node_health.available():
         return not_connected_exception()
 
     # Check login token validity
-    token_validity = validate_login_token(x_access_token)
+    token_validity = await validate_login_token(x_access_token)
 
     if token_validity.get('result', 'invalid') == 'invalid':
         return invalid_login_token_exception()
 
-    contract_instance = w3.eth.contract(abi=ABI, address=CONTRACT_ADDRESS)
     try:
         sender = Web3.toChecksumAddress(body.sender)
         receiver = Web3.toChecksumAddress(body.receiver)
@@ -579,7 +776,7 @@ async def transfer(body: Transaction, db: Session = Depends(DB.get_db),
     if sender == transactor:
         # Normal sending
         # Check if user owns the wallet
-        wallet_sender = db.query(models.User).filter(models.User.user_wallet == sender).first()
+        wallet_sender = (await db.scalars(select(models.User).filter(models.User.user_wallet == sender))).first()
 
         if not wallet_sender:
             return user_doesnt_own_wallet_exception()
@@ -591,7 +788,8 @@ async def transfer(body: Transaction, db: Session = Depends(DB.get_db),
     else:
         # Approval sending (By reseller)
         # Check if user owns the wallet
-        wallet_transactor = db.query(models.User).filter(models.User.user_wallet == transactor).first()
+        wallet_transactor = (await db.scalars(select(models.User)
+                                              .filter(models.User.user_wallet == transactor))).first()
 
         if not wallet_transactor:
             return user_doesnt_own_wallet_exception()
@@ -605,12 +803,12 @@ async def transfer(body: Transaction, db: Session = Depends(DB.get_db),
         if transactor_type != "reseller":
             return invalid_permission_exception()
 
-        if contract_instance.functions.getApproved(token_id).call() != transactor:
+        if await contract_instance.functions.getApproved(token_id).call() != transactor:
             return reseller_not_approved_exception()
 
     # Unlock wallet
     try:
-        account_unlock = w3.geth.personal.unlock_account(transactor, body.wallet_password)
+        account_unlock = await unlock_account(w3, transactor, body.wallet_password)
     except ValueError:
         return wallet_password_mismatch_exception()
     else:
@@ -620,19 +818,17 @@ async def transfer(body: Transaction, db: Session = Depends(DB.get_db),
             print('Account unlock successful')
 
     try:
-        result = contract_instance.functions.safeTransferFrom(sender, receiver, token_id).transact({'from': transactor})
+        result = await contract_instance.functions.safeTransferFrom(sender, receiver, token_id) \
+            .transact({'from': transactor})
     except Exception as e:
         print(e)
         return invalid_transfer_exception()
 
-    # Add result to K-V DB  -> SOMEHOW NOT WORKING
-    # tx_info = w3.eth.get_transaction(result.hex())
-    # receiver_from_tx = tx_info['to']  # Append to K-V DB
-
-    history = models.History(token_id=token_id, token_from=sender, token_to=receiver,
-                             event_time=datetime.datetime.utcnow())
-    db.add(history)
-    db.commit()
+    # Written right away as pending; the receipt watcher confirms it or marks it failed once the transaction is mined
+    history, = await add_transfer_histories(db, [(token_id, sender, receiver)], models.TX_PENDING)
+    track(db, result, KIND_TRANSFER, token_id=token_id, history_id=history.history_id)
+    await db.commit()
+    validation_cache.invalidate(token_id)
 
     return JSONResponse(
         status_code=200,
@@ -640,27 +836,179 @@ async def transfer(body: Transaction, db: Session = Depends(DB.get_db),
     )
 
 
+def invalid_transfer_batch_exception(invalid: list) -> JSONResponse:
+    return JSONResponse(
+        status_code=406,
+        content={'error': f'Give 1 to {TRANSFER_BATCH_LIMIT} items with valid addresses and distinct token ids.',
+                 'invalid': invalid}
+    )
+
+
+@node_router.post("/transfer/batch")
+async def transfer_batch(batch: BatchTransfer, db: AsyncSession = Depends(DB.get_db),
+                         x_access_token: Optional[str] = Header(None)) -> JSONResponse:
+    """
+    Transfers many tokens from one transactor, e.g. a reseller delivering a pallet. The login, wallet and unlock
+    checks run once. Ownership and approval of every item are read in one aggregated call pinned to a block, gas is
+    estimated in one JSON-RPC batch, and the transactions go out through the transaction pipeline. History rows are
+    written pending in one commit and settled by the receipt watcher.
+
+    :return: Per item, in order: tid and txhash, or tid and an error
+    """
+    if not await node_health.available():
+        return not_connected_exception()
+
+    # Check login token validity
+    token_validity = await validate_login_token(x_access_token)
+
+    if token_validity.get('result', 'invalid') == 'invalid':
+        return invalid_login_token_exception()
+
+    try:
+        transactor = Web3.toChecksumAddress(batch.transactor)
+    except ValueError:
+        return address_invalid_exception()
+
+    # Check every item before anything is sent
+    items = []
+    invalid = []
+    for index, item in enumerate(batch.items):
+        try:
+            items.append((Web3.toChecksumAddress(item.sender), Web3.toChecksumAddress(item.receiver), item.tid))
+        except ValueError:
+            invalid.append(index)
+
+    token_ids = [item.tid for item in batch.items]
+    if len(set(token_ids)) != len(token_ids):
+        invalid.extend(index for index, token_id in enumerate(token_ids) if token_ids.count(token_id) > 1)
+
+    if invalid or not 0 < len(batch.items) <= TRANSFER_BATCH_LIMIT:
+        return invalid_transfer_batch_exception(sorted(set(invalid)))
+
+    # Check if user owns the wallet
+    wallet_transactor = (await db.scalars(select(models.User).filter(models.User.user_wallet == transactor))).first()
+
+    if not wallet_transactor:
+        return user_doesnt_own_wallet_exception()
+
+    if wallet_transactor.user_id != token_validity['token']['uid']:
+        return user_doesnt_own_wallet_exception()
+
+    # Current owner and approved address of every token, read at the same block
+    calls = []
+    for _, _, token_id in items:
+        calls.append(contract_instance.functions.ownerOf(token_id))
+        calls.append(contract_instance.functions.getApproved(token_id))
+
+    try:
+        _, reads = await aggregate(w3, calls)
+    except Exception as e:
+        print(f'Error: {e}')
+        return node_sync_exception()
+
+    errors = [None] * len(items)
+    for n, (sender, _, _) in enumerate(items):
+        owner, approved = reads[2 * n], reads[2 * n + 1]
+
+        if 'error' in owner:
+            errors[n] = 'Token does not exist.'
+        elif owner['result'] != sender:
+            errors[n] = 'Sender does not own the token.'
+        elif sender != transactor:
+            # Approval sending (By reseller)
+            if wallet_transactor.user_type != "reseller":
+                errors[n] = 'Not authorized (Permission)'
+            elif approved.get('result') != transactor:
+                errors[n] = 'Reseller has no access to this token.'
+
+    transactions = {}
+    for n, (sender, receiver, token_id) in enumerate(items):
+        if errors[n] is None:
+            transactions[n] = {'from': transactor, 'to': CONTRACT_ADDRESS,
+                               'data': contract_instance.functions.safeTransferFrom(sender, receiver, token_id)
+                               ._encode_transaction_data()}
+
+    if transactions:
+        # Unlock wallet
+        try:
+            account_unlock = await unlock_account(w3, transactor, batch.wallet_password)
+        except ValueError:
+            return wallet_password_mismatch_exception()
+        else:
+            if account_unlock is False:
+                return wallet_password_mismatch_exception()
+
+        # Gas differs per item (e.g. a receiver's first token costs more), so every item gets its own estimate
+        try:
+            estimates = await batch_request(w3, [('eth_estimateGas', [rpc_transaction(tx)])
+                                                 for tx in transactions.values()])
+        except Exception as e:
+            print(e)
+            return invalid_transfer_exception()
+
+        for n, estimate in zip(list(transactions), estimates):
+            if 'error' in estimate:
+                errors[n] = 'Transfer cannot be made at the moment.'
+                del transactions[n]
+            else:
+                gas = estimate['result']
+                transactions[n]['gas'] = int(gas, 16) if isinstance(gas, str) else gas
+
+    sent = {}
+    if transactions:
+        try:
+            results = await tx_pipeline.submit_many(w3, list(transactions.values()))
+        except Exception as e:
+            print(e)
+            return invalid_transfer_exception()
+
+        for n, (tx_hash, error) in zip(transactions, results):
+            if tx_hash is None:
+                errors[n] = error
+            else:
+                sent[n] = tx_hash
+
+    if sent:
+        histories = await add_transfer_histories(db, [(items[n][2], items[n][0], items[n][1]) for n in sent],
+                                                 models.TX_PENDING)
+
+        for (n, tx_hash), history in zip(sent.items(), histories):
+            track(db, tx_hash, KIND_TRANSFER, token_id=history.token_id, history_id=history.history_id)
+        await db.commit()
+
+        for n in sent:
+            validation_cache.invalidate(items[n][2])
+
+    print(f'Batch transfer: {len(sent)} of {len(items)} sent')
+
+    return JSONResponse(
+        status_code=200,
+        content={'result': 'success' if len(sent) == len(items) else 'partial',
+                 'items': [{'tid': token_id, 'txhash': sent[n].hex()} if n in sent else
+                           {'tid': token_id, 'error': errors[n]} for n, (_, _, token_id) in enumerate(items)]}
+    )
+
+
 @node_router.post("/approve")
-async def approve(body: Approval, db: Session = Depends(DB.get_db),
+async def approve(body: Approval, db: AsyncSession = Depends(DB.get_db),
                   x_access_token: Optional[str] = Header(None)) -> JSONResponse:
-    if w3.isConnected() is False:
+    if not await node_health.available():
         return not_connected_exception()
 
     # Check login token validity
-    token_validity = validate_login_token(x_access_token)
+    token_validity = await validate_login_token(x_access_token)
 
     if token_validity.get('result', 'invalid') == 'invalid':
         return invalid_login_token_exception()
 
-    contract_instance = w3.eth.contract(abi=ABI, address=CONTRACT_ADDRESS)
-
     try:
         receiver = Web3.toChecksumAddress(body.receiver)
     except ValueError:
         return address_invalid_exception()
 
     # Check account type
-    approver = db.query(models.User).filter(models.User.user_id == token_validity['token']['uid']).first()
+    approver = (await db.scalars(select(models.User)
+                                 .filter(models.User.user_id == token_validity['token']['uid']))).first()
 
     if not approver:
         return user_doesnt_exist_exception()
@@ -668,7 +1016,7 @@ async def approve(body: Approval, db: Session = Depends(DB.get_db),
     if approver.user_type != "manufacturer":
         return invalid_permission_exception()
 
-    receiver = db.query(models.User).filter(models.User.user_wallet == receiver).first()
+    receiver = (await db.scalars(select(models.User).filter(models.User.user_wallet == receiver))).first()
 
     if not receiver:
         return user_doesnt_exist_exception()
@@ -687,7 +1035,7 @@ async def approve(body: Approval, db: Session = Depends(DB.get_db),
 
     # Unlock wallet
     try:
-        account_unlock = w3.geth.personal.unlock_account(approver_wallet, body.wallet_password)
+        account_unlock = await unlock_account(w3, approver_wallet, body.wallet_password)
     except ValueError:
         return wallet_password_mismatch_exception()
     else:
@@ -697,20 +1045,67 @@ async def approve(body: Approval, db: Session = Depends(DB.get_db),
             print('Account unlock successful')
 
     try:
-        contract_instance.functions.approve(receiver.user_wallet, token_id).transact({'from': approver_wallet})
+        result = await contract_instance.functions.approve(receiver.user_wallet, token_id) \
+            .transact({'from': approver_wallet})
     except Exception as e:
         print(e)
         return invalid_approval_exception()
 
+    track(db, result, KIND_APPROVE, token_id=token_id)
+    await db.commit()
+
     return JSONResponse(
         status_code=200,
-        content={'result': 'success'}
+        content={'result': 'success', 'txhash': result.hex()}
     )
 
 
+async def check_ownership(db: AsyncSession, token_id: int, owner: str) -> tuple:
+    """
+    Validation Process - Validate token by Key-Value tx storage. Key is token id and Value is a stack of account
+    address. Validation will check token id and see if the last element of the stack is the owner. Also,
+    the server will check if the token is from the manufacturer type address.
+
+    :param owner: Checksum address
+    :return: (CustodyChain, None) if `owner` holds the token, otherwise (CustodyChain or None, reason)
+    """
+    # The mint and sender/receiver checks only depend on the History rows, so they are memoized per token and
+    # only rows added since the last call are checked.
+    chain = await validation_cache.custody_chain(db, token_id)
+    return chain, ownership_detail(chain, owner)
+
+
+async def check_ownerships(db: AsyncSession, pairs: list) -> list:
+    """
+    Same as check_ownership for many (token_id, owner) pairs, with a fixed number of queries for the whole batch.
+
+    :return: (CustodyChain or None, reason or None) per pair, in order
+    """
+    chains = await validation_cache.custody_chains(db, list({token_id for token_id, _ in pairs}))
+    return [(chains[token_id], ownership_detail(chains[token_id], owner)) for token_id, owner in pairs]
+
+
+def ownership_detail(chain: CustodyChain, owner: str) -> str:
+    """
+    :return: None if the valid `chain` ends at `owner`, otherwise the reason
+    """
+    # Check whether transaction history exists or not
+    if chain is None:
+        return 'Cannot inquire transaction history.'
+
+    if chain.detail is not None:
+        return chain.detail
+
+    # Check whether last "token_to" equals to current owner or not
+    if Web3.toChecksumAddress(chain.tx_history[-1][-1]) != owner:
+        return 'Token not properly owned.'
+
+    return None
+
+
 @node_router.post("/validate")
-async def validate_token(body: Validation, db: Session = Depends(DB.get_db)) -> JSONResponse:
-    if w3.isConnected() is False:
+async def validate_token(body: Validation, db: AsyncSession = Depends(DB.get_db)) -> JSONResponse:
+    if not await node_health.available():
         return not_connected_exception()
 
     token_id = body.tid
@@ -720,86 +1115,92 @@ async def validate_token(body: Validation, db: Session = Depends(DB.get_db)) ->
     except ValueError:
         return address_invalid_exception()
 
-    # Validation Process - Validate token by Key-Value tx storage. Key is token id and Value is a stack of account
-    # address. Validation will check token id and see if the last element of the stack is the owner. Also,
-    # the server will check if the token is from the manufacturer type address.
-
-    # Get value from KV storage using token_id
-    tx_history = []
-    histories = db.query(models.History).filter(models.History.token_id == token_id).all()
-
-    if not histories:
-        histories = []
-
-    for history in histories:
-        tx_history.append([history.token_from, history.token_to])
+    chain, detail = await check_ownership(db, token_id, receiver)
 
-    # Check whether transaction history exists or not
-    if not tx_history:
+    if detail is not None:
         return JSONResponse(
             status_code=200,
-            content={'result': 'invalid', 'detail': 'Cannot inquire transaction history.'}
+            content={'result': 'invalid', 'detail': detail}
         )
 
-    # Check whether token minted properly or not
-    minter = db.query(models.User).filter(models.User.user_wallet == tx_history[0][-1]).first()
+    tx_history = chain.tx_history
 
-    if not minter:
-        return JSONResponse(
-            status_code=200,
-            content={'result': 'invalid', 'detail': 'Token is not properly minted.'}
-        )
+    token_info = (await fetch_tokens(db, [token_id])).get(token_id)
 
-    # Check whether first "token_from" equals to NULL or not
-    # print(tx_history[0][0])
-    if tx_history[0][0] is not None:
+    if token_info is not None:
         return JSONResponse(
             status_code=200,
-            content={'result': 'invalid', 'detail': 'Cannot verify whether token minted properly or not.'}
+            content={'result': 'valid', 'txHistory': tx_history, 'info': token_info}
         )
 
-    # Check whether first "token_to"'s user type equals to manufacturer or not
-    minter_type = minter.user_type
-    if minter_type != "manufacturer":
+    else:
         return JSONResponse(
             status_code=200,
-            content={'result': 'invalid', 'detail': 'Token minter is not manufacturer'}
+            content={'result': 'invalid', 'details': 'Token not found from the server.'}
         )
 
-    # Check whether current "token_to" equals to next "token_from" or not
-    for x in range(len(tx_history) - 1):
-        if tx_history[x][-1] != tx_history[x + 1][0]:
-            return JSONResponse(
-                status_code=200,
-                content={'result': 'invalid', 'detail': 'Sender and receiver does not match.'}
-            )
 
-    # Check whether last "token_to" equals to current owner or not
-    if Web3.toChecksumAddress(tx_history[-1][-1]) != receiver:
-        return JSONResponse(
-            status_code=200,
-            content={'result': 'invalid', 'detail': 'Token not properly owned.'}
-        )
+@node_router.get("/integrity")
+async def get_history_integrity(db: AsyncSession = Depends(DB.get_db)) -> JSONResponse:
+    """
+    :return: Tokens whose History chain failed the last background verification
+    """
+    audits = (await db.scalars(select(models.HistoryAudit).order_by(models.HistoryAudit.token_id))).all()
+
+    return JSONResponse(
+        status_code=200,
+        content={'result': [{'token_id': audit.token_id,
+                             'history_id': audit.history_id,
+                             'detail': audit.detail,
+                             'detected_at': audit.detected_at.strftime('%Y/%m/%d %H:%M:%S')} for audit in audits]}
+    )
+
+
+def invalid_tx_hash_exception() -> JSONResponse:
+    return JSONResponse(
+        status_code=406,
+        content={'error': 'Transaction hash is not valid!'}
+    )
 
-    token = db.query(models.Token).filter(models.Token.token_id == token_id).first()
 
-    if token is not None:
-        token_info = {
-            "TokenID": token.token_id,
-            "Brand": token.brand,
-            "ProductName": token.product_name,
-            "ProductionDate": token.production_date.strftime("%Y-%m-%d"),
-            "ExpirationDate": token.expiration_date.strftime("%Y-%m-%d"),
-            "Details": token.details
-        }
+@node_router.get("/tx/{tx_hash}")
+async def get_tx_status(tx_hash: str, db: AsyncSession = Depends(DB.get_db)) -> JSONResponse:
+    """
+    :return: pending, confirmed or failed for a transaction sent by this server, as settled by the receipt watcher.
+             Transactions the server does not track are looked up on the node.
+    """
+    try:
+        tx_hash = HexBytes(tx_hash).hex()
+    except ValueError:
+        return invalid_tx_hash_exception()
 
+    if len(tx_hash) != 66:
+        return invalid_tx_hash_exception()
+
+    tx = await db.get(models.ChainTransaction, tx_hash)
+    if tx is not None:
         return JSONResponse(
             status_code=200,
-            content={'result': 'valid', 'txHistory': tx_history, 'info': token_info}
+            content={'result': tx_status(tx)}
         )
 
+    try:
+        receipt = await rpc_request(w3, 'eth_getTransactionReceipt', [tx_hash])
+        if receipt is None and await rpc_request(w3, 'eth_getTransactionByHash', [tx_hash]) is None:
+            return JSONResponse(
+                status_code=404,
+                content={'error': 'Transaction not found.'}
+            )
+    except Exception as e:
+        print(f'Error: {e}')
+        return node_sync_exception()
+
+    if receipt is None:
+        status = models.TX_PENDING
     else:
-        return JSONResponse(
-            status_code=200,
-            content={'result': 'invalid', 'details': 'Token not found from the server.'}
-        )
+        status = models.TX_CONFIRMED if receipt_formatter(receipt)['status'] == 1 else models.TX_FAILED
+
+    return JSONResponse(
+        status_code=200,
+        content={'result': {'txhash': tx_hash, 'status': status}}
+    )
@@ -0,0 +1,229 @@
+import os
+from collections import OrderedDict
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import models
+from database.history_chain import row_hash
+
+VALIDATION_CACHE_SIZE = int(os.environ.get('VALIDATION_CACHE_SIZE', '10000'))
+
+TAMPERED = 'History has been tampered with.'
+
+
+class CustodyChain:
+    """
+    Result of walking a token's History rows up to last_history_id, whose stored chain_hash is head_hash.
+    `detail` is None while the chain is valid, otherwise the reason it is not. A broken chain stays broken, because
+    rows are only ever appended.
+    """
+
+    __slots__ = ('last_history_id', 'head_hash', 'tx_history', 'detail')
+
+    def __init__(self, last_history_id: int, head_hash: str, tx_history: list, detail: str = None):
+        self.last_history_id = last_history_id
+        self.head_hash = head_hash
+        self.tx_history = tx_history
+        self.detail = detail
+
+
+class ValidationCache:
+    """
+    Memoizes CustodyChain per token, keyed by (token_id, last history_id). A lookup loads the memoized head row and
+    the rows added after it. The head row's hash must be unchanged, and only the new rows are checked against the
+    verified chain, so every transfer is walked once. Older rows are re-checked by node/verifier.py, whose findings
+    in HistoryAudit are checked on every lookup.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+
+    def invalidate(self, token_id: int) -> None:
+        self.entries.pop(token_id, None)
+
+    def store(self, token_id: int, chain: CustodyChain) -> None:
+        self.entries[token_id] = chain
+        self.entries.move_to_end(token_id)
+
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    async def custody_chain(self, db: AsyncSession, token_id: int) -> CustodyChain:
+        """
+        :return: The chain of custody through the latest History row, or None if the token has no history.
+        """
+        chain = await self.walk_chain(db, token_id)
+        if chain is None or chain.detail is not None:
+            return chain
+
+        return with_audit(chain, await db.get(models.HistoryAudit, token_id))
+
+    async def custody_chains(self, db: AsyncSession, token_ids: list) -> dict:
+        """
+        Same as custody_chain for many tokens, with one query each for their History rows, minters and audits.
+
+        :return: {token_id: CustodyChain or None} for every id of `token_ids`
+        """
+        by_token = {}
+        for history in await db.scalars(select(models.History)
+                                        .filter(models.History.token_id.in_(token_ids))
+                                        .order_by(models.History.token_id, models.History.history_id)):
+            by_token.setdefault(history.token_id, []).append(history)
+
+        # (verified chain, rows after its head) of tokens whose memoized head row is unchanged
+        resumed = {}
+        for token_id, histories in by_token.items():
+            cached = self.entries.get(token_id)
+            if cached is None:
+                continue
+
+            head = next((n for n, history in enumerate(histories) if history.history_id == cached.last_history_id),
+                        None)
+            if head is not None and histories[head].chain_hash == cached.head_hash:
+                resumed[token_id] = (cached, histories[head + 1:])
+            else:
+                self.invalidate(token_id)
+
+        wallets = {histories[0].token_to for token_id, histories in by_token.items() if token_id not in resumed}
+        minters = await db.scalars(select(models.User).filter(models.User.user_wallet.in_(wallets)))
+        minters = {user.user_wallet: user for user in minters}
+        audits = await db.scalars(select(models.HistoryAudit).filter(models.HistoryAudit.token_id.in_(token_ids)))
+        audits = {audit.token_id: audit for audit in audits}
+        chains = {}
+        for token_id in token_ids:
+            histories = by_token.get(token_id)
+            if not histories:
+                chains[token_id] = None
+                continue
+
+            if token_id in resumed:
+                chain, histories = resumed[token_id]
+            else:
+                chain = check_mint(histories[0], minters.get(histories[0].token_to))
+                if chain.detail is not None:
+                    chains[token_id] = chain
+                    continue
+                histories = histories[1:]
+
+            chain = self.extend(token_id, chain, histories)
+            chains[token_id] = chain if chain.detail is not None else with_audit(chain, audits.get(token_id))
+
+        return chains
+
+    async def walk_chain(self, db: AsyncSession, token_id: int) -> CustodyChain:
+        cached = self.entries.get(token_id)
+
+        query = select(models.History).filter(models.History.token_id == token_id)
+        if cached is not None:
+            query = query.filter(models.History.history_id >= cached.last_history_id)
+
+        histories = (await db.scalars(query.order_by(models.History.history_id))).all()
+
+        if cached is not None:
+            head = histories[0] if histories else None
+            if head is None or head.history_id != cached.last_history_id or head.chain_hash != cached.head_hash:
+                # The memoized head row was changed or removed. Verify the whole chain again.
+                self.invalidate(token_id)
+                return await self.walk_chain(db, token_id)
+
+            chain = cached
+            histories = histories[1:]
+        elif histories:
+            chain = await verify_mint(db, histories[0])
+            if chain.detail is not None:
+                # Depends on the User table, which may still change, so it is not memoized
+                return chain
+            histories = histories[1:]
+        else:
+            return None
+
+        return self.extend(token_id, chain, histories)
+
+    def extend(self, token_id: int, chain: CustodyChain, histories: list) -> CustodyChain:
+        """
+        Checks `histories`, the rows after the head of the verified `chain`, and memoizes the result once settled.
+        """
+        if histories:
+            detail = chain.detail or check_links(chain.tx_history[-1][-1], chain.head_hash, histories)
+
+            # A new list, so a concurrent request still holding the previous entry is not affected
+            chain = CustodyChain(histories[-1].history_id, histories[-1].chain_hash,
+                                 chain.tx_history + [[history.token_from, history.token_to] for history in histories
+                                                     if history.tx_status != models.TX_FAILED],
+                                 detail)
+
+        # A pending transfer may still fail and drop out of the chain, so only settled chains are memoized
+        if not any(history.tx_status == models.TX_PENDING for history in histories):
+            self.store(token_id, chain)
+        return chain
+
+
+def with_audit(chain: CustodyChain, audit: models.HistoryAudit) -> CustodyChain:
+    # Rows before the memoized head are only re-checked by the verifier; honor what it found
+    if audit is None:
+        return chain
+
+    return CustodyChain(chain.last_history_id, chain.head_hash, chain.tx_history, audit.detail)
+
+
+async def verify_mint(db: AsyncSession, first: models.History) -> CustodyChain:
+    """
+    Checks the first History row of a token: it must come from nowhere and go to a manufacturer account.
+    """
+    minter = (await db.scalars(select(models.User).filter(models.User.user_wallet == first.token_to))).first()
+    return check_mint(first, minter)
+
+
+def check_mint(first: models.History, minter: models.User) -> CustodyChain:
+    """
+    Same as verify_mint, with the User row of first.token_to already loaded (None if there is none).
+    """
+    tx_history = [[first.token_from, first.token_to]]
+
+    def invalid(detail: str) -> CustodyChain:
+        return CustodyChain(first.history_id, first.chain_hash, tx_history, detail)
+
+    if first.chain_hash != row_hash(None, first):
+        return invalid(TAMPERED)
+
+    if not minter:
+        return invalid('Token is not properly minted.')
+
+    if first.token_from is not None:
+        return invalid('Cannot verify whether token minted properly or not.')
+
+    if minter.user_type != "manufacturer":
+        return invalid('Token minter is not manufacturer')
+
+    return CustodyChain(first.history_id, first.chain_hash, tx_history)
+
+
+def check_links(previous_to: str, prev_hash: str, histories: list) -> str:
+    """
+    Checks that every row extends the hash chain of the row before it and that its token_from is that row's
+    token_to. Every row has a chain_hash since migration 3, so a missing one counts as tampering. Rows of failed
+    transactions stay in the hash chain but are skipped by the link check.
+
+    :param previous_to: token_to of the last verified row
+    :param prev_hash: chain_hash of the last verified row
+    :return: None if the chain holds, otherwise the reason
+    """
+    for history in histories:
+        if history.chain_hash != row_hash(prev_hash, history):
+            return TAMPERED
+
+        prev_hash = history.chain_hash
+        if history.tx_status == models.TX_FAILED:
+            continue
+
+        if history.token_from != previous_to:
+            return 'Sender and receiver does not match.'
+
+        previous_to = history.token_to
+
+    return None
+
+
+validation_cache = ValidationCache(VALIDATION_CACHE_SIZE)
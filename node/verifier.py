@@ -0,0 +1,145 @@
+import asyncio
+import datetime
+import os
+import time
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import DB, models
+from database.history_chain import row_hash
+from node import indexer
+from node.validation import TAMPERED
+
+# Re-checks every History chain in the background, so tampering with rows that validation no longer re-reads is
+# still detected. Findings are kept in HistoryAudit and printed.
+STATE_NAME = 'HistoryVerifier'
+VERIFY_INTERVAL = float(os.environ.get('HISTORY_VERIFIER_INTERVAL', '3600'))
+VERIFY_BATCH = int(os.environ.get('HISTORY_VERIFIER_BATCH', '500'))
+LEASE_POLL = indexer.LEASE_SECONDS / 3
+
+
+def verify_chain(histories: list) -> tuple:
+    """
+    Walks one token's History rows in history_id order. A row without chain_hash counts as tampered: migration 3
+    hashed every row, and writers always hash theirs.
+
+    :return: (broken row or None, reason or None)
+    """
+    prev_hash = None
+    previous_to = None
+
+    for n, history in enumerate(histories):
+        expected = row_hash(prev_hash, history)
+
+        if history.chain_hash != expected:
+            return history, TAMPERED
+
+        prev_hash = expected
+        if history.tx_status == models.TX_FAILED:
+            continue
+
+        if n > 0 and history.token_from != previous_to:
+            return history, 'Sender and receiver does not match.'
+
+        previous_to = history.token_to
+
+    return None, None
+
+
+async def verify_batch(db: AsyncSession, after: int) -> tuple:
+    """
+    Verifies the chains of the next VERIFY_BATCH tokens after token id `after` and updates HistoryAudit for them.
+
+    :return: (last token id of the batch or None when done, number of broken chains)
+    """
+    token_ids = (await db.scalars(select(models.History.token_id).distinct()
+                                  .filter(models.History.token_id > after)
+                                  .order_by(models.History.token_id)
+                                  .limit(VERIFY_BATCH))).all()
+    if not token_ids:
+        return None, 0
+
+    histories = (await db.scalars(select(models.History)
+                                  .filter(models.History.token_id.in_(token_ids))
+                                  .order_by(models.History.token_id, models.History.history_id))).all()
+    by_token = {}
+    for history in histories:
+        by_token.setdefault(history.token_id, []).append(history)
+
+    audits = {audit.token_id: audit for audit in await db.scalars(select(models.HistoryAudit)
+                                                                  .filter(models.HistoryAudit.token_id.in_(token_ids)))}
+    broken_count = 0
+
+    for token_id in token_ids:
+        broken, detail = verify_chain(by_token[token_id])
+        audit = audits.get(token_id)
+
+        if broken is None:
+            if audit is not None:
+                await db.delete(audit)
+            continue
+
+        broken_count += 1
+        if audit is None or audit.history_id != broken.history_id or audit.detail != detail:
+            print(f'History verifier: token {token_id} broken at history {broken.history_id}: {detail}')
+
+        if audit is None:
+            db.add(models.HistoryAudit(token_id=token_id, history_id=broken.history_id, detail=detail,
+                                       detected_at=datetime.datetime.utcnow()))
+        elif audit.history_id != broken.history_id or audit.detail != detail:
+            audit.history_id = broken.history_id
+            audit.detail = detail
+            audit.detected_at = datetime.datetime.utcnow()
+
+    await db.commit()
+    return token_ids[-1], broken_count
+
+
+async def verify_all(db: AsyncSession) -> None:
+    started = time.monotonic()
+    after = -1
+    broken = 0
+
+    while True:
+        if not await indexer.acquire_lease(db, STATE_NAME):
+            print('History verifier: lease lost, stopping this run')
+            return
+
+        last, broken_in_batch = await verify_batch(db, after)
+        if last is None:
+            break
+
+        broken += broken_in_batch
+        after = last
+
+    print(f'History verifier: finished in {time.monotonic() - started:.1f}s, {broken} broken chain(s)')
+
+
+async def run_verifier() -> None:
+    last_run = None
+
+    while True:
+        async with DB.AsyncSessionLocal() as db:
+            try:
+                await indexer.ensure_sync_state(db, STATE_NAME)
+                if await indexer.acquire_lease(db, STATE_NAME):
+                    if last_run is None or time.monotonic() - last_run >= VERIFY_INTERVAL:
+                        last_run = time.monotonic()
+                        await verify_all(db)
+                else:
+                    # Another worker verifies. Run right away if this worker takes over later.
+                    last_run = None
+            except Exception as e:
+                print(f'History verifier error: {e}')
+                await db.rollback()
+
+        await asyncio.sleep(LEASE_POLL)
+
+
+async def start_verifier() -> None:
+    if os.environ.get('HISTORY_VERIFIER_ENABLED', '1') == '0':
+        print('History verifier disabled')
+        return
+
+    asyncio.ensure_future(run_verifier())
@@ -0,0 +1,4 @@
+import os
+
+# database.DB builds its engines at import. The tests create their own SQLite databases.
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
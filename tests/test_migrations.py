@@ -0,0 +1,107 @@
+import datetime
+
+import pytest
+from sqlalchemy import create_engine, select
+
+from database import migrate
+from database.history_chain import row_hash
+from database.migrations import v000_core_tables
+
+MANUFACTURER = '0x7E5F4552091A69125d5DfCb7b8C2659029395Bdf'
+RESELLER = '0x2B5AD5c4795c026514f8317c7a215E218DcCD6cF'
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f'sqlite:///{tmp_path / "migrate.db"}')
+    yield engine
+    engine.dispose()
+
+
+def populate_v000(engine, tokens: list, histories: list) -> None:
+    """
+    Writes rows the way the server did before migrations existed.
+
+    :param tokens: Stored token ids
+    :param histories: (token_id, token_from, token_to) in insertion order
+    """
+    token, history = (table for table in v000_core_tables.TABLES if table.name in ('Token', 'History'))
+    event_time = datetime.datetime(2022, 1, 1, 12, 0, 0)
+
+    with engine.begin() as conn:
+        for token_id in tokens:
+            conn.execute(token.insert().values(token_id=token_id, brand='b', product_name='p',
+                                               production_date=datetime.date(2022, 1, 1),
+                                               expiration_date=datetime.date(2024, 1, 1), details='d'))
+        for n, (token_id, token_from, token_to) in enumerate(histories):
+            conn.execute(history.insert().values(token_id=token_id, token_from=token_from, token_to=token_to,
+                                                 event_time=event_time + datetime.timedelta(seconds=n)))
+
+
+def history_chains(engine) -> dict:
+    """
+    :return: {token_id: [History rows in history_id order]}
+    """
+    history = migrate.models.History.__table__
+    with engine.connect() as conn:
+        rows = conn.execute(select(history).order_by(history.c.token_id, history.c.history_id)).all()
+
+    chains = {}
+    for row in rows:
+        chains.setdefault(row.token_id, []).append(row)
+    return chains
+
+
+def assert_linked(chain: list) -> None:
+    prev_hash = None
+    for row in chain:
+        assert row.prev_hash == prev_hash
+        assert row.chain_hash == row_hash(prev_hash, row)
+        prev_hash = row.chain_hash
+
+
+def test_upgrade_populated_v000_database(engine):
+    migrate.upgrade(engine, 0)
+    populate_v000(engine, [1, 2], [(1, None, MANUFACTURER), (2, None, MANUFACTURER)])
+
+    migrate.upgrade(engine)
+
+    assert all(applied for _, _, applied in migrate.status(engine))
+    chains = history_chains(engine)
+    assert sorted(chains) == [0, 1]
+    for chain in chains.values():
+        assert_linked(chain)
+
+
+def test_downgrade_to_v000_and_upgrade_again(engine):
+    migrate.upgrade(engine, 0)
+    populate_v000(engine, [1], [(1, None, MANUFACTURER)])
+    migrate.upgrade(engine)
+
+    migrate.downgrade(engine, 0)
+    migrate.upgrade(engine)
+
+    chains = history_chains(engine)
+    assert sorted(chains) == [0]
+    assert_linked(chains[0])
+
+
+def test_legacy_mints_move_to_their_real_token_ids(engine):
+    migrate.upgrade(engine, 0)
+    # Legacy mints of tokens 0 and 1 were stored at 1 and 2; the transfer of token 1 used its real id
+    populate_v000(engine, [1, 2], [(1, None, MANUFACTURER), (2, None, MANUFACTURER), (1, MANUFACTURER, RESELLER)])
+
+    migrate.upgrade(engine)
+
+    chains = history_chains(engine)
+    assert [(row.token_from, row.token_to) for row in chains[0]] == [(None, MANUFACTURER)]
+    assert [(row.token_from, row.token_to) for row in chains[1]] == [(None, MANUFACTURER), (MANUFACTURER, RESELLER)]
+    assert 2 not in chains
+    for chain in chains.values():
+        assert_linked(chain)
+
+    migrate.downgrade(engine, 5)
+
+    chains = history_chains(engine)
+    assert [(row.token_from, row.token_to) for row in chains[1]] == [(None, MANUFACTURER), (MANUFACTURER, RESELLER)]
+    assert [(row.token_from, row.token_to) for row in chains[2]] == [(None, MANUFACTURER)]
@@ -1,3 +1,5 @@
+from typing import List, Optional
+
 from pydantic import BaseModel
 
 
@@ -12,3 +14,8 @@ class TokenWithOwner(BaseModel):
 
 class TokenOnly(BaseModel):
     tid: int
+
+
+class TicketBatch(BaseModel):
+    tickets: List[TokenWithOwner]
+    ttl: Optional[int] = None  # seconds each ticket stays valid, capped by TICKET_MAX_TTL
@@ -0,0 +1,87 @@
+"""
+Signing keys for ownership tickets (the JWTs inside QR codes), parsed once at import.
+
+SIGNING_KEYS holds comma-separated base64 PEM private keys. The first key signs. The others are retired keys that are
+still published at /tokens/keys, so tickets they signed keep verifying until they expire. Without SIGNING_KEYS the
+PRIVATE_KEY RSA key is used. The algorithm follows the key type: RSA signs RS256, Ed25519 signs EdDSA (much faster to
+sign and verify, and a smaller QR code), P-256 signs ES256. Every ticket names its key in the `kid` header.
+
+    openssl genpkey -algorithm ed25519 | base64 -w0   # a new key for SIGNING_KEYS
+"""
+import base64
+import hashlib
+import os
+import sys
+
+import jwt
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec, ed25519, rsa
+
+signing_keys_env = os.environ.get('SIGNING_KEYS') or os.environ.get('PRIVATE_KEY')
+
+if signing_keys_env is None:
+    print('Signing Key Environment Variable Missing!!')
+    sys.exit(1)
+
+
+class SigningKey:
+    __slots__ = ('kid', 'algorithm', 'private_key', 'public_key')
+
+    def __init__(self, encoded: str):
+        """
+        :param encoded: base64 encoded PEM private key, like PRIVATE_KEY
+        """
+        self.private_key = serialization.load_pem_private_key(base64.b64decode(encoded), password=None)
+
+        if isinstance(self.private_key, rsa.RSAPrivateKey):
+            self.algorithm = 'RS256'
+        elif isinstance(self.private_key, ed25519.Ed25519PrivateKey):
+            self.algorithm = 'EdDSA'
+        elif isinstance(self.private_key, ec.EllipticCurvePrivateKey) and self.private_key.curve.name == 'secp256r1':
+            self.algorithm = 'ES256'
+        else:
+            raise ValueError(f'Unsupported signing key type: {type(self.private_key).__name__}')
+
+        public_der = self.private_key.public_key().public_bytes(serialization.Encoding.DER,
+                                                                serialization.PublicFormat.SubjectPublicKeyInfo)
+        public_pem = self.private_key.public_key().public_bytes(serialization.Encoding.PEM,
+                                                                serialization.PublicFormat.SubjectPublicKeyInfo)
+
+        # Derived from the key itself, so every worker and every deploy agrees on it without configuration
+        self.kid = hashlib.sha256(public_der).hexdigest()[:16]
+        self.public_key = base64.b64encode(public_pem).decode('utf-8')
+
+    def to_dict(self) -> dict:
+        return {'kid': self.kid, 'alg': self.algorithm, 'public_key': self.public_key}
+
+
+class KeyManager:
+    def __init__(self, keys: list):
+        if not keys:
+            raise ValueError('no signing key given')
+
+        kids = [key.kid for key in keys]
+        if len(set(kids)) != len(kids):
+            raise ValueError('SIGNING_KEYS contains the same key twice')
+
+        self.keys = keys
+        self.active = keys[0]
+
+    def sign(self, payload: dict) -> str:
+        return jwt.encode(payload, key=self.active.private_key, algorithm=self.active.algorithm,
+                          headers={'kid': self.active.kid})
+
+    def sign_many(self, payloads: list) -> list:
+        # One executor hop for a whole batch instead of one per ticket
+        return [self.sign(payload) for payload in payloads]
+
+    def public_keys(self) -> list:
+        return [key.to_dict() for key in self.keys]
+
+
+try:
+    key_manager = KeyManager([SigningKey(encoded.strip()) for encoded in signing_keys_env.split(',')
+                              if encoded.strip()])
+except (ValueError, TypeError) as e:
+    print(f'Signing key could not be loaded: {e}')
+    sys.exit(1)
@@ -0,0 +1,181 @@
+import json
+import os
+import sys
+from collections import OrderedDict
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import DB, models
+
+# Token ids per `IN (...)` query. Keeps each statement well below MySQL's max_allowed_packet.
+LOOKUP_CHUNK_SIZE = int(os.environ.get('TOKEN_LOOKUP_CHUNK_SIZE', '1000'))
+
+# /tokens/tokenInfo requests with more ids than this are streamed instead of built in memory
+STREAM_THRESHOLD = int(os.environ.get('TOKEN_INFO_STREAM_THRESHOLD', '1000'))
+
+# Token rows are written once at mint and never updated, so cached entries never go stale.
+TOKEN_CACHE_SIZE = int(os.environ.get('TOKEN_CACHE_SIZE', '10000'))
+
+# Redis shared by all gunicorn workers, e.g. redis://10.0.0.3:6379/0. Deploys set it through app.yaml; without it
+# each worker only keeps its own in-process cache.
+token_cache_url_env = os.environ.get('TOKEN_CACHE_URL')
+TOKEN_CACHE_TTL = int(os.environ.get('TOKEN_CACHE_TTL', '86400'))
+
+if token_cache_url_env is not None:
+    try:
+        import redis.asyncio as redis
+    except ImportError:
+        print('TOKEN_CACHE_URL is set but the redis package is not installed!!')
+        sys.exit(1)
+
+
+def dump_json(content) -> str:
+    # Same encoding as JSONResponse, so streamed and buffered bodies are byte-identical
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(",", ":"))
+
+
+def token_to_dict(token: models.Token) -> dict:
+    return {"TokenID": token.token_id,
+            "Brand": token.brand,
+            "ProductName": token.product_name,
+            "ProductionDate": token.production_date.strftime("%Y-%m-%d"),
+            "ExpirationDate": token.expiration_date.strftime("%Y-%m-%d"),
+            "Details": token.details
+            }
+
+
+class TokenInfoCache:
+    """
+    Bounded LRU of token info dicts in front of the Token table, with an optional Redis tier shared across workers.
+    Only existing tokens are cached; a miss may still be minted later. Callers must not mutate the returned dicts.
+    """
+
+    def __init__(self, max_size: int, redis_url: str = None):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.remote = redis.from_url(redis_url) if redis_url else None
+        self.hits = 0
+        self.remote_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def remote_key(token_id: int) -> str:
+        # v2: migration 6 moved tokens minted before receipt tracking to their real ids
+        return f'token:v2:{token_id}'
+
+    def store_local(self, token_id: int, info: dict) -> None:
+        self.entries[token_id] = info
+        self.entries.move_to_end(token_id)
+
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    async def get_many(self, token_ids: list) -> dict:
+        """
+        :return: {token_id: token info dict} for the cached ids. Counts one hit or miss per id.
+        """
+        found = {}
+        for token_id in token_ids:
+            info = self.entries.get(token_id)
+            if info is not None:
+                self.entries.move_to_end(token_id)
+                found[token_id] = info
+
+        self.hits += len(found)
+        missing = [token_id for token_id in token_ids if token_id not in found]
+
+        if self.remote is not None and missing:
+            try:
+                values = await self.remote.mget([self.remote_key(token_id) for token_id in missing])
+            except Exception as e:
+                # Fall back to the database while Redis is unreachable
+                print(f'Token cache error: {e}')
+                values = [None] * len(missing)
+
+            for token_id, value in zip(missing, values):
+                if value is not None:
+                    info = json.loads(value)
+                    self.store_local(token_id, info)
+                    found[token_id] = info
+                    self.remote_hits += 1
+
+        self.misses += len(token_ids) - len(found)
+        return found
+
+    async def put_many(self, infos: dict) -> None:
+        for token_id, info in infos.items():
+            self.store_local(token_id, info)
+
+        if self.remote is not None and infos:
+            try:
+                async with self.remote.pipeline(transaction=False) as pipe:
+                    for token_id, info in infos.items():
+                        pipe.set(self.remote_key(token_id), dump_json(info), ex=TOKEN_CACHE_TTL)
+                    await pipe.execute()
+            except Exception as e:
+                print(f'Token cache error: {e}')
+
+    def stats(self) -> dict:
+        return {'size': len(self.entries),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'remote_hits': self.remote_hits,
+                'misses': self.misses,
+                'shared': self.remote is not None}
+
+
+token_cache = TokenInfoCache(TOKEN_CACHE_SIZE, token_cache_url_env)
+
+
+async def fetch_tokens(db: AsyncSession, token_ids: list) -> dict:
+    """
+    Looks token ids up in token_cache, then loads the rest with one `IN (...)` query per LOOKUP_CHUNK_SIZE ids.
+
+    :return: {token_id: token info dict} for the ids that exist
+    """
+    unique_ids = list(dict.fromkeys(token_ids))
+    found = await token_cache.get_many(unique_ids)
+    unique_ids = [token_id for token_id in unique_ids if token_id not in found]
+
+    for start in range(0, len(unique_ids), LOOKUP_CHUNK_SIZE):
+        chunk = unique_ids[start:start + LOOKUP_CHUNK_SIZE]
+        rows = await db.scalars(select(models.Token).filter(models.Token.token_id.in_(chunk)))
+        loaded = {token.token_id: token_to_dict(token) for token in rows}
+
+        await token_cache.put_many(loaded)
+        found.update(loaded)
+
+    return found
+
+
+async def load_token_infos(db: AsyncSession, token_ids: list) -> tuple:
+    """
+    :return: (token info dicts in request order, ids that have no Token row, in request order)
+    """
+    found = await fetch_tokens(db, token_ids)
+    missing = set(token_ids) - found.keys()
+
+    return [found[tid] for tid in token_ids if tid in found], [tid for tid in token_ids if tid in missing]
+
+
+async def stream_token_infos(token_ids: list):
+    """
+    Yields the /tokens/tokenInfo JSON body piece by piece, one lookup chunk at a time, so only the ids and one chunk
+    of rows are held in memory. Uses its own session because it runs after the handler has returned.
+    """
+    not_founded = []
+    separator = ''
+
+    yield '{"tokenInfo":['
+
+    async with DB.AsyncSessionLocal() as db:
+        for start in range(0, len(token_ids), LOOKUP_CHUNK_SIZE):
+            infos, missing = await load_token_infos(db, token_ids[start:start + LOOKUP_CHUNK_SIZE])
+            not_founded.extend(missing)
+
+            for info in infos:
+                yield separator + dump_json(info)
+                separator = ','
+
+    yield '],"NotFounded":' + dump_json(not_founded) + '}'
@@ -0,0 +1,207 @@
+import asyncio
+import base64
+import io
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import qrcode
+
+from node.stats import latency_ms
+
+# QR rendering is pure CPU work, so it runs in worker processes instead of threads that would hold the GIL and
+# stall the event loop. Every gunicorn worker owns its own pool.
+QR_RENDER_WORKERS = int(os.environ.get('QR_RENDER_WORKERS', '1'))
+
+# Renders queued or running per gunicorn worker. Requests beyond this are refused instead of piling up.
+QR_RENDER_QUEUE = int(os.environ.get('QR_RENDER_QUEUE', '16'))
+
+# Samples kept per format for /tokens/qrStats
+QR_STATS_WINDOW = int(os.environ.get('QR_STATS_WINDOW', '1000'))
+
+PNG = 'png'
+SVG = 'svg'
+JWT = 'jwt'
+JSON = 'json'
+
+FORMATS = (PNG, SVG, JWT, JSON)
+
+MEDIA_TYPES = {
+    PNG: 'image/png',
+    SVG: 'image/svg+xml',
+    JWT: 'application/jwt',
+}
+
+ACCEPTED_TYPES = {
+    'image/png': PNG,
+    'image/svg+xml': SVG,
+    'application/jwt': JWT,
+    'text/plain': JWT,
+    'application/json': JSON,
+}
+
+
+class QueueFull(Exception):
+    pass
+
+
+def negotiate_format(requested: str, accept: str) -> str:
+    """
+    Picks the response format from an explicit `format` query parameter, then from the Accept header. Clients that
+    send neither, or only */*, keep getting the JSON body with a base64 PNG data URL.
+
+    :return: One of FORMATS, or None if nothing acceptable was asked for
+    """
+    if requested:
+        return requested.lower() if requested.lower() in FORMATS else None
+
+    if not accept:
+        return JSON
+
+    ranked = []
+    for n, part in enumerate(accept.split(',')):
+        media_type, *params = [value.strip() for value in part.split(';')]
+        quality = 1.0
+        for param in params:
+            if param.startswith('q='):
+                try:
+                    quality = float(param[2:])
+                except ValueError:
+                    quality = 0.0
+
+        if quality > 0 and (media_type in ACCEPTED_TYPES or media_type in ('*/*', 'image/*')):
+            ranked.append((-quality, n, media_type))
+
+    for _, _, media_type in sorted(ranked):
+        if media_type == '*/*':
+            return JSON
+        if media_type == 'image/*':
+            return PNG
+        return ACCEPTED_TYPES[media_type]
+
+    return None
+
+
+def render(data: str, output: str) -> tuple:
+    """
+    Renders `data` as a QR code. Runs in a pool process.
+
+    :param output: SVG, otherwise PNG
+    :return: (image bytes, CPU seconds spent)
+    """
+    started = time.process_time()
+
+    qr_code = qrcode.QRCode(
+        version=None,
+        error_correction=qrcode.constants.ERROR_CORRECT_M,
+        box_size=6,
+        border=4
+    )
+
+    qr_code.add_data(data)
+    qr_code.make(fit=True)
+
+    if output == SVG:
+        return svg_image(qr_code.get_matrix()), time.process_time() - started
+
+    byte_stream = io.BytesIO()
+    img = qr_code.make_image(fill_color="black", back_color="white")
+    img.save(stream=byte_stream, format="PNG")
+
+    return byte_stream.getvalue(), time.process_time() - started
+
+
+def svg_image(matrix: list) -> bytes:
+    """
+    Draws the module matrix (border included) as one path of horizontal runs in module units. qrcode's own SVG
+    factories write every module with absolute millimetre coordinates, which is several times larger.
+    """
+    size = len(matrix)
+    runs = []
+
+    for y, row in enumerate(matrix):
+        x = 0
+        while x < size:
+            if not row[x]:
+                x += 1
+                continue
+
+            start = x
+            while x < size and row[x]:
+                x += 1
+            runs.append(f'M{start} {y}h{x - start}v1h-{x - start}z')
+
+    return (f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 {size} {size}" shape-rendering="crispEdges">'
+            f'<rect width="{size}" height="{size}" fill="#fff"/><path d="{"".join(runs)}"/></svg>').encode('utf-8')
+
+
+def to_data_url(png: bytes) -> str:
+    return "data:image/png;base64," + base64.b64encode(png).decode('utf-8')
+
+
+class QrRenderer:
+    """
+    Bounded process pool for QR rendering, plus latency and CPU samples per output format. The pool is created on
+    first use, so it is forked from the gunicorn worker that uses it and not from the master.
+    """
+
+    def __init__(self, workers: int, max_pending: int, window: int):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.pool = None
+        self.pending = 0
+        self.refused = 0
+        self.samples = {output: deque(maxlen=window) for output in FORMATS}
+
+    def get_pool(self) -> ProcessPoolExecutor:
+        if self.pool is None:
+            self.pool = ProcessPoolExecutor(max_workers=self.workers)
+        return self.pool
+
+    def shutdown(self) -> None:
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+
+    async def render(self, data: str, output: str) -> tuple:
+        """
+        :return: (image bytes, CPU seconds spent in the pool process)
+        """
+        if self.pending >= self.max_pending:
+            self.refused += 1
+            raise QueueFull()
+
+        self.pending += 1
+        try:
+            loop = asyncio.get_event_loop()
+            return await loop.run_in_executor(self.get_pool(), render, data, output)
+        except BrokenProcessPool:
+            # A pool process died (e.g. killed for memory). Start a fresh pool for the next request.
+            self.pool = None
+            raise
+        finally:
+            self.pending -= 1
+
+    def record(self, output: str, latency: float, cpu: float) -> None:
+        self.samples[output].append((latency, cpu))
+
+    def stats(self) -> dict:
+        result = {'workers': self.workers, 'pending': self.pending, 'maxPending': self.max_pending,
+                  'refused': self.refused}
+
+        for output, samples in self.samples.items():
+            if not samples:
+                continue
+
+            result[output] = {
+                'samples': len(samples),
+                'latencyMs': latency_ms([latency for latency, _ in samples]),
+                'cpuMs': {'avg': round(sum(cpu for _, cpu in samples) / len(samples) * 1000, 3)},
+            }
+
+        return result
+
+
+qr_renderer = QrRenderer(QR_RENDER_WORKERS, QR_RENDER_QUEUE, QR_STATS_WINDOW)
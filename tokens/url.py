@@ -1,31 +1,77 @@
-import base64
 import datetime
-import io
 import json
 import os
+import time
 from json import JSONDecodeError
 from typing import Optional
 
-import jwt
-import qrcode
-from fastapi import APIRouter, Depends, Header
-from fastapi.responses import JSONResponse
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, Header, Query
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from web3 import Web3
 
 from database import DB, models
+from node.chain import contract_instance, w3
 from node.DataClass import Validation
-from node.url import validate_login_token, invalid_login_token_exception, validate_token
-from tokens.DataClass import TokenList, TokenWithOwner, TokenOnly
+from node.executor import run_blocking
+from node.multicall import aggregate
+from node.url import validate_login_token, invalid_login_token_exception, validate_token, check_ownerships, \
+    invalid_permission_exception, node_sync_exception
+from tokens.DataClass import TokenList, TokenWithOwner, TokenOnly, TicketBatch
+from tokens.keys import key_manager
+from tokens.metadata import STREAM_THRESHOLD, fetch_tokens, load_token_infos, stream_token_infos, token_cache
+from tokens.qr import JSON, JWT, MEDIA_TYPES, QueueFull, negotiate_format, qr_renderer, to_data_url
 
 token_router = APIRouter()
 
-private_key_env = base64.b64decode(os.environ.get('PRIVATE_KEY'))
+# Seconds a QR code shown on screen stays valid
+QR_TICKET_TTL = int(os.environ.get('QR_TICKET_TTL', '15'))
+
+# Tickets issued in bulk are printed on warranty cards, so they may live longer than on-screen QR codes. A ticket
+# keeps verifying after the token changes hands until it expires, so the cap is one day.
+TICKET_MAX_TTL = int(os.environ.get('TICKET_MAX_TTL', str(24 * 3600)))
+
+# Accounts that may issue tickets in bulk
+TICKET_ISSUER_TYPES = ('manufacturer', 'reseller')
+TICKET_BATCH_LIMIT = int(os.environ.get('TICKET_BATCH_LIMIT', '500'))
+
+
+def sign_ownership(payload: dict) -> tuple:
+    """
+    Signs the ownership payload that the QR code carries. Runs in the blocking executor.
+
+    :return: (JWT, CPU seconds spent)
+    """
+    started = time.thread_time()
+    encoded_jwt = key_manager.sign(payload)
+
+    return encoded_jwt, time.thread_time() - started
+
+
+def ownership_payload(tid: int, owner: str, ttl: int) -> dict:
+    return {
+        "tid": tid,
+        "owner": owner,
+        "exp": datetime.datetime.utcnow() + datetime.timedelta(seconds=ttl)
+    }
+
+
+def server_timing(latency: float, cpu: float) -> dict:
+    return {'Server-Timing': f'qr;dur={latency * 1000:.3f}, cpu;dur={cpu * 1000:.3f}', 'Cache-Control': 'no-store'}
+
+
+@token_router.on_event("shutdown")
+def stop_qr_renderer():
+    qr_renderer.shutdown()
 
 
 @token_router.post("/manufacturer")
-async def get_manufacturer_address(body : TokenOnly, db: Session = Depends(DB.get_db)) -> JSONResponse:
+async def get_manufacturer_address(body : TokenOnly, db: AsyncSession = Depends(DB.get_db)) -> JSONResponse:
     token_id = body.tid
-    history = db.query(models.History).filter(models.History.token_id == token_id).first()
+    history = (await db.scalars(select(models.History)
+                                .filter(models.History.token_id == token_id)
+                                .order_by(models.History.history_id))).first()
 
     if not history:
         return JSONResponse(
@@ -34,7 +80,8 @@ async def get_manufacturer_address(body : TokenOnly, db: Session = Depends(DB.ge
         )
 
     try:
-        minter = db.query(models.User).filter(models.User.user_wallet == history.token_to).first()
+        minter = (await db.scalars(select(models.User)
+                                   .filter(models.User.user_wallet == history.token_to))).first()
     except AttributeError:
         return JSONResponse(
             status_code=503,
@@ -55,24 +102,13 @@ async def get_manufacturer_address(body : TokenOnly, db: Session = Depends(DB.ge
 
 
 @token_router.post("/tokenInfo")
-async def load_token_info(body: TokenList, db: Session = Depends(DB.get_db)) -> JSONResponse:
+async def load_token_info(body: TokenList, db: AsyncSession = Depends(DB.get_db)) -> JSONResponse:
     token_list = body.token_list
-    token_infos = []
-    not_founded = []
-
-    for tokenID in token_list:
-        token = db.query(models.Token).filter(models.Token.token_id == tokenID).first()
-        if token is not None:
-            tokenInfo = {"TokenID": token.token_id,
-                         "Brand": token.brand,
-                         "ProductName": token.product_name,
-                         "ProductionDate": token.production_date.strftime("%Y-%m-%d"),
-                         "ExpirationDate": token.expiration_date.strftime("%Y-%m-%d"),
-                         "Details": token.details
-                         }
-            token_infos.append(tokenInfo)
-        else:
-            not_founded.append(tokenID)
+
+    if len(token_list) > STREAM_THRESHOLD:
+        return StreamingResponse(stream_token_infos(token_list), media_type="application/json")
+
+    token_infos, not_founded = await load_token_infos(db, token_list)
 
     return JSONResponse(
         status_code=200,
@@ -83,10 +119,40 @@ async def load_token_info(body: TokenList, db: Session = Depends(DB.get_db)) ->
     )
 
 
+@token_router.get("/cacheStats")
+async def get_cache_stats() -> JSONResponse:
+    return JSONResponse(
+        status_code=200,
+        content={'result': token_cache.stats()}
+    )
+
+
+@token_router.get("/qrStats")
+async def get_qr_stats() -> JSONResponse:
+    return JSONResponse(
+        status_code=200,
+        content={'result': qr_renderer.stats()}
+    )
+
+
 @token_router.post("/create_qr")
-async def create_qr_code(body: TokenWithOwner, db: Session = Depends(DB.get_db),
-                         x_access_token: Optional[str] = Header(None)) -> JSONResponse:
-    token_validity = validate_login_token(x_access_token)
+async def create_qr_code(body: TokenWithOwner, db: AsyncSession = Depends(DB.get_db),
+                         x_access_token: Optional[str] = Header(None), accept: Optional[str] = Header(None),
+                         output: Optional[str] = Query(None, alias='format')) -> Response:
+    """
+    Returns the ownership QR code as image/png, image/svg+xml or the raw signed JWT (application/jwt) for clients
+    that draw the code themselves, chosen by ?format=png|svg|jwt|json or the Accept header. The default stays the
+    JSON body with a base64 PNG data URL.
+    """
+    output = negotiate_format(output, accept)
+
+    if output is None:
+        return JSONResponse(
+            status_code=406,
+            content={'error': 'Supported formats: png, svg, jwt, json'}
+        )
+
+    token_validity = await validate_login_token(x_access_token)
 
     if token_validity.get('result', 'invalid') == 'invalid':
         return invalid_login_token_exception()
@@ -97,39 +163,40 @@ async def create_qr_code(body: TokenWithOwner, db: Session = Depends(DB.get_db),
         if json.loads(result.body.decode('utf-8')).get('result') == 'valid':
             # Successful. Generating QR code.
 
-            payload = {
-                    "tid": body.tid,
-                    "owner": body.owner,
-                    "exp": datetime.datetime.utcnow() + datetime.timedelta(seconds=15)
-            }
-            encoded_jwt = jwt.encode(payload, key=private_key_env, algorithm="RS256")
-
-            qr_code = qrcode.QRCode(
-                version=None,
-                error_correction=qrcode.constants.ERROR_CORRECT_M,
-                box_size=6,
-                border=4
-            )
+            payload = ownership_payload(body.tid, body.owner, QR_TICKET_TTL)
 
-            qr_code.add_data(encoded_jwt)
-            qr_code.make(fit=True)
+            started = time.perf_counter()
+            encoded_jwt, cpu = await run_blocking(sign_ownership, payload)
 
-            byte_stream = io.BytesIO()
-            img = qr_code.make_image(fill_color="black", back_color="white")
-            img.save(stream=byte_stream, format="PNG")
+            if output == JWT:
+                image = encoded_jwt.encode('utf-8')
+            else:
+                image, render_cpu = await qr_renderer.render(encoded_jwt, output)
+                cpu += render_cpu
 
-            base64_converted = base64.b64encode(byte_stream.getvalue())
+            latency = time.perf_counter() - started
+            qr_renderer.record(output, latency, cpu)
 
-            return JSONResponse(
-                status_code=200,
-                content={'result': "data:image/png;base64," + base64_converted.decode('utf-8')}
-            )
+            if output == JSON:
+                return JSONResponse(
+                    status_code=200,
+                    content={'result': to_data_url(image)},
+                    headers=server_timing(latency, cpu)
+                )
+
+            return Response(content=image, media_type=MEDIA_TYPES[output], headers=server_timing(latency, cpu))
         else:
             return JSONResponse(
                 status_code=404,
                 content={'error': 'Invalid request. Do you own the token?'}
             )
 
+    except QueueFull:
+        return JSONResponse(
+            status_code=503,
+            content={'error': 'Too many QR codes being generated. Please try again.'},
+            headers={'Retry-After': '1'}
+        )
     except (UnicodeDecodeError, JSONDecodeError):
         return JSONResponse(
             status_code=503,
@@ -141,3 +208,99 @@ async def create_qr_code(body: TokenWithOwner, db: Session = Depends(DB.get_db),
             status_code=503,
             content={'error': 'Unknown error. Please try again.'}
         )
+
+
+@token_router.get("/keys")
+async def get_signing_keys() -> JSONResponse:
+    """
+    :return: Public keys that ownership tickets may be signed with. Pick the one named by the ticket's `kid` header.
+    """
+    return JSONResponse(
+        status_code=200,
+        content={'active': key_manager.active.kid, 'keys': key_manager.public_keys()}
+    )
+
+
+def invalid_ticket_batch_exception() -> JSONResponse:
+    return JSONResponse(
+        status_code=400,
+        content={'error': f'Give 1 to {TICKET_BATCH_LIMIT} tickets and a ttl of 1 to {TICKET_MAX_TTL} seconds.'}
+    )
+
+
+@token_router.post("/tickets")
+async def issue_tickets(body: TicketBatch, db: AsyncSession = Depends(DB.get_db),
+                        x_access_token: Optional[str] = Header(None)) -> JSONResponse:
+    """
+    Issues signed ownership tickets (the JWT of /create_qr?format=jwt) for many (tid, owner) pairs at once, e.g. for
+    kiosks printing warranty cards. Only manufacturer and reseller accounts may issue them, for tokens held by their
+    own wallet or approved to it. Every pair is validated like /node/validate; pairs that fail get an `error` instead
+    of a `ticket`, in the order they were given.
+    """
+    token_validity = await validate_login_token(x_access_token)
+
+    if token_validity.get('result', 'invalid') == 'invalid':
+        return invalid_login_token_exception()
+
+    issuer = (await db.scalars(select(models.User)
+                               .filter(models.User.user_id == token_validity['token']['uid']))).first()
+
+    if not issuer or issuer.user_type not in TICKET_ISSUER_TYPES:
+        return invalid_permission_exception()
+
+    ttl = body.ttl if body.ttl is not None else QR_TICKET_TTL
+
+    if not 0 < len(body.tickets) <= TICKET_BATCH_LIMIT or not 0 < ttl <= TICKET_MAX_TTL:
+        return invalid_ticket_batch_exception()
+
+    results = []
+    for ticket in body.tickets:
+        try:
+            owner = Web3.toChecksumAddress(ticket.owner)
+        except ValueError:
+            results.append({'tid': ticket.tid, 'owner': ticket.owner, 'error': 'Address is not valid.'})
+            continue
+
+        results.append({'tid': ticket.tid, 'owner': owner, 'error': None})
+
+    # Tokens of other wallets need an approval to the issuer, all read at one block
+    delegated = [result for result in results if result['error'] is None and result['owner'] != issuer.user_wallet]
+    if delegated:
+        try:
+            _, approvals = await aggregate(w3, [contract_instance.functions.getApproved(result['tid'])
+                                                for result in delegated])
+        except Exception as e:
+            print(f'Error: {e}')
+            return node_sync_exception()
+
+        for result, approved in zip(delegated, approvals):
+            if approved.get('result') != issuer.user_wallet:
+                result['error'] = 'Not authorized for this token.'
+
+    # One set of custody queries for all tokens instead of one per ticket
+    checked = [result for result in results if result['error'] is None]
+    ownerships = await check_ownerships(db, [(result['tid'], result['owner']) for result in checked])
+    for result, (_, detail) in zip(checked, ownerships):
+        result['error'] = detail
+
+    # One lookup for all tokens instead of one per ticket
+    token_infos = await fetch_tokens(db, list({result['tid'] for result in results if result['error'] is None}))
+
+    issued = []
+    for result in results:
+        if result['error'] is None and result['tid'] not in token_infos:
+            result['error'] = 'Token not found from the server.'
+
+        if result['error'] is None:
+            del result['error']
+            issued.append(result)
+
+    tickets = await run_blocking(key_manager.sign_many,
+                                 [ownership_payload(result['tid'], result['owner'], ttl) for result in issued])
+    for result, ticket in zip(issued, tickets):
+        result['ticket'] = ticket
+
+    return JSONResponse(
+        status_code=200,
+        content={'kid': key_manager.active.kid, 'issued': len(issued), 'result': results}
+    )